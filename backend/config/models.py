@@ -1,5 +1,7 @@
 #models.py
 
+from typing import Literal, Optional
+
 from pydantic import BaseModel, Field
 
 
@@ -42,4 +44,8 @@ class TemplateSettings(BaseModel):
     rxs: int
     transmitter: TransmitterSettings
     receiver: ReceiverSettings
-    antenna: AntennaSettings
\ No newline at end of file
+    antenna: AntennaSettings
+    engine: Optional[Literal["cloudrf", "local"]] = Field(
+        default=None,
+        description="Motor de propagação do template (None = SIM_ENGINE_PADRAO)"
+    )
@@ -2,7 +2,7 @@
 
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import Field, HttpUrl, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -109,6 +109,27 @@ class AppSettings(BaseSettings):
     CLOUDRF_API_KEY: Optional[str] = None
     CLOUDRF_API_URL: HttpUrl = Field(default="https://api.cloudrf.com/area")
     HTTP_TIMEOUT: float = 60.0
+    HTTP_HTTP2: bool = True
+    HTTP_MAX_CONNECTIONS: int = Field(
+        default=100,
+        description="Conexões máximas por host no pool HTTP compartilhado (hosts sem perfil próprio)"
+    )
+    HTTP_MAX_KEEPALIVE: int = Field(
+        default=20,
+        description="Conexões ociosas mantidas por host no pool HTTP compartilhado"
+    )
+    HTTP_KEEPALIVE_EXPIRY: float = Field(
+        default=30.0,
+        description="Segundos até fechar uma conexão ociosa do pool HTTP"
+    )
+    RATE_LIMIT_MAX_WAIT: float = Field(
+        default=120.0,
+        description="Segundos máximos na fila do limitador de um upstream antes de desistir"
+    )
+    RATE_LIMIT_MAX_RETRY_AFTER: float = Field(
+        default=30.0,
+        description="Retry-After acima deste valor (s) não é aguardado; o erro é repassado"
+    )
     LOG_LEVEL: str = "INFO"
 
     @property
@@ -124,6 +145,87 @@ class AppSettings(BaseSettings):
         default=50,
         description="Número de segmentos no cálculo do perfil de elevação"
     )
+    SIM_ELEVATION_LOCAL: bool = Field(
+        default=True,
+        description="Amostra perfis de elevação do MDT em cache (arquivos/dem_cache); a API remota vira fallback"
+    )
+    SIM_ELEVATION_INTERPOLACAO: Literal["bilinear", "cubica"] = Field(
+        default="bilinear",
+        description="Interpolação dos perfis amostrados do MDT local"
+    )
+    SIM_DEM_DOWNLOAD_CONCURRENCY: int = Field(
+        default=2, ge=1,
+        description="Downloads simultâneos de tiles SRTM (cada tile é baixado uma única vez)"
+    )
+    SIM_ELEVATION_BATCH_MAX: int = Field(
+        default=500, ge=1,
+        description="Número máximo de perfis aceitos em /elevation_profiles"
+    )
+    SIM_ELEVATION_BATCH_MAX_TILES: int = Field(
+        default=4, ge=0,
+        description="Tiles SRTM que um lote de perfis pode baixar antes de recorrer à API remota"
+    )
+    SIM_CACHE_REUSE_RADIUS_M: float = Field(
+        default=15.0,
+        description="Raio (m) para reaproveitar simulação em cache de ponto vizinho; 0 desativa "
+                    "(padrão: metade da resolução de 30 m da CloudRF)"
+    )
+    SIM_LOCK_TIMEOUT: float = Field(
+        default=180.0,
+        description="Segundos aguardando outro worker concluir a mesma simulação antes de simular por conta própria"
+    )
+    SIM_CACHE_MAX_BYTES: int = Field(
+        default=512 * 1024 * 1024,
+        description="Orçamento de disco do cache de simulações em bytes (0 = sem limite)"
+    )
+    SIM_CACHE_MAX_AGE_DAYS: float = Field(
+        default=180.0,
+        description="Idade máxima de uma simulação em cache, em dias (0 = sem limite)"
+    )
+    SIM_BATCH_CONCURRENCY: int = Field(
+        default=4,
+        description="Simulações simultâneas por requisição de /simulation/run_batch"
+    )
+    SIM_BATCH_MAX_SITES: int = Field(
+        default=50,
+        description="Número máximo de sites aceitos em um lote de simulação"
+    )
+    SIM_AREA_AMOSTRAS: int = Field(
+        default=24, ge=2,
+        description="Amostras por lado da grade usada na cobertura por área de cada pivô (n×n)"
+    )
+    SIM_AREA_FRACAO_MINIMA: float = Field(
+        default=0.5, ge=0, le=1,
+        description="Fração mínima da área do pivô coberta para considerá-lo com sinal (modo 'area')"
+    )
+    SIM_JOB_GRID_MAX_JOBS: int = Field(
+        default=32,
+        description="Jobs com grade composta de cobertura mantida em memória (LRU)"
+    )
+    SIM_JOB_GRID_MAX_CELLS: int = Field(
+        default=4_000_000,
+        description="Células máximas da grade composta de um job; acima disso a verificação é overlay a overlay"
+    )
+    SIM_JOB_GRID_MAX_TOTAL_CELLS: int = Field(
+        default=16_000_000,
+        description="Células somadas das grades de todos os jobs; acima disso as menos usadas são descartadas"
+    )
+    OVERLAY_CACHE_MAX_BYTES: int = Field(
+        default=256 * 1024 * 1024,
+        description="Orçamento (bytes) do cache em memória de máscaras/overlays decodificados (0 = desativado)"
+    )
+    SIM_ENGINE_PADRAO: Literal["cloudrf", "local"] = Field(
+        default="cloudrf",
+        description="Motor de propagação padrão: 'cloudrf' (API remota) ou 'local' (NumPy + MDT, para prévias)"
+    )
+    SIM_PROCESS_WORKERS: Optional[int] = Field(
+        default=None, ge=0,
+        description="Processos do pool de geoprocessamento pesado (None = núcleos - 1, até 4; 0 = desativado)"
+    )
+    SIM_PROCESS_MIN_CARGA: int = Field(
+        default=2_000_000,
+        description="Carga mínima (pontos × overlays ou células de MDT) para usar o pool de processos em vez de threads"
+    )
     SIM_MAX_LOS_TASKS: int = Field(
         default=64,
         description="Limite de análises de visada (LOS) simultâneas para proteger APIs externas"
@@ -0,0 +1 @@
+# backend/devtools/__init__.py
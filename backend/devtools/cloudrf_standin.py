@@ -0,0 +1,196 @@
+# backend/devtools/cloudrf_standin.py
+"""
+Stand-in local da API /area da CloudRF, para desenvolvimento offline e testes de carga.
+
+Implementa só o contrato consumido por cloudrf_service:
+    POST /area  (header "key", payload de _build_cloudrf_payload)
+        -> {"PNG_WGS84": "<url da imagem>", "bounds": [N, E, S, W], ...}
+    GET  /images/<id>.png
+
+A cobertura é sintetizada com um modelo simples de perda de percurso (dois raios:
+espaço livre até o ponto de quebra, 40 dB/déc depois) + sombreamento log-normal
+determinístico por local, usando frq/txw/txg/rxg/rxs/alturas do payload.
+
+Uso:
+    uvicorn backend.devtools.cloudrf_standin:app --port 8010
+    # no .env do backend:
+    CLOUDRF_API_URL="http://127.0.0.1:8010/area"
+    CLOUDRF_API_KEY="qualquer-coisa"
+
+Latência, erros e 429 são configuráveis por variáveis CLOUDRF_STANDIN_*.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import random
+import threading
+import uuid
+from collections import OrderedDict
+from math import cos, log10, radians
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from backend.services import signal_palette
+
+logger = logging.getLogger("irricontrol")
+
+
+class StandInSettings(BaseSettings):
+    """Comportamento do stand-in (prefixo de ambiente CLOUDRF_STANDIN_)."""
+
+    model_config = SettingsConfigDict(env_prefix="CLOUDRF_STANDIN_", env_file=".env", extra="ignore")
+
+    LATENCY_MS: float = Field(default=1500.0, description="Latência base de /area (ms)")
+    LATENCY_JITTER_MS: float = Field(default=500.0, description="Variação aleatória somada à latência (ms)")
+    ERROR_RATE: float = Field(default=0.0, ge=0, le=1, description="Fração de respostas HTTP 500")
+    RATE_LIMIT_RATE: float = Field(default=0.0, ge=0, le=1, description="Fração de respostas HTTP 429")
+    RETRY_AFTER_S: int = Field(default=2, ge=0, description="Valor do header Retry-After nos 429")
+    MAX_IMAGES: int = Field(default=256, description="Imagens mantidas em memória para download")
+    SHADOWING_DB: float = Field(default=6.0, description="Desvio do sombreamento log-normal (dB)")
+
+
+standin_settings = StandInSettings()
+app = FastAPI(title="CloudRF stand-in", version="1.0.0")
+
+_images: "OrderedDict[str, bytes]" = OrderedDict()
+_images_lock = threading.Lock()
+_counters: Dict[str, int] = {"area": 0, "errors": 0, "throttled": 0, "images": 0}
+
+_METERS_PER_DEG_LAT = 111320.0
+
+
+# ----------------- Modelo de propagação -----------------
+
+def _received_dbm(payload: Dict[str, Any], dist_m: np.ndarray) -> np.ndarray:
+    tx, rx, ant = payload["transmitter"], payload["receiver"], payload.get("antenna", {})
+    frq = float(tx["frq"])
+    eirp_dbm = 10 * log10(float(tx["txw"]) * 1000.0) + float(ant.get("txg", 0.0))
+    h_tx, h_rx = max(float(tx["alt"]), 1.0), max(float(rx["alt"]), 1.0)
+
+    d = np.maximum(dist_m, 1.0)
+    wavelength = 299.792458 / frq
+    d_break = 4 * h_tx * h_rx / wavelength
+    fspl = 20 * np.log10(d / 1000.0) + 20 * log10(frq) + 32.44
+    extra = np.where(d > d_break, 20 * np.log10(d / d_break), 0.0)
+    return eirp_dbm + float(rx.get("rxg", 0.0)) - (fspl + extra)
+
+
+def _shadowing(shape: Tuple[int, int], seed: int, sigma_db: float) -> np.ndarray:
+    """Campo aleatório suave (ruído em baixa resolução ampliado), determinístico por seed."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.normal(0.0, sigma_db, size=(shape[0] // 16 + 2, shape[1] // 16 + 2)).astype(np.float32)
+    img = Image.fromarray(coarse, mode="F").resize((shape[1], shape[0]), Image.BILINEAR)
+    return np.asarray(img, dtype=np.float32)
+
+
+def _color(level_dbm: np.ndarray, rxs: float, col: Optional[str] = None) -> np.ndarray:
+    """
+    Paleta `col` da CloudRF quando conhecida (como a API real); senão rampa
+    vermelho (limiar) -> verde (forte). Transparente abaixo da sensibilidade.
+    """
+    paleta = signal_palette.paleta(col)
+    if paleta is not None:
+        rgba = paleta.colorir(level_dbm)
+        rgba[level_dbm < rxs] = 0
+        return rgba
+    t = np.clip((level_dbm - rxs) / 40.0, 0.0, 1.0)
+    rgba = np.zeros(level_dbm.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = (255 * (1 - t)).astype(np.uint8)
+    rgba[..., 1] = (255 * t).astype(np.uint8)
+    rgba[..., 2] = 40
+    rgba[..., 3] = np.where(level_dbm >= rxs, 255, 0).astype(np.uint8)
+    return rgba
+
+
+def synthesize_coverage(payload: Dict[str, Any]) -> Tuple[bytes, list]:
+    """Gera o PNG de cobertura e os bounds [N, E, S, W] (mesma ordem da CloudRF)."""
+    tx = payload["transmitter"]
+    out = payload.get("output", {})
+    lat, lon = float(tx["lat"]), float(tx["lon"])
+    radius_m = float(out.get("rad", 7)) * 1000.0
+    res_m = max(float(out.get("res", 30)), 5.0)
+    size = int(2 * radius_m / res_m)
+
+    dlat = radius_m / _METERS_PER_DEG_LAT
+    dlon = radius_m / (_METERS_PER_DEG_LAT * max(cos(radians(lat)), 1e-6))
+    n, s, e, w = lat + dlat, lat - dlat, lon + dlon, lon - dlon
+
+    axis = (np.arange(size) + 0.5) * res_m - radius_m
+    yy, xx = np.meshgrid(-axis, axis, indexing="ij")  # linha 0 = norte
+    dist = np.hypot(xx, yy)
+
+    seed = int.from_bytes(hashlib.sha256(f"{lat:.4f},{lon:.4f}".encode()).digest()[:4], "little")
+    level = _received_dbm(payload, dist) + _shadowing((size, size), seed, standin_settings.SHADOWING_DB)
+    level[dist > radius_m] = -999.0
+
+    rxs = float(payload["receiver"].get("rxs", -100))
+    buf = io.BytesIO()
+    Image.fromarray(_color(level, rxs, out.get("col")), mode="RGBA").save(buf, format="PNG", optimize=False)
+    return buf.getvalue(), [round(n, 6), round(e, 6), round(s, 6), round(w, 6)]
+
+
+# ----------------- Endpoints -----------------
+
+@app.post("/area")
+async def area(request: Request, key: str = Header(default="")):
+    _counters["area"] += 1
+    if not key:
+        raise HTTPException(status_code=401, detail="Missing API key")
+
+    cfg = standin_settings
+    if cfg.RATE_LIMIT_RATE and random.random() < cfg.RATE_LIMIT_RATE:
+        _counters["throttled"] += 1
+        return JSONResponse(
+            {"error": "Too many requests"}, status_code=429,
+            headers={"Retry-After": str(cfg.RETRY_AFTER_S)},
+        )
+
+    payload = await request.json()
+    await asyncio.sleep(max(cfg.LATENCY_MS + random.uniform(0, cfg.LATENCY_JITTER_MS), 0) / 1000.0)
+
+    if cfg.ERROR_RATE and random.random() < cfg.ERROR_RATE:
+        _counters["errors"] += 1
+        return JSONResponse({"error": "Simulated engine failure"}, status_code=500)
+
+    try:
+        png, bounds = await asyncio.to_thread(synthesize_coverage, payload)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Payload inválido: {e}")
+
+    image_id = uuid.uuid4().hex
+    with _images_lock:
+        _images[image_id] = png
+        while len(_images) > cfg.MAX_IMAGES:
+            _images.popitem(last=False)
+    _counters["images"] += 1
+
+    base = str(request.base_url).rstrip("/")
+    return {
+        "PNG_WGS84": f"{base}/images/{image_id}.png",
+        "bounds": bounds,
+        "area": round(3.14159 * (float(payload.get("output", {}).get("rad", 7)) ** 2), 2),
+        "elapsed": round(cfg.LATENCY_MS, 1),
+        "standin": True,
+    }
+
+
+@app.get("/images/{image_id}.png")
+async def image(image_id: str):
+    with _images_lock:
+        png = _images.get(image_id)
+    if png is None:
+        raise HTTPException(status_code=404, detail="Imagem expirada ou inexistente")
+    return Response(content=png, media_type="image/png")
+
+
+@app.get("/stats")
+async def stats() -> Dict[str, Any]:
+    return {**_counters, "cached_images": len(_images), "settings": standin_settings.model_dump()}
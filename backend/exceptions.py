@@ -16,4 +16,8 @@ class FileParseError(AppBaseError):
 
 class PDFGenerationError(AppBaseError):
     """Lançada quando há um erro durante a geração do relatório PDF."""
+    pass
+
+class ReevaluationStateError(AppBaseError):
+    """Lançada quando o estado de reavaliação do job no servidor não está na versão esperada pelo cliente."""
     pass
\ No newline at end of file
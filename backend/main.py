@@ -5,6 +5,7 @@ from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
@@ -12,6 +13,14 @@ from backend.config import settings
 from backend.routers import kmz, simulation, report
 from backend.logging_config import setup_logging
 from backend.middlewares import RequestContextMiddleware
+from backend.services import cloudrf_service, dem_store
+from backend.services.http_pool import http_pool
+from backend.services.job_coverage import job_coverage
+from backend.services.overlay_cache import overlay_cache
+from backend.services.process_pool import process_pool
+from backend.services.rate_limiter import rate_limiters
+from backend.services.reevaluation_service import reeval_states
+from backend.services.simulation_cache import simulation_cache
 
 
 # ---------------------------------------------------------------------------
@@ -59,11 +68,18 @@ async def lifespan(app: FastAPI):
     logger = logging.getLogger("irricontrol")
     _init_directories(logger)
     _log_startup_info(logger)
-    
+    await http_pool.startup()
+    try:
+        await run_in_threadpool(simulation_cache.migrate_legacy)
+    except Exception as e:
+        logger.exception("Falha ao migrar cache de simulações antigo: %s", e)
+
     yield # A aplicação executa aqui
 
     # Ações na finalização
     logger.info("Aplicação finalizando (lifespan shutdown).")
+    await http_pool.shutdown()
+    await run_in_threadpool(process_pool.shutdown)
 
 
 # ---------------------------------------------------------------------------
@@ -130,6 +146,21 @@ async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get(f"{settings.API_V1_STR}/metrics", tags=["Health"])
+async def metrics() -> dict[str, dict]:
+    """Métricas internas (pool HTTP, simulações, overlays) para diagnóstico de desempenho."""
+    return {
+        "http": http_pool.stats(),
+        "rate_limits": rate_limiters.stats(),
+        "simulations": cloudrf_service.simulation_stats(),
+        "overlays": overlay_cache.stats(),
+        "job_grids": job_coverage.stats(),
+        "reeval_states": reeval_states.stats(),
+        "process_pool": process_pool.stats(),
+        "dem": dem_store.download_stats(),
+    }
+
+
 @app.get(f"{settings.API_V1_STR}/version", tags=["Health"])
 async def version_info() -> dict[str, str]:
     """Retorna nome e versão da aplicação (útil para automations)."""
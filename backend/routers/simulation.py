@@ -3,17 +3,22 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
+import os
 import shutil
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple, Literal
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple, Literal
 
 from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
 from backend.config import settings
-from backend.services import cloudrf_service, analysis_service
-from backend.exceptions import CloudRFAPIError, DEMProcessingError
+from backend.services import cloudrf_service, analysis_service, coverage_mask, reevaluation_service
+from backend.services.simulation_cache import simulation_cache
+from backend.exceptions import CloudRFAPIError, DEMProcessingError, ReevaluationStateError
 
 logger = logging.getLogger("irricontrol")
 router = APIRouter(prefix="/simulation", tags=["Simulation & Analysis"])
@@ -35,6 +40,10 @@ class PivoData(BaseModel):
     abertura_arco: Optional[float] = None
     angulo_inicio: Optional[float] = None
     angulo_fim: Optional[float] = None
+    coordenadas: Optional[List[List[float]]] = None
+    fracao_coberta: Optional[float] = None
+    sinal_dbm: Optional[float] = None
+    margem_db: Optional[float] = None
 
 
 class BombaData(BaseModel):
@@ -43,6 +52,8 @@ class BombaData(BaseModel):
     lon: float
     type: Literal["bomba"] = "bomba"
     fora: Optional[bool] = None
+    sinal_dbm: Optional[float] = None
+    margem_db: Optional[float] = None
 
 
 class AntenaSimPayload(BaseModel):
@@ -55,6 +66,9 @@ class AntenaSimPayload(BaseModel):
     template: str
     pivos_atuais: List[PivoData]
     bombas_atuais: List[BombaData]
+    permitir_aproximado: bool = True
+    engine: Optional[Literal["cloudrf", "local"]] = None
+    modo_cobertura: Literal["centro", "area"] = "centro"
 
 
 class ManualSimPayload(BaseModel):
@@ -65,12 +79,37 @@ class ManualSimPayload(BaseModel):
     altura_receiver: float
     template: str
     pivos_atuais: List[PivoData]
+    permitir_aproximado: bool = True
+    engine: Optional[Literal["cloudrf", "local"]] = None
+
+
+class BatchSiteData(BaseModel):
+    id: Optional[str] = None
+    lat: float
+    lon: float
+    altura: float
+    altura_receiver: Optional[float] = None
+    template: Optional[str] = None
+    is_repeater: bool = True
+
+
+class BatchSimPayload(BaseModel):
+    job_id: str
+    template: str
+    sites: List[BatchSiteData] = Field(min_length=1)
+    pivos_atuais: List[PivoData] = []
+    bombas_atuais: List[BombaData] = []
+    formato: Literal["ndjson", "sse"] = "ndjson"
+    permitir_aproximado: bool = True
+    engine: Optional[Literal["cloudrf", "local"]] = None
+    modo_cobertura: Literal["centro", "area"] = "centro"
 
 
 class OverlayData(BaseModel):
     id: Optional[str] = None
     imagem: str
     bounds: Tuple[float, float, float, float]
+    template: Optional[str] = None
 
 
 class ReavaliarPayload(BaseModel):
@@ -79,6 +118,29 @@ class ReavaliarPayload(BaseModel):
     bombas: List[BombaData]
     overlays: List[OverlayData]
     signal_sources: Optional[List[Dict[str, float]]] = None
+    modo_cobertura: Literal["centro", "area"] = "centro"
+
+
+class ReavaliarDeltaPayload(BaseModel):
+    job_id: str
+    versao_base: int = 0
+    reiniciar: bool = False
+    overlays_incluidos: List[OverlayData] = []
+    overlays_removidos: List[str] = []
+    pivos: List[PivoData] = []
+    pivos_removidos: List[str] = []
+    bombas: List[BombaData] = []
+    bombas_removidas: List[str] = []
+    signal_sources: Optional[List[Dict[str, float]]] = None
+    modo_cobertura: Optional[Literal["centro", "area"]] = None
+
+
+class RedundanciaPayload(BaseModel):
+    job_id: str
+    pivos: List[PivoData] = []
+    bombas: List[BombaData] = []
+    overlays: List[OverlayData]
+    gerar_raster: bool = True
 
 
 class PerfilPayload(BaseModel):
@@ -87,6 +149,16 @@ class PerfilPayload(BaseModel):
     altura_receiver: float
 
 
+class PerfilLoteItem(BaseModel):
+    pontos: Tuple[Tuple[float, float], Tuple[float, float]]
+    altura_antena: float
+    altura_receiver: float
+
+
+class PerfisLotePayload(BaseModel):
+    perfis: List[PerfilLoteItem] = Field(min_length=1)
+
+
 class FindRepeaterSitesPayload(BaseModel):
     job_id: str
     target_pivot_lat: float
@@ -114,6 +186,23 @@ def _get_image_filepath_for_analysis(image_filename: str, job_id: str) -> Path:
     return settings.IMAGENS_DIR_PATH / job_id / filename_only
 
 
+def _overlays_para_analise(overlays: List[OverlayData], job_id: str) -> List[Dict[str, Any]]:
+    """Resolve as imagens dos overlays na pasta do job (ignora as inexistentes)."""
+    resultado = []
+    for o_data in overlays:
+        imagem_path_servidor = _get_image_filepath_for_analysis(o_data.imagem, job_id)
+        if not imagem_path_servidor.is_file():
+            logger.warning("Arquivo imagem '%s' não encontrado (sessão %s). Pulando.", o_data.imagem, job_id)
+            continue
+        resultado.append({
+            "id": o_data.id or f"overlay_{Path(o_data.imagem.split('?',1)[0]).stem}",
+            "imagem_path": imagem_path_servidor,
+            "bounds": o_data.bounds,
+            "template": o_data.template,
+        })
+    return resultado
+
+
 def _build_served_url(job_id: str, filename: str) -> str:
     """Monta URL pública da imagem. Usa BACKEND_PUBLIC_URL se definido."""
     backend_url = (
@@ -132,15 +221,58 @@ def _validate_template_id(template_id: str) -> None:
         raise HTTPException(status_code=400, detail=f"Template inválido: '{template_id}'")
 
 
-def _copy_cached_with_json(cached_image_path: Path, dest_image_path: Path) -> None:
-    """Copia imagem e JSON irmão, loga warning se JSON ausente."""
+def _link_or_copy(src: Path, dst: Path) -> None:
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _copy_cached_with_json(cached_image_path: Path, dest_image_path: Path, bounds: list) -> None:
+    """
+    Materializa a imagem do cache (e sua máscara de cobertura) na pasta do job e
+    grava o JSON de bounds ao lado. Blobs do cache são imutáveis, então tenta
+    hard link antes de copiar.
+    """
     dest_image_path.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(cached_image_path, dest_image_path)
-    json_src, json_dst = cached_image_path.with_suffix(".json"), dest_image_path.with_suffix(".json")
-    if json_src.exists():
-        shutil.copy2(json_src, json_dst)
-    else:
-        logger.warning("Arquivo JSON associado não encontrado: %s", json_src)
+    _link_or_copy(cached_image_path, dest_image_path)
+    try:
+        coverage_mask.ensure_mask(cached_image_path, bounds)
+        for src, dst in zip(coverage_mask.mask_paths(cached_image_path), coverage_mask.mask_paths(dest_image_path)):
+            _link_or_copy(src, dst)
+    except Exception as e:
+        # Sem máscara a análise recai na decodificação do PNG (mais lenta, mesmo resultado).
+        logger.warning("Falha ao preparar máscara de cobertura de %s: %s", cached_image_path.name, e)
+    cloudrf_service.save_bounds(bounds, dest_image_path)
+
+
+async def _simular_no_job(job_id: str, **sim_kwargs: Any) -> Tuple[Dict[str, Any], Path]:
+    """
+    Roda a simulação (via cache) e materializa a imagem na pasta do job. Se o
+    blob for despejado do cache entre a consulta e a cópia (outro pedido ou
+    worker estourou o orçamento), a entrada já saiu do índice: simula de novo.
+    """
+    for tentativa in (1, 2):
+        sim_result = await cloudrf_service.run_cloudrf_simulation(**sim_kwargs)
+        bounds = sim_result.get("bounds")
+        if bounds is None:
+            raise CloudRFAPIError("Resposta da simulação sem 'bounds'.")
+
+        dest_image_path = settings.IMAGENS_DIR_PATH / job_id / Path(sim_result["imagem_filename"]).name
+        try:
+            await run_in_threadpool(
+                _copy_cached_with_json, Path(sim_result["imagem_local_path"]), dest_image_path, bounds
+            )
+        except FileNotFoundError:
+            if tentativa == 2:
+                raise
+            logger.warning("Imagem %s despejada do cache durante a cópia; simulando de novo.",
+                           sim_result["imagem_filename"])
+            continue
+        # A máscara pode ter sido gerada agora ao lado do blob: entra no orçamento do cache
+        await run_in_threadpool(simulation_cache.refresh_size, sim_result["digest"])
+        return sim_result, dest_image_path
 
 
 # ---------------------------------------------------------------------------
@@ -197,31 +329,26 @@ async def run_main_simulation_endpoint(payload: AntenaSimPayload, request: Reque
         _validate_template_id_with_override(payload.template, allow_disabled=True)
         logger.info("🛰️  Iniciando simulação principal para a sessão: %s", payload.job_id)
 
-        sim_result = await cloudrf_service.run_cloudrf_simulation(
+        sim_result, dest_image_path = await _simular_no_job(
+            payload.job_id,
             lat=payload.lat,
             lon=payload.lon,
             altura=payload.altura,
             altura_receiver=payload.altura_receiver,
             template_id=payload.template,
+            permitir_aproximado=payload.permitir_aproximado,
+            engine=payload.engine,
         )
-
-        cached_image_path = Path(sim_result["imagem_local_path"])
-        imagem_filename = sim_result["imagem_filename"]
-        bounds = sim_result.get("bounds")
-        if bounds is None:
-            raise HTTPException(status_code=502, detail="Resposta da simulação sem 'bounds'.")
-
-        job_image_dir = settings.IMAGENS_DIR_PATH / payload.job_id
-        dest_image_path = job_image_dir / Path(imagem_filename).name
-        _copy_cached_with_json(cached_image_path, dest_image_path)
+        bounds = sim_result["bounds"]
 
         imagem_servida_url = _build_served_url(payload.job_id, dest_image_path.name)
-        overlay_info = {"imagem_path": dest_image_path, "bounds": bounds}
+        overlay_info = {"imagem_path": dest_image_path, "bounds": bounds, "template": payload.template}
         signal_sources = [{"lat": payload.lat, "lon": payload.lon}]
 
         pivos_com_status, bombas_com_status = await asyncio.gather(
             analysis_service.verificar_cobertura_pivos(
-                [p.model_dump() for p in payload.pivos_atuais], [overlay_info], signal_sources
+                [p.model_dump() for p in payload.pivos_atuais], [overlay_info], signal_sources,
+                modo_cobertura=payload.modo_cobertura,
             ),
             analysis_service.verificar_cobertura_bombas(
                 [b.model_dump() for b in payload.bombas_atuais], [overlay_info], signal_sources
@@ -235,11 +362,17 @@ async def run_main_simulation_endpoint(payload: AntenaSimPayload, request: Reque
             "bounds": bounds,
             "pivos": pivos_com_status,
             "bombas": bombas_com_status,
+            "aproximado": sim_result.get("aproximado", False),
+            "distancia_reuso_m": sim_result.get("distancia_reuso_m"),
+            "engine": sim_result.get("engine"),
         }
     
     except CloudRFAPIError as e:
         logger.error("Falha na API da CloudRF para o job %s: %s", payload.job_id, e)
         raise HTTPException(status_code=502, detail=f"O serviço de simulação externo falhou: {e}")
+    except DEMProcessingError as e:
+        logger.error("Falha no MDT da simulação local para o job %s: %s", payload.job_id, e)
+        raise HTTPException(status_code=502, detail=f"Falha ao obter dados de elevação: {e}")
     except HTTPException:
         raise
     except Exception as e:
@@ -254,24 +387,19 @@ async def run_manual_simulation_endpoint(payload: ManualSimPayload, request: Req
         _validate_template_id_with_override(payload.template, allow_disabled=True)
         logger.info("📡 Iniciando simulação manual para a sessão: %s", payload.job_id)
 
-        sim_result = await cloudrf_service.run_cloudrf_simulation(
+        sim_result, dest_image_path = await _simular_no_job(
+            payload.job_id,
             lat=payload.lat,
             lon=payload.lon,
             altura=int(payload.altura),
             altura_receiver=int(payload.altura_receiver),
             template_id=payload.template,
             is_repeater=True,
+            permitir_aproximado=payload.permitir_aproximado,
+            engine=payload.engine,
         )
-
-        cached_image_path = Path(sim_result["imagem_local_path"])
-        imagem_filename = Path(sim_result["imagem_filename"]).name
-        bounds = sim_result.get("bounds")
-        if bounds is None:
-            raise HTTPException(status_code=502, detail="Resposta da simulação sem 'bounds'.")
-
-        job_image_dir = settings.IMAGENS_DIR_PATH / payload.job_id
-        dest_image_path = job_image_dir / imagem_filename
-        _copy_cached_with_json(cached_image_path, dest_image_path)
+        imagem_filename = dest_image_path.name
+        bounds = sim_result["bounds"]
 
         imagem_servida_url = _build_served_url(payload.job_id, imagem_filename)
         logger.info("✅ Simulação manual concluída para sessão: %s", payload.job_id)
@@ -281,11 +409,17 @@ async def run_manual_simulation_endpoint(payload: ManualSimPayload, request: Req
             "imagem_filename": imagem_filename,
             "bounds": bounds,
             "status": "Simulação manual concluída",
+            "aproximado": sim_result.get("aproximado", False),
+            "distancia_reuso_m": sim_result.get("distancia_reuso_m"),
+            "engine": sim_result.get("engine"),
         }
     
     except CloudRFAPIError as e:
         logger.error("Falha na API da CloudRF para o job %s: %s", payload.job_id, e)
         raise HTTPException(status_code=502, detail=f"O serviço de simulação externo falhou: {e}")
+    except DEMProcessingError as e:
+        logger.error("Falha no MDT da simulação local para o job %s: %s", payload.job_id, e)
+        raise HTTPException(status_code=502, detail=f"Falha ao obter dados de elevação: {e}")
     except HTTPException:
         raise
     except Exception as e:
@@ -300,17 +434,7 @@ async def reevaluate_pivots_endpoint(payload: ReavaliarPayload):
     try:
         logger.info("🔄 Reavaliando cobertura para sessão %s com %d overlays.", payload.job_id, len(payload.overlays))
 
-        overlays_para_analise = []
-        for o_data in payload.overlays or []:
-            imagem_path_servidor = _get_image_filepath_for_analysis(o_data.imagem, payload.job_id)
-            if not imagem_path_servidor.is_file():
-                logger.warning("Arquivo imagem '%s' não encontrado (sessão %s). Pulando.", o_data.imagem, payload.job_id)
-                continue
-            overlays_para_analise.append({
-                "id": o_data.id or f"overlay_{Path(o_data.imagem.split('?',1)[0]).stem}",
-                "imagem_path": imagem_path_servidor,
-                "bounds": o_data.bounds,
-            })
+        overlays_para_analise = _overlays_para_analise(payload.overlays or [], payload.job_id)
 
         pivos_atualizados = [p.model_dump() for p in payload.pivos]
         bombas_atualizadas = [b.model_dump() for b in payload.bombas]
@@ -320,16 +444,10 @@ async def reevaluate_pivots_endpoint(payload: ReavaliarPayload):
             for bomba in bombas_atualizadas: bomba["fora"] = True
             return {"pivos": pivos_atualizados, "bombas": bombas_atualizadas}
 
-        tasks, signal_sources = [], payload.signal_sources or []
-        if pivos_atualizados:
-            tasks.append(analysis_service.verificar_cobertura_pivos(pivos_atualizados, overlays_para_analise, signal_sources))
-        if bombas_atualizadas:
-            tasks.append(analysis_service.verificar_cobertura_bombas(bombas_atualizadas, overlays_para_analise, signal_sources))
-
-        if tasks:
-            results = await asyncio.gather(*tasks)
-            if pivos_atualizados: pivos_atualizados = results[0]
-            if bombas_atualizadas and len(results) > 1: bombas_atualizadas = results[1]
+        pivos_atualizados, bombas_atualizadas = await analysis_service.reavaliar_entidades(
+            pivos_atualizados, bombas_atualizadas, overlays_para_analise, payload.signal_sources or [],
+            modo_cobertura=payload.modo_cobertura, job_id=payload.job_id,
+        )
 
         logger.info("✅ Reavaliação concluída para sessão %s.", payload.job_id)
         return {"pivos": pivos_atualizados, "bombas": bombas_atualizadas}
@@ -339,6 +457,70 @@ async def reevaluate_pivots_endpoint(payload: ReavaliarPayload):
         raise HTTPException(status_code=500, detail=msg)
 
 
+@router.post("/reevaluate_delta")
+async def reevaluate_delta_endpoint(payload: ReavaliarDeltaPayload):
+    """
+    Reavaliação incremental: aplica só as mudanças (overlays incluídos/removidos,
+    pivôs/bombas novos, movidos ou removidos) ao estado do job no servidor e
+    devolve só as entidades cujo resultado mudou. 409 se `versao_base` não
+    bater com o servidor (estado perdido): reenviar tudo com `reiniciar=true`.
+    """
+    try:
+        overlays_incluidos = _overlays_para_analise(payload.overlays_incluidos, payload.job_id)
+        return await reevaluation_service.aplicar_delta(
+            job_id=payload.job_id,
+            versao_base=payload.versao_base,
+            overlays_incluidos=overlays_incluidos,
+            overlays_removidos=payload.overlays_removidos,
+            pivos=[p.model_dump() for p in payload.pivos],
+            pivos_removidos=payload.pivos_removidos,
+            bombas=[b.model_dump() for b in payload.bombas],
+            bombas_removidas=payload.bombas_removidas,
+            signal_sources=payload.signal_sources,
+            modo_cobertura=payload.modo_cobertura,
+            reiniciar=payload.reiniciar,
+        )
+    except ReevaluationStateError as e:
+        logger.info("Delta recusado para sessão %s: %s", payload.job_id, e)
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error("❌ Erro em /simulation/reevaluate_delta (sessão %s): %s", payload.job_id, e, exc_info=True)
+        msg = f"Erro ao reavaliar cobertura: {e}" if DEBUG else "Erro interno ao reavaliar cobertura."
+        raise HTTPException(status_code=500, detail=msg)
+
+
+@router.post("/redundancy")
+async def redundancy_endpoint(payload: RedundanciaPayload):
+    """
+    Redundância de cobertura: quantas fontes (overlays ativos) cobrem cada pivô
+    e bomba, resumo (sem cobertura / fonte única / redundante) e o raster de
+    contagem por pixel. A pilha de máscaras é a grade composta do job, em cache:
+    consultas repetidas com os mesmos overlays não recalculam nada.
+    """
+    try:
+        overlays_para_analise = _overlays_para_analise(payload.overlays, payload.job_id)
+        raster_path = (
+            settings.IMAGENS_DIR_PATH / payload.job_id / "redundancia.png" if payload.gerar_raster else None
+        )
+        resultado = await analysis_service.calcular_redundancia(
+            [p.model_dump() for p in payload.pivos],
+            [b.model_dump() for b in payload.bombas],
+            overlays_para_analise,
+            payload.job_id,
+            raster_path,
+        )
+        raster = resultado.pop("raster")
+        if raster is not None:
+            resultado["imagem_salva"] = _build_served_url(payload.job_id, raster["path"].name)
+            resultado["bounds"] = raster["bounds"]
+            resultado["max_fontes"] = raster["max"]
+        return resultado
+    except Exception as e:
+        logger.error("❌ Erro em /simulation/redundancy (sessão %s): %s", payload.job_id, e, exc_info=True)
+        msg = f"Erro ao calcular redundância: {e}" if DEBUG else "Erro interno ao calcular redundância."
+        raise HTTPException(status_code=500, detail=msg)
+
+
 @router.post("/elevation_profile")
 async def get_elevation_profile_endpoint(payload: PerfilPayload):
     try:
@@ -359,6 +541,33 @@ async def get_elevation_profile_endpoint(payload: PerfilPayload):
         raise HTTPException(status_code=500, detail=msg)
 
 
+@router.post("/elevation_profiles")
+async def get_elevation_profiles_endpoint(payload: PerfisLotePayload):
+    """Vários perfis de elevação num só pedido; a resposta segue a ordem de `perfis`."""
+    if len(payload.perfis) > settings.SIM_ELEVATION_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo de {settings.SIM_ELEVATION_BATCH_MAX} perfis por lote.")
+    try:
+        resultados = await analysis_service.obter_perfis_elevacao([
+            (p.pontos[0], p.pontos[1], p.altura_antena, p.altura_receiver) for p in payload.perfis
+        ])
+    except Exception as e:
+        logger.exception("❌ Erro em /simulation/elevation_profiles: %s", e)
+        msg = f"Erro ao buscar perfis de elevação: {e}" if DEBUG else "Erro interno ao buscar perfis de elevação."
+        raise HTTPException(status_code=500, detail=msg)
+
+    perfis: List[Dict[str, Any]] = []
+    for r in resultados:
+        if isinstance(r, DEMProcessingError):
+            perfis.append({"erro": f"Erro ao processar dados de terreno: {r}"})
+        elif isinstance(r, Exception):
+            logger.error("❌ Perfil do lote falhou: %s", r)
+            perfis.append({"erro": f"Erro ao buscar perfil de elevação: {r}" if DEBUG else "Erro interno ao buscar perfil de elevação."})
+        else:
+            perfis.append(r)
+    logger.info("✅ %d perfis de elevação calculados (%d com erro).", len(perfis), sum("erro" in p for p in perfis))
+    return {"perfis": perfis}
+
+
 @router.post("/find_repeater_sites")
 async def find_repeater_sites_endpoint(payload: FindRepeaterSitesPayload):
     try:
@@ -396,7 +605,109 @@ async def find_repeater_sites_endpoint(payload: FindRepeaterSitesPayload):
         raise HTTPException(status_code=500, detail=msg)
 
 
+async def _run_batch_site(
+    payload: BatchSimPayload, idx: int, site: BatchSiteData
+) -> Dict[str, Any]:
+    """Simula um site do lote, materializa na pasta do job e avalia cobertura só desse site."""
+    site_id = site.id or f"site_{idx}"
+    try:
+        sim_result, dest_image_path = await _simular_no_job(
+            payload.job_id,
+            lat=site.lat,
+            lon=site.lon,
+            altura=int(site.altura),
+            altura_receiver=site.altura_receiver,
+            template_id=site.template or payload.template,
+            is_repeater=site.is_repeater,
+            permitir_aproximado=payload.permitir_aproximado,
+            engine=payload.engine,
+        )
+        imagem_filename = dest_image_path.name
+        bounds = sim_result["bounds"]
 
-
-
-
+        overlay_info = {
+            "imagem_path": dest_image_path, "bounds": bounds, "template": site.template or payload.template,
+        }
+        signal_sources = [{"lat": site.lat, "lon": site.lon}]
+        pivos, bombas = await asyncio.gather(
+            analysis_service.verificar_cobertura_pivos(
+                [p.model_dump() for p in payload.pivos_atuais], [overlay_info], signal_sources,
+                modo_cobertura=payload.modo_cobertura,
+            ),
+            analysis_service.verificar_cobertura_bombas(
+                [b.model_dump() for b in payload.bombas_atuais], [overlay_info], signal_sources
+            ),
+        )
+        return {
+            "id": site_id,
+            "index": idx,
+            "status": "ok",
+            "imagem_salva": _build_served_url(payload.job_id, imagem_filename),
+            "imagem_filename": imagem_filename,
+            "bounds": bounds,
+            "aproximado": sim_result.get("aproximado", False),
+            "distancia_reuso_m": sim_result.get("distancia_reuso_m"),
+            "engine": sim_result.get("engine"),
+            "pivos_cobertos": [p["nome"] for p in pivos if p.get("fora") is False],
+            "bombas_cobertas": [b["nome"] for b in bombas if b.get("fora") is False],
+        }
+    except CloudRFAPIError as e:
+        logger.error("Falha na CloudRF no lote (job %s, site %s): %s", payload.job_id, site_id, e)
+        return {"id": site_id, "index": idx, "status": "erro", "detail": f"O serviço de simulação externo falhou: {e}"}
+    except DEMProcessingError as e:
+        logger.error("Falha no MDT do lote (job %s, site %s): %s", payload.job_id, site_id, e)
+        return {"id": site_id, "index": idx, "status": "erro", "detail": f"Falha ao obter dados de elevação: {e}"}
+    except Exception as e:
+        logger.exception("❌ Erro no lote (job %s, site %s): %s", payload.job_id, site_id, e)
+        msg = f"Erro na simulação: {e}" if DEBUG else "Erro interno inesperado na simulação."
+        return {"id": site_id, "index": idx, "status": "erro", "detail": msg}
+
+
+def _format_batch_event(item: Dict[str, Any], formato: str, event: str = "result") -> str:
+    data = json.dumps(item, ensure_ascii=False)
+    if formato == "sse":
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@router.post("/run_batch")
+async def run_batch_simulation_endpoint(payload: BatchSimPayload, request: Request):
+    """
+    Simula vários sites de uma vez com concorrência limitada (SIM_BATCH_CONCURRENCY)
+    e devolve cada resultado assim que fica pronto (NDJSON ou SSE).
+    """
+    if len(payload.sites) > settings.SIM_BATCH_MAX_SITES:
+        raise HTTPException(status_code=413, detail=f"Máximo de {settings.SIM_BATCH_MAX_SITES} sites por lote.")
+    for tpl_id in {payload.template, *(s.template for s in payload.sites if s.template)}:
+        _validate_template_id_with_override(tpl_id, allow_disabled=True)
+
+    logger.info("📦 Iniciando lote de %d simulações para a sessão: %s", len(payload.sites), payload.job_id)
+    semaphore = asyncio.Semaphore(max(1, settings.SIM_BATCH_CONCURRENCY))
+
+    async def _bounded(idx: int, site: BatchSiteData) -> Dict[str, Any]:
+        async with semaphore:
+            return await _run_batch_site(payload, idx, site)
+
+    async def _stream() -> AsyncIterator[str]:
+        tasks = [asyncio.create_task(_bounded(i, site)) for i, site in enumerate(payload.sites)]
+        ok = erros = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                if item["status"] == "ok":
+                    ok += 1
+                else:
+                    erros += 1
+                yield _format_batch_event(item, payload.formato)
+            logger.info("✅ Lote concluído para sessão %s (%d ok, %d erros).", payload.job_id, ok, erros)
+            yield _format_batch_event(
+                {"status": "done", "total": len(tasks), "ok": ok, "erros": erros}, payload.formato, event="done"
+            )
+        finally:
+            # Cliente desconectou (ou erro): não deixa simulações órfãs na fila.
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    media_type = "text/event-stream" if payload.formato == "sse" else "application/x-ndjson"
+    return StreamingResponse(_stream(), media_type=media_type, headers={"Cache-Control": "no-cache"})
@@ -1,7 +1,5 @@
 import re
-from PIL import Image
 import httpx
-import requests  # Adicionado para downloads
 from math import sqrt, radians, sin, cos, atan2
 from typing import List, Dict, Optional, Union, TypedDict, Tuple, Any
 from pathlib import Path
@@ -9,17 +7,26 @@ import logging
 import asyncio
 import hashlib
 import json
+import os
+import uuid
 
 # DEM / geoprocessamento
 import rasterio
-import rasterio.mask
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 import numpy as np
 from scipy.ndimage import maximum_filter
-from shapely.geometry import Point, Polygon, box
+from PIL import Image
+import shapely
+from shapely.geometry import Polygon, box
+from shapely.strtree import STRtree
 
 from backend.config import settings
-from backend.services import cloudrf_service
+from backend.services import cloudrf_service, dem_store
+from backend.services.coverage_mask import normalize_bounds
+from backend.services.job_coverage import job_coverage
+from backend.services.overlay_cache import overlay_cache
+from backend.services.process_pool import process_pool
+from backend.services import signal_palette
 from backend.services.i18n_service import i18n_service
 from fastapi.concurrency import run_in_threadpool
 
@@ -36,10 +43,11 @@ class PivoInputData(TypedDict, total=False):
     type: str
     fora: Optional[bool]
 
-class OverlayInputData(TypedDict):
+class OverlayInputData(TypedDict, total=False):
     id: Optional[str]
     imagem_path: Union[str, Path]
     bounds: Tuple[float, float, float, float]  # (S, W, N, E)
+    template: Optional[str]  # define a paleta (nível de sinal); senão inferido do nome da imagem
 
 class ElevationPoint(TypedDict):
     lat: float
@@ -81,172 +89,623 @@ def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     return R * c
 
 
+def haversine_np(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """`haversine` vetorizada (broadcast NumPy), mesma fórmula, em metros."""
+    R = 6371000  # m
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2)**2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+PROXIMITY_THRESHOLD_METERS = 20.0
+
+
+def _zona_seguranca(
+    lats: np.ndarray, lons: np.ndarray, signal_sources: List[Dict[str, float]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(dentro da zona, distância à fonte mais próxima) — broadcast pontos × fontes."""
+    if lats.size == 0 or not signal_sources:
+        return np.zeros(lats.shape, dtype=bool), np.full(lats.shape, np.inf)
+    src_lats = np.array([float(s["lat"]) for s in signal_sources], dtype=np.float64)
+    src_lons = np.array([float(s["lon"]) for s in signal_sources], dtype=np.float64)
+    distancias = haversine_np(lats[..., None], lons[..., None], src_lats, src_lons).min(axis=-1)
+    return distancias < PROXIMITY_THRESHOLD_METERS, distancias
+
+
+def _pesado(carga: int, fn: Any, arrays: List[np.ndarray], *args: Any) -> Any:
+    """
+    `fn(*arrays, *args)` no pool de processos quando a carga passa de
+    SIM_PROCESS_MIN_CARGA (arrays por memória compartilhada); senão na thread atual.
+    """
+    if process_pool.deve_usar(carga):
+        return process_pool.executar(fn, arrays, *args)
+    return fn(*arrays, *args)
+
+
+_OverlayValido = Tuple[OverlayInputData, Path, list, Tuple[float, float, float, float]]
+
+
+def _overlays_validos(overlays_info: List[OverlayInputData]) -> List[_OverlayValido]:
+    """(overlay, caminho, bounds, (S, W, N, E)) dos overlays com bounds e imagem utilizáveis."""
+    validos: List[_OverlayValido] = []
+    for overlay_data in overlays_info:
+        bounds = list(overlay_data["bounds"])
+        if len(bounds) != 4:
+            logger.warning("  -> ⚠️ Bounds inválidos para overlay: %s", bounds)
+            continue
+
+        s, w, n, e = normalize_bounds(bounds)
+
+        imagem_path = Path(overlay_data["imagem_path"])
+
+        if not imagem_path.is_file():
+            logger.warning("  -> ⚠️ Imagem não encontrada: %s. Pulando overlay.", imagem_path)
+            continue
+
+        if e - w == 0 or n - s == 0:
+            continue
+        validos.append((overlay_data, imagem_path, bounds, (s, w, n, e)))
+    return validos
+
+
+def _candidatos_por_overlay(
+    lats: np.ndarray, lons: np.ndarray, validos: List[_OverlayValido], pontos: np.ndarray
+) -> List[np.ndarray]:
+    """
+    Para cada overlay válido, os índices de `pontos` que caem no seu retângulo,
+    numa única consulta a um STRtree dos bounds (em vez de pontos × overlays).
+    """
+    # Folga de 1% no retângulo: o int() da conta de pixel trunca para zero, então
+    # pontos até 1 pixel a oeste/norte ainda caem no pixel 0 (mantém o resultado).
+    caixas = [
+        box(w - (e - w) * 0.01, s - (n - s) * 0.01, e + (e - w) * 0.01, n + (n - s) * 0.01)
+        for _, _, _, (s, w, n, e) in validos
+    ]
+    idx_ponto, idx_overlay = STRtree(caixas).query(
+        shapely.points(lons[pontos], lats[pontos]), predicate="intersects"
+    )
+    ordem = np.argsort(idx_overlay, kind="stable")
+    idx_ponto, idx_overlay = pontos[idx_ponto[ordem]], idx_overlay[ordem]
+    cortes = np.searchsorted(idx_overlay, np.arange(len(validos) + 1))
+    return [idx_ponto[cortes[j]:cortes[j + 1]] for j in range(len(validos))]
+
+
+def _sincronizar_grade(grid: Any, overlays_info: List[OverlayInputData]) -> None:
+    """Atualiza a grade composta do job (chamar com `grid.lock`); MemoryError se exceder o limite."""
+    delta = grid.sync(overlays_info, _paleta_do_overlay)
+    job_coverage.ajustar(grid.job_id)
+    if delta["incluidos"] or delta["removidos"]:
+        logger.info("  -> Grade do job %s: +%d / -%d overlays (%d ativos).",
+                    grid.job_id, delta["incluidos"], delta["removidos"], delta["ativos"])
+
+
+def _cobertura_pontos(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    overlays_info: List[OverlayInputData],
+    coberto: Optional[np.ndarray] = None,
+    job_id: Optional[str] = None,
+) -> np.ndarray:
+    """
+    True para cada ponto coberto por ao menos um overlay (máscara alpha > SIM_ALPHA_THRESHOLD).
+    Cada máscara é amostrada uma vez, por indexação de arrays, só nos pontos ainda não cobertos
+    que caem no seu retângulo (consulta num STRtree dos bounds dos overlays).
+    Com `job_id`, usa a grade composta do job (atualizada só com os overlays que
+    mudaram), e a consulta fica O(pontos) independente do número de overlays
+    (o mesmo vale para o nível de sinal, ver _sinal_pontos); só os pontos em
+    células marcadas como incertas (borda de algum overlay) voltam ao teste
+    overlay a overlay, então o resultado é o mesmo do caminho direto.
+    """
+    coberto = np.zeros(lats.shape, dtype=bool) if coberto is None else coberto.copy()
+    if job_id is not None:
+        grid = job_coverage.get(job_id)
+        try:
+            with grid.lock:
+                _sincronizar_grade(grid, overlays_info)
+                resultado = coberto | (grid.count_at(lats, lons) > 0)
+                incerto = grid.incerto_at(lats, lons) & ~coberto
+        except MemoryError as ex:
+            logger.warning("  -> ⚠️ %s Verificando overlay a overlay.", ex)
+            job_coverage.drop(job_id)
+        else:
+            # Células com borda de algum overlay: teste pixel a pixel só nesses pontos
+            if incerto.any():
+                resultado[incerto] = _cobertura_pontos(lats[incerto], lons[incerto], overlays_info)
+            return resultado
+
+    flat = coberto.reshape(-1)
+    pendentes = np.flatnonzero(~flat)
+    validos = _overlays_validos(overlays_info)
+    if not validos or pendentes.size == 0:
+        return coberto
+    if process_pool.deve_usar(int(pendentes.size) * len(validos)):
+        return process_pool.executar(_cobertura_pontos_proc, [lats, lons, coberto], overlays_info)
+
+    flat_lats, flat_lons = lats.reshape(-1), lons.reshape(-1)
+    for (_, imagem_path, bounds, (s, w, n, e)), candidatos in zip(
+        validos, _candidatos_por_overlay(flat_lats, flat_lons, validos, pendentes)
+    ):
+        candidatos = candidatos[~flat[candidatos]]
+        if candidatos.size == 0:
+            continue
+        try:
+            mascara = overlay_cache.mask(imagem_path, bounds)
+
+            # np.trunc reproduz o int() escalar (trunca em direção a zero).
+            pixel_x = np.trunc(((flat_lons[candidatos] - w) / (e - w)) * mascara.width).astype(np.int64)
+            pixel_y = np.trunc(((n - flat_lats[candidatos]) / (n - s)) * mascara.height).astype(np.int64)
+            flat[candidatos[mascara.covered_many(pixel_x, pixel_y)]] = True
+        except Exception as ex:
+            logger.error("  -> ❌ Erro ao analisar overlay %s: %s", imagem_path.name, ex, exc_info=True)
+    return coberto
+
+
+def _cobertura_pontos_proc(
+    lats: np.ndarray, lons: np.ndarray, coberto: np.ndarray, overlays_info: List[OverlayInputData]
+) -> np.ndarray:
+    """Ponto de entrada de `_cobertura_pontos` no pool de processos (arrays primeiro)."""
+    return _cobertura_pontos(lats, lons, overlays_info, coberto)
+
+
+def _template_do_overlay(overlay: OverlayInputData) -> Optional[Any]:
+    """Template do overlay: o informado, senão o do nome canônico da imagem (`<tipo>_<template>_tx...`)."""
+    template_id = overlay.get("template")
+    if not template_id:
+        nome = Path(overlay["imagem_path"]).name.lower()
+        template_id = next(
+            (t.id for t in settings.TEMPLATES_DISPONIVEIS if f"_{t.id.lower().replace(' ', '_')}_" in nome), None
+        )
+    if not template_id or template_id not in settings.listar_templates_ids():
+        return None
+    return settings.obter_template(template_id)
+
+
+def _paleta_do_overlay(overlay: OverlayInputData) -> Optional[Tuple[signal_palette.SignalPalette, float]]:
+    """Paleta (`tpl.col`) e sensibilidade (`tpl.receiver.rxs`) do template do overlay; None sem paleta conhecida."""
+    tpl = _template_do_overlay(overlay)
+    paleta = signal_palette.paleta(tpl.col) if tpl is not None else None
+    if paleta is None:
+        return None
+    return paleta, float(tpl.receiver.rxs)
+
+
+def _sinal_pontos(
+    lats: np.ndarray, lons: np.ndarray, overlays_info: List[OverlayInputData], job_id: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (nível dBm, margem dB) de cada ponto, pelo overlay de maior margem sobre a
+    sensibilidade do seu template. O nível é o limiar da faixa de cor da paleta
+    (`tpl.col`), decodificado por tabela RGB -> dBm. NaN sem sinal ou sem paleta.
+    Com `job_id`, lê a grade de sinal do job (mantida junto da contagem), O(pontos).
+    """
+    if job_id is not None:
+        grid = job_coverage.get(job_id)
+        try:
+            with grid.lock:
+                _sincronizar_grade(grid, overlays_info)
+                nivel, margem = grid.sinal_at(lats, lons)
+                incerto = grid.incerto_at(lats, lons)
+        except MemoryError as ex:
+            logger.warning("  -> ⚠️ %s Decodificando sinal overlay a overlay.", ex)
+            job_coverage.drop(job_id)
+        else:
+            if incerto.any():
+                nivel[incerto], margem[incerto] = _sinal_pontos(lats[incerto], lons[incerto], overlays_info)
+            return nivel, margem
+
+    nivel = np.full(lats.shape, np.nan, dtype=np.float32)
+    margem = np.full(lats.shape, np.nan, dtype=np.float32)
+    validos = _overlays_validos(overlays_info)
+    if not validos or lats.size == 0:
+        return nivel, margem
+    if process_pool.deve_usar(int(lats.size) * len(validos)):
+        return process_pool.executar(_sinal_pontos_proc, [lats, lons], overlays_info)
+
+    flat_lats, flat_lons = lats.reshape(-1), lons.reshape(-1)
+    flat_nivel, flat_margem = nivel.reshape(-1), margem.reshape(-1)
+    todos = np.arange(flat_lats.size)
+    for (overlay, imagem_path, bounds, (s, w, n, e)), candidatos in zip(
+        validos, _candidatos_por_overlay(flat_lats, flat_lons, validos, todos)
+    ):
+        if candidatos.size == 0:
+            continue
+        sinal = _paleta_do_overlay(overlay)
+        if sinal is None:
+            continue
+        paleta, rxs = sinal
+        try:
+            grade = overlay_cache.sinal(imagem_path, paleta)
+            pixel_x = np.trunc(((flat_lons[candidatos] - w) / (e - w)) * grade.width).astype(np.int64)
+            pixel_y = np.trunc(((n - flat_lats[candidatos]) / (n - s)) * grade.height).astype(np.int64)
+            nivel_ov = grade.nivel_many(pixel_x, pixel_y)
+            margem_ov = nivel_ov - rxs
+            atual_m, atual_n = flat_margem[candidatos], flat_nivel[candidatos]
+            # Maior margem; no empate, maior nível (independe da ordem dos overlays)
+            melhor = ~np.isnan(margem_ov) & (~(margem_ov <= atual_m) | ((margem_ov == atual_m) & (nivel_ov > atual_n)))
+            flat_nivel[candidatos[melhor]] = nivel_ov[melhor]
+            flat_margem[candidatos[melhor]] = margem_ov[melhor]
+        except Exception as ex:
+            logger.error("  -> ❌ Erro ao decodificar sinal do overlay %s: %s", imagem_path.name, ex, exc_info=True)
+    return nivel, margem
+
+
+def _sinal_pontos_proc(
+    lats: np.ndarray, lons: np.ndarray, overlays_info: List[OverlayInputData]
+) -> Tuple[np.ndarray, np.ndarray]:
+    return _sinal_pontos(lats, lons, overlays_info)
+
+
+def _com_sinal(entidade: Dict[str, Any], nivel: float, margem: float) -> Dict[str, Any]:
+    """Preenche `sinal_dbm`/`margem_db` (None quando não há nível decodificado)."""
+    entidade["sinal_dbm"] = None if np.isnan(nivel) else round(float(nivel), 1)
+    entidade["margem_db"] = None if np.isnan(margem) else round(float(margem), 1)
+    return entidade
+
+
 def _check_coverage_sync(
     entities: List[Dict[str, Any]],
     overlays_info: List[OverlayInputData],
-    signal_sources: List[Dict[str, float]]
+    signal_sources: List[Dict[str, float]],
+    job_id: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
     """
-    Verifica cobertura usando overlays RGBA (canal alpha) + zona de segurança de proximidade.
+    Verifica cobertura usando as máscaras compactadas dos overlays (alpha > SIM_ALPHA_THRESHOLD)
+    + zona de segurança de proximidade.
+    Vetorizada: proximidade entidades × fontes num único broadcast e amostragem
+    de cada máscara por indexação de arrays (só para entidades ainda não cobertas).
+    Também devolve `sinal_dbm`/`margem_db` decodificados da paleta (ver _sinal_pontos).
     (Síncrona; é rodada no threadpool.)
     """
     logger.info("🔎 (Thread) Verificando cobertura para %d entidades com %d fontes de sinal.",
                 len(entities), len(signal_sources))
-    imagens_abertas_cache: Dict[Path, Image.Image] = {}
+
+    lats = np.array([float(e["lat"]) for e in entities], dtype=np.float64)
+    lons = np.array([float(e["lon"]) for e in entities], dtype=np.float64)
+
+    # 1) Zona de segurança (próximo a qualquer fonte)
+    proximo, distancias = _zona_seguranca(lats, lons, signal_sources)
+    for i in np.flatnonzero(proximo):
+        logger.info("  -> 🎯 '%s' dentro da zona de segurança (%.1fm).",
+                    entities[i].get('nome', '<sem nome>'), float(distancias[i]))
+
+    # 2) Teste de cobertura pela máscara de cada overlay (cache LRU do processo)
+    coberto = _cobertura_pontos(lats, lons, overlays_info, proximo, job_id)
+
+    # 3) Nível de sinal / margem sobre a sensibilidade
+    nivel, margem = _sinal_pontos(lats, lons, overlays_info, job_id)
+
     entities_atualizadas: List[Dict[str, Any]] = []
+    for entity_data, ok, nv, mg in zip(entities, coberto.tolist(), nivel.tolist(), margem.tolist()):
+        entity_data_atualizado = entity_data.copy()
+        entity_data_atualizado["fora"] = not ok
+        entities_atualizadas.append(_com_sinal(entity_data_atualizado, nv, mg))
 
-    PROXIMITY_THRESHOLD_METERS = 20.0
+    logger.info("  -> (Thread) Concluída verificação de %d entidades.", len(entities))
+    return entities_atualizadas
 
-    try:
-        for entity_data in entities:
-            entity_data_atualizado = entity_data.copy()
-            lat, lon = entity_data["lat"], entity_data["lon"]
-            coberto = False
-
-            # 1) Zona de segurança (próximo à fonte)
-            for source in signal_sources:
-                distance = haversine(lat, lon, source['lat'], source['lon'])
-                if distance < PROXIMITY_THRESHOLD_METERS:
-                    coberto = True
-                    logger.info("  -> 🎯 '%s' dentro da zona de segurança (%.1fm).", entity_data.get('nome', '<sem nome>'), distance)
-                    break
-
-            if coberto:
-                entity_data_atualizado["fora"] = False
-                entities_atualizadas.append(entity_data_atualizado)
-                continue
 
-            # 2) Teste de cobertura por pixel alpha
-            for overlay_data in overlays_info:
-                bounds = list(overlay_data["bounds"])
-                if len(bounds) != 4:
-                    logger.warning("  -> ⚠️ Bounds inválidos para overlay: %s", bounds)
-                    continue
+# --- Cobertura ponderada por área (pivôs) ---
+
+_M_POR_GRAU_LAT = 111320.0
 
-                s, w, n, e = bounds
-                if s > n: s, n = n, s
-                if w > e: w, e = e, w
 
-                imagem_path = Path(overlay_data["imagem_path"])
+def _pegadas_pivos(pivos: List[Dict[str, Any]], n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Amostra a pegada de cada pivô numa grade n×n sobre seu retângulo envolvente.
+    Retorna (lats, lons, dentro), todos (P, n*n). Pegadas suportadas:
+    polígono `coordenadas` ([lat, lon]), setor (`angulo_central`/`abertura_arco`),
+    pac-man (`angulo_inicio`/`angulo_fim`) e círculo de `raio`. Sem geometria
+    conhecida, só o centro conta.
+    """
+    P = len(pivos)
+    base = (np.arange(n, dtype=np.float64) + 0.5) / n * 2.0 - 1.0
+    ux, uy = (a.ravel() for a in np.meshgrid(base, base))  # grade em [-1, 1]², x = leste
+
+    lat0 = np.array([float(p["lat"]) for p in pivos], dtype=np.float64)
+    lon0 = np.array([float(p["lon"]) for p in pivos], dtype=np.float64)
+    m_por_grau_lon = _M_POR_GRAU_LAT * np.maximum(np.cos(np.radians(lat0)), 1e-6)
+
+    meia_x = np.zeros(P)
+    meia_y = np.zeros(P)
+    centro_x = np.zeros(P)
+    centro_y = np.zeros(P)
+    raio = np.zeros(P)
+    ang_ini = np.zeros(P)      # setor angular aceito: [ang_ini, ang_ini + ang_larg) a partir do norte
+    ang_larg = np.full(P, 360.0)
+    poligonos: Dict[int, np.ndarray] = {}
+
+    for i, p in enumerate(pivos):
+        coords = p.get("coordenadas") or []
+        if p.get("tipo") == "custom" and len(coords) >= 3:
+            pts = np.asarray(coords, dtype=np.float64)[:, :2]
+            xy = np.column_stack([(pts[:, 1] - lon0[i]) * m_por_grau_lon[i], (pts[:, 0] - lat0[i]) * _M_POR_GRAU_LAT])
+            (x_min, y_min), (x_max, y_max) = xy.min(axis=0), xy.max(axis=0)
+            centro_x[i], centro_y[i] = (x_min + x_max) / 2, (y_min + y_max) / 2
+            meia_x[i], meia_y[i] = (x_max - x_min) / 2, (y_max - y_min) / 2
+            poligonos[i] = xy
+            continue
+        r = float(p.get("raio") or 0.0)
+        if r <= 0:
+            continue
+        raio[i] = meia_x[i] = meia_y[i] = r
+        if p.get("tipo") == "setorial" and p.get("angulo_central") is not None and p.get("abertura_arco") is not None:
+            ang_larg[i] = float(p["abertura_arco"])
+            ang_ini[i] = float(p["angulo_central"]) - ang_larg[i] / 2
+        elif p.get("tipo") == "pacman" and p.get("angulo_inicio") is not None and p.get("angulo_fim") is not None:
+            inicio, fim = float(p["angulo_inicio"]), float(p["angulo_fim"])
+            boca = (fim - inicio) % 360 or 360.0
+            ang_ini[i], ang_larg[i] = fim, 360.0 - boca
+
+    x = centro_x[:, None] + ux[None, :] * meia_x[:, None]
+    y = centro_y[:, None] + uy[None, :] * meia_y[:, None]
+
+    # Círculos / setores / pac-man
+    dist = np.hypot(x, y)
+    rumo = np.degrees(np.arctan2(x, y)) % 360.0
+    dentro = (raio[:, None] > 0) & (dist <= raio[:, None]) & (
+        ((rumo - ang_ini[:, None]) % 360.0 < ang_larg[:, None]) | (ang_larg[:, None] >= 360.0)
+    )
 
-                if not imagem_path.is_file():
-                    logger.warning("  -> ⚠️ Imagem não encontrada: %s. Pulando overlay.", imagem_path)
-                    continue
+    # Polígonos: teste par-ímpar vetorizado, vértices preenchidos até o maior polígono
+    if poligonos:
+        idx = np.fromiter(poligonos.keys(), dtype=np.int64)
+        v_max = max(len(v) for v in poligonos.values())
+        vx = np.empty((idx.size, v_max))
+        vy = np.empty((idx.size, v_max))
+        for j, i in enumerate(idx):
+            xy = poligonos[int(i)]
+            vx[j, :len(xy)], vy[j, :len(xy)] = xy[:, 0], xy[:, 1]
+            vx[j, len(xy):], vy[j, len(xy):] = xy[0, 0], xy[0, 1]  # fecha e repete (arestas nulas)
+        for a in range(0, idx.size, 128):  # lotes limitam a memória (lote × n² × vértices)
+            sel = idx[a:a + 128]
+            x1, y1 = vx[a:a + 128, None, :], vy[a:a + 128, None, :]
+            x2, y2 = np.roll(x1, -1, axis=2), np.roll(y1, -1, axis=2)
+            px, py = x[sel][:, :, None], y[sel][:, :, None]
+            cruza = ((y1 > py) != (y2 > py)) & (
+                px < (x2 - x1) * (py - y1) / np.where(y2 == y1, 1.0, y2 - y1) + x1
+            )
+            dentro[sel] = (np.count_nonzero(cruza, axis=2) % 2) == 1
+
+    # Sem geometria (ou pegada vazia): amostra única no centro
+    vazio = ~dentro.any(axis=1)
+    x[vazio], y[vazio] = 0.0, 0.0
+    dentro[vazio, 0] = True
+
+    lats = lat0[:, None] + y / _M_POR_GRAU_LAT
+    lons = lon0[:, None] + x / m_por_grau_lon[:, None]
+    return lats, lons, dentro
+
+
+def _check_area_coverage_sync(
+    pivos: List[Dict[str, Any]],
+    overlays_info: List[OverlayInputData],
+    signal_sources: List[Dict[str, float]],
+    job_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Cobertura ponderada por área: fração da pegada de cada pivô coberta pela
+    união dos overlays (`fracao_coberta`). `fora` passa a ser
+    fração < SIM_AREA_FRACAO_MINIMA, exceto na zona de segurança da fonte.
+    `sinal_dbm`/`margem_db` são os do centro do pivô.
+    Vetorizada para todos os pivôs de uma vez. (Síncrona; roda no threadpool.)
+    """
+    logger.info("🔎 (Thread) Cobertura por área para %d pivôs e %d overlays.", len(pivos), len(overlays_info))
+    if not pivos:
+        return []
 
-                try:
-                    if imagem_path not in imagens_abertas_cache:
-                        imagens_abertas_cache[imagem_path] = Image.open(imagem_path).convert("RGBA")
-
-                    pil_image = imagens_abertas_cache[imagem_path]
-                    img_width, img_height = pil_image.size
-
-                    delta_lon = e - w
-                    delta_lat = n - s
-                    if delta_lon == 0 or delta_lat == 0:
-                        continue
-
-                    pixel_x = int(((lon - w) / delta_lon) * img_width)
-                    pixel_y = int(((n - lat) / delta_lat) * img_height)
-
-                    if 0 <= pixel_x < img_width and 0 <= pixel_y < img_height:
-                        _, _, _, alpha = pil_image.getpixel((pixel_x, pixel_y))
-                        # MUDANÇA 3: Usa o parâmetro de settings em vez da constante
-                        if alpha > settings.SIM_ALPHA_THRESHOLD:
-                            coberto = True
-                            break
-                except Exception as ex:
-                    logger.error("  -> ❌ Erro ao analisar overlay p/ '%s': %s",
-                                entity_data.get('nome', '<sem nome>'), ex, exc_info=True)
-
-            entity_data_atualizado["fora"] = not coberto
-            entities_atualizadas.append(entity_data_atualizado)
-    finally:
-        for img_obj in imagens_abertas_cache.values():
-            try:
-                img_obj.close()
-            except Exception:
-                pass
+    lats, lons, dentro = _pegadas_pivos(pivos, settings.SIM_AREA_AMOSTRAS)
+    coberto = _cobertura_pontos(lats, lons, overlays_info, ~dentro, job_id)  # fora da pegada: não testa
+    fracao = np.count_nonzero(coberto & dentro, axis=1) / np.count_nonzero(dentro, axis=1)
 
-    logger.info("  -> (Thread) Concluída verificação de %d entidades.", len(entities))
-    return entities_atualizadas
+    centros_lat = np.array([float(p["lat"]) for p in pivos], dtype=np.float64)
+    centros_lon = np.array([float(p["lon"]) for p in pivos], dtype=np.float64)
+    proximo, _ = _zona_seguranca(centros_lat, centros_lon, signal_sources)
+    nivel, margem = _sinal_pontos(centros_lat, centros_lon, overlays_info, job_id)  # no centro do pivô
+
+    resultado: List[Dict[str, Any]] = []
+    for pivo, f, perto, nv, mg in zip(pivos, fracao.tolist(), proximo.tolist(), nivel.tolist(), margem.tolist()):
+        atualizado = pivo.copy()
+        atualizado["fracao_coberta"] = round(f, 4)
+        atualizado["fora"] = not (perto or f >= settings.SIM_AREA_FRACAO_MINIMA)
+        resultado.append(_com_sinal(atualizado, nv, mg))
+    return resultado
 
 
 async def verificar_cobertura_pivos(
     pivos: List[Dict[str, Any]],
     overlays_info: List[OverlayInputData],
-    signal_sources: List[Dict[str, float]]
+    signal_sources: List[Dict[str, float]],
+    modo_cobertura: str = "centro",
+    job_id: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
-    """Verifica cobertura de pivôs no threadpool."""
-    logger.info("Delegando verificação de %d pivôs p/ threadpool.", len(pivos))
+    """
+    Verifica cobertura de pivôs no threadpool.
+    modo_cobertura: "centro" (pixel do centro) ou "area" (fração da pegada coberta).
+    job_id: usa a grade composta incremental do job (ver job_coverage).
+    """
+    logger.info("Delegando verificação de %d pivôs p/ threadpool (modo=%s).", len(pivos), modo_cobertura)
+    if modo_cobertura == "area":
+        return await run_in_threadpool(
+            _check_area_coverage_sync, pivos=pivos, overlays_info=overlays_info,
+            signal_sources=signal_sources, job_id=job_id,
+        )
     return await run_in_threadpool(
-        _check_coverage_sync, entities=pivos, overlays_info=overlays_info, signal_sources=signal_sources
+        _check_coverage_sync, entities=pivos, overlays_info=overlays_info,
+        signal_sources=signal_sources, job_id=job_id,
     )
 
 
 async def verificar_cobertura_bombas(
     bombas: List[Dict[str, Any]],
     overlays_info: List[OverlayInputData],
-    signal_sources: List[Dict[str, float]]
+    signal_sources: List[Dict[str, float]],
+    job_id: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
-    """Verifica cobertura de bombas no threadpool."""
+    """Verifica cobertura de bombas no threadpool (job_id: ver verificar_cobertura_pivos)."""
     logger.info("Delegando verificação de %d bombas p/ threadpool.", len(bombas))
     return await run_in_threadpool(
-        _check_coverage_sync, entities=bombas, overlays_info=overlays_info, signal_sources=signal_sources
+        _check_coverage_sync, entities=bombas, overlays_info=overlays_info,
+        signal_sources=signal_sources, job_id=job_id,
     )
 
 
-async def obter_perfil_elevacao(pontos: List[Tuple[float, float]], alt1: float, alt2: float) -> ElevationProfileResult:
+# --- Redundância (quantas fontes cobrem cada ponto) ---
+
+# Cores do raster de redundância: 1 fonte, 2 fontes, 3+ fontes (0 = transparente).
+_CORES_REDUNDANCIA = ((1, (230, 57, 70)), (2, (244, 162, 97)), (3, (42, 157, 143)))
+
+
+def _contagem_pontos(
+    lats: np.ndarray, lons: np.ndarray, overlays_info: List[OverlayInputData], job_id: Optional[str] = None
+) -> np.ndarray:
+    """Quantos overlays cobrem cada ponto. Com `job_id`, consulta a grade composta (em cache) do job."""
+    if job_id is not None:
+        grid = job_coverage.get(job_id)
+        try:
+            with grid.lock:
+                _sincronizar_grade(grid, overlays_info)
+                contagem = grid.count_at(lats, lons)
+                incerto = grid.incerto_at(lats, lons)
+        except MemoryError as ex:
+            logger.warning("  -> ⚠️ %s Contando overlay a overlay.", ex)
+            job_coverage.drop(job_id)
+        else:
+            if incerto.any():
+                contagem[incerto] = _contagem_pontos(lats[incerto], lons[incerto], overlays_info)
+            return contagem
+
+    contagem = np.zeros(lats.shape, dtype=np.int64)
+    validos = _overlays_validos(overlays_info)
+    if not validos or lats.size == 0:
+        return contagem
+    flat_lats, flat_lons, flat = lats.reshape(-1), lons.reshape(-1), contagem.reshape(-1)
+    for (_, imagem_path, bounds, (s, w, n, e)), candidatos in zip(
+        validos, _candidatos_por_overlay(flat_lats, flat_lons, validos, np.arange(flat.size))
+    ):
+        if candidatos.size == 0:
+            continue
+        try:
+            mascara = overlay_cache.mask(imagem_path, bounds)
+            pixel_x = np.trunc(((flat_lons[candidatos] - w) / (e - w)) * mascara.width).astype(np.int64)
+            pixel_y = np.trunc(((n - flat_lats[candidatos]) / (n - s)) * mascara.height).astype(np.int64)
+            flat[candidatos[mascara.covered_many(pixel_x, pixel_y)]] += 1
+        except Exception as ex:
+            logger.error("  -> ❌ Erro ao analisar overlay %s: %s", imagem_path.name, ex, exc_info=True)
+    return contagem
+
+
+def _raster_redundancia(job_id: str, overlays_info: List[OverlayInputData], output_path: Path) -> Optional[Dict[str, Any]]:
     """
-    Perfil de elevação entre 2 pontos (ordem importa, pois alt1/alt2 são aplicadas nos extremos).
-    Usa cache local para reduzir chamadas à API.
+    Grava o PNG da contagem de fontes por pixel (grade composta do job) em
+    `output_path`. Só regrava quando o conjunto de overlays mudou.
     """
-    if len(pontos) != 2:
-        # MUDANÇA 4: Lança exceção específica para erro de lógica interna
-        raise DEMProcessingError("São necessários exatamente dois pontos para o perfil de elevação.")
+    grid = job_coverage.get(job_id)
+    try:
+        with grid.lock:
+            _sincronizar_grade(grid, overlays_info)
+            raster = grid.raster()
+            if raster is None:
+                return None
+            contagem, bounds = raster
+            if grid.raster_salvo != (grid.versao, output_path) or not output_path.is_file():
+                rgba = np.zeros(contagem.shape + (4,), dtype=np.uint8)
+                for minimo, cor in _CORES_REDUNDANCIA:
+                    rgba[contagem >= minimo] = (*cor, 255)
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                Image.fromarray(rgba, mode="RGBA").save(output_path, format="PNG")
+                grid.raster_salvo = (grid.versao, output_path)
+            return {"path": output_path, "bounds": [round(v, 6) for v in bounds], "max": int(contagem.max())}
+    except MemoryError as ex:
+        logger.warning("  -> ⚠️ %s Raster de redundância indisponível.", ex)
+        job_coverage.drop(job_id)
+        return None
+
+
+def _redundancia_sync(
+    pivos: List[Dict[str, Any]],
+    bombas: List[Dict[str, Any]],
+    overlays_info: List[OverlayInputData],
+    job_id: str,
+    raster_path: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Contagem de fontes por entidade (`redundancia`), resumo e raster. (Síncrona; roda no threadpool.)"""
+    entidades = pivos + bombas
+    lats = np.array([float(e["lat"]) for e in entidades], dtype=np.float64)
+    lons = np.array([float(e["lon"]) for e in entidades], dtype=np.float64)
+    contagem = _contagem_pontos(lats, lons, overlays_info, job_id).tolist()
+
+    resultado = [dict(e, redundancia=int(c)) for e, c in zip(entidades, contagem)]
+    return {
+        "pivos": resultado[:len(pivos)],
+        "bombas": resultado[len(pivos):],
+        "resumo": {
+            "sem_cobertura": sum(1 for c in contagem if c == 0),
+            "fonte_unica": sum(1 for c in contagem if c == 1),
+            "redundante": sum(1 for c in contagem if c >= 2),
+        },
+        "raster": _raster_redundancia(job_id, overlays_info, raster_path) if raster_path is not None else None,
+    }
 
-    cache_key_string = (
-        f"p1:{pontos[0][0]:.6f},{pontos[0][1]:.6f}|"
-        f"p2:{pontos[1][0]:.6f},{pontos[1][1]:.6f}|"
-        f"alt1:{alt1}|alt2:{alt2}"
-    )
-    cache_hash = hashlib.sha256(cache_key_string.encode()).hexdigest()
-    cache_dir = settings.ELEVATION_CACHE_PATH
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    cache_file_path = cache_dir / f"{cache_hash}.json"
 
-    if cache_file_path.exists():
-        logger.info("CACHE HIT: perfil %s", cache_hash[:12])
-        with open(cache_file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+async def calcular_redundancia(
+    pivos: List[Dict[str, Any]],
+    bombas: List[Dict[str, Any]],
+    overlays_info: List[OverlayInputData],
+    job_id: str,
+    raster_path: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Quantas fontes (overlays) cobrem cada pivô/bomba; com `raster_path`, grava o raster de contagem."""
+    logger.info("Delegando redundância de %d entidades e %d overlays p/ threadpool.",
+                len(pivos) + len(bombas), len(overlays_info))
+    return await run_in_threadpool(_redundancia_sync, pivos, bombas, overlays_info, job_id, raster_path)
 
-    num_passos = settings.SIM_ELEVATION_STEPS
-    logger.info("CACHE MISS: calculando perfil (%d passos) entre %s e %s.",
-                num_passos, pontos[0], pontos[1])
 
-    pontos_amostrados = [
-        (pontos[0][0] + (pontos[1][0] - pontos[0][0]) * i / num_passos,
-         pontos[0][1] + (pontos[1][1] - pontos[0][1]) * i / num_passos)
-        for i in range(num_passos + 1)
-    ]
+async def reavaliar_entidades(
+    pivos: List[Dict[str, Any]],
+    bombas: List[Dict[str, Any]],
+    overlays_info: List[OverlayInputData],
+    signal_sources: List[Dict[str, float]],
+    modo_cobertura: str = "centro",
+    job_id: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Verifica pivôs e bombas em paralelo (listas vazias não disparam verificação)."""
+    async def _vazio() -> List[Dict[str, Any]]:
+        return []
 
+    return tuple(await asyncio.gather(
+        verificar_cobertura_pivos(pivos, overlays_info, signal_sources, modo_cobertura, job_id)
+        if pivos else _vazio(),
+        verificar_cobertura_bombas(bombas, overlays_info, signal_sources, job_id)
+        if bombas else _vazio(),
+    ))
+
+
+# Máximo de locais por pedido aceito pela OpenTopoData.
+_OPENTOPODATA_MAX_LOCATIONS = 100
+
+
+async def _elevacoes_remotas(pontos_amostrados: List[Tuple[float, float]]) -> List[float]:
+    """Cotas dos pontos pela API pública OpenTopoData (SRTM 90 m, interpolação cúbica)."""
     coords_param_str = "|".join([f"{lat:.6f},{lon:.6f}" for lat, lon in pontos_amostrados])
     url_api_elevacao = f"https://api.opentopodata.org/v1/srtm90m?locations={coords_param_str}&interpolation=cubic"
 
-    async with await cloudrf_service.get_http_client() as client:
-        try:
-            response = await client.get(url_api_elevacao, timeout=20.0)
-            response.raise_for_status()
-            dados_api = response.json()
-        except httpx.HTTPStatusError as e_http:
-            logger.error("❌ Falha HTTP elevacao: %s %s", e_http.response.status_code, e_http.response.text, exc_info=True)
-            # MUDANÇA 5: Lança exceção específica para falha de API externa
-            raise DEMProcessingError(f"API de elevação respondeu com erro (HTTP {e_http.response.status_code}).")
-        except httpx.RequestError as e_req:
-            logger.error("❌ Erro de rede elevacao: %s", e_req, exc_info=True)
-            raise DEMProcessingError(f"Falha na comunicação com a API de elevação: {e_req}")
-        except Exception as e_geral:
-            logger.error("❌ Erro geral elevacao: %s", e_geral, exc_info=True)
-            raise DEMProcessingError(f"Erro inesperado ao processar dados de elevação: {e_geral}")
+    client = cloudrf_service.get_http_client(url_api_elevacao)
+    try:
+        response = await cloudrf_service.request_with_retries(client, "GET", url_api_elevacao, timeout=20.0)
+        response.raise_for_status()
+        dados_api = response.json()
+    except httpx.HTTPStatusError as e_http:
+        logger.error("❌ Falha HTTP elevacao: %s %s", e_http.response.status_code, e_http.response.text, exc_info=True)
+        # MUDANÇA 5: Lança exceção específica para falha de API externa
+        raise DEMProcessingError(f"API de elevação respondeu com erro (HTTP {e_http.response.status_code}).")
+    except httpx.RequestError as e_req:
+        logger.error("❌ Erro de rede elevacao: %s", e_req, exc_info=True)
+        raise DEMProcessingError(f"Falha na comunicação com a API de elevação: {e_req}")
+    except Exception as e_geral:
+        logger.error("❌ Erro geral elevacao: %s", e_geral, exc_info=True)
+        raise DEMProcessingError(f"Erro inesperado ao processar dados de elevação: {e_geral}")
 
     results = (dados_api or {}).get("results") or []
     if len(results) != len(pontos_amostrados):
@@ -255,117 +714,261 @@ async def obter_perfil_elevacao(pontos: List[Tuple[float, float]], alt1: float,
     elevacoes_terreno = [res.get("elevation") for res in results]
     if any(e is None for e in elevacoes_terreno):
         raise DEMProcessingError("Dados de elevação inválidos (valor 'null' encontrado).")
+    return elevacoes_terreno
 
-    logger.info("  -> Elevações (Min: %.1fm, Max: %.1fm)", min(elevacoes_terreno), max(elevacoes_terreno))
 
-    elevacao_total_ponto1 = elevacoes_terreno[0] + alt1
-    elevacao_total_ponto2 = elevacoes_terreno[-1] + alt2
-    linha_visada_elev = [
-        elevacao_total_ponto1 + i * (elevacao_total_ponto2 - elevacao_total_ponto1) / num_passos
-        for i in range(num_passos + 1)
-    ]
+def _linhas_amostradas(
+    origens: np.ndarray, destinos: np.ndarray, num_passos: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pontos (lat, lon) de cada linha origem -> destino, (linhas, num_passos + 1)."""
+    i = np.arange(num_passos + 1)
+    lats = origens[:, 0:1] + (destinos[:, 0:1] - origens[:, 0:1]) * i / num_passos
+    lons = origens[:, 1:2] + (destinos[:, 1:2] - origens[:, 1:2]) * i / num_passos
+    return lats, lons
 
-    ponto_bloqueio: Optional[BlockageInfo] = None
-    max_diferenca_bloqueio = 0.0
-
-    for i in range(1, num_passos):
-        elev_terreno_atual = elevacoes_terreno[i]
-        elev_visada_atual = linha_visada_elev[i]
-        if elev_terreno_atual > elev_visada_atual:
-            diferenca = elev_terreno_atual - elev_visada_atual
-            if diferenca > max_diferenca_bloqueio:
-                max_diferenca_bloqueio = diferenca
-                ponto_bloqueio = {
-                    "lat": pontos_amostrados[i][0],
-                    "lon": pontos_amostrados[i][1],
-                    "elev": float(elev_terreno_atual),
-                    "diff": float(diferenca),
-                    "dist": i / num_passos
-                }
-
-    idx_elev_max = int(np.argmax(elevacoes_terreno))
-    ponto_mais_alto: Dict[str, Optional[float]] = {
-        "lat": pontos_amostrados[idx_elev_max][0],
-        "lon": pontos_amostrados[idx_elev_max][1],
-        "elev": float(elevacoes_terreno[idx_elev_max])
-    }
 
-    perfil_final: List[ElevationPoint] = [
-        {"lat": pontos_amostrados[i][0], "lon": pontos_amostrados[i][1],
-            "elev": float(elevacoes_terreno[i]), "dist": i / num_passos}
-        for i in range(num_passos + 1)
-    ]
+def _avaliar_perfis(
+    lats: np.ndarray, lons: np.ndarray, elevacoes: np.ndarray, alt1: np.ndarray, alt2: np.ndarray
+) -> List[ElevationProfileResult]:
+    """
+    Visada, maior bloqueio e ponto mais alto de várias linhas de uma vez
+    (arrays (linhas, passos + 1); alturas por linha aplicadas nos extremos).
+    """
+    num_passos = elevacoes.shape[1] - 1
+    i = np.arange(num_passos + 1)
+    topo1 = elevacoes[:, 0] + alt1
+    topo2 = elevacoes[:, -1] + alt2
+    linha_visada = topo1[:, None] + i * (topo2 - topo1)[:, None] / num_passos
+
+    # Bloqueio = maior excesso do terreno sobre a visada nos pontos internos
+    excesso = np.where(elevacoes > linha_visada, elevacoes - linha_visada, 0.0)[:, 1:num_passos]
+    idx_bloqueio = np.argmax(excesso, axis=1) + 1 if num_passos > 1 else np.zeros(len(elevacoes), dtype=np.int64)
+    bloqueado = excesso.max(axis=1, initial=0.0) > 0
+    idx_max = np.argmax(elevacoes, axis=1)
+
+    dists = [k / num_passos for k in range(num_passos + 1)]
+    resultados: List[ElevationProfileResult] = []
+    for r in range(elevacoes.shape[0]):
+        lat_r, lon_r, elev_r = lats[r].tolist(), lons[r].tolist(), elevacoes[r].tolist()
+        ponto_bloqueio: Optional[BlockageInfo] = None
+        if bloqueado[r]:
+            j = int(idx_bloqueio[r])
+            ponto_bloqueio = {
+                "lat": lat_r[j], "lon": lon_r[j], "elev": elev_r[j],
+                "diff": float(excesso[r, j - 1]), "dist": dists[j],
+            }
+        j = int(idx_max[r])
+        resultados.append({
+            "perfil": [
+                {"lat": lat_r[k], "lon": lon_r[k], "elev": elev_r[k], "dist": dists[k]}
+                for k in range(num_passos + 1)
+            ],
+            "bloqueio": ponto_bloqueio,
+            "ponto_mais_alto": {"lat": lat_r[j], "lon": lon_r[j], "elev": elev_r[j]},
+        })
+    return resultados
 
-    final_result: ElevationProfileResult = {
-        "perfil": perfil_final,
-        "bloqueio": ponto_bloqueio,
-        "ponto_mais_alto": ponto_mais_alto
-    }
-    with open(cache_file_path, "w", encoding="utf-8") as f:
-        json.dump(final_result, f, indent=4)
-    logger.info(" -> Perfil salvo no cache: %s", cache_file_path.name)
-    return final_result
+
+def _arquivo_cache_terreno(pontos: List[Tuple[float, float]], num_passos: int) -> Path:
+    """Cache só do terreno da linha: independe das alturas, a visada é recalculada a cada pedido."""
+    cache_key_string = (
+        f"p1:{pontos[0][0]:.6f},{pontos[0][1]:.6f}|"
+        f"p2:{pontos[1][0]:.6f},{pontos[1][1]:.6f}|"
+        f"passos:{num_passos}"
+    )
+    cache_hash = hashlib.sha256(cache_key_string.encode()).hexdigest()
+    return settings.ELEVATION_CACHE_PATH / "terreno" / f"{cache_hash}.json"
 
 
-def _download_file(url: str, output_path: Path) -> None:
-    """Faz o download de um arquivo de forma robusta."""
+def _ler_cache_terreno(cache_file_path: Path) -> Optional[List[float]]:
+    """Terreno em cache; arquivo ilegível ou fora do formato conta como miss (e é apagado)."""
+    if not cache_file_path.exists():
+        return None
+    try:
+        with open(cache_file_path, "r", encoding="utf-8") as f:
+            elevacoes = json.load(f)["elevacoes"]
+        if len(elevacoes) != settings.SIM_ELEVATION_STEPS + 1 or any(e is None for e in elevacoes):
+            raise ValueError("número de amostras inesperado")
+        return [float(e) for e in elevacoes]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("  -> ⚠️ Cache de terreno inválido (%s): %s. Descartando.", cache_file_path.name, e)
+        cache_file_path.unlink(missing_ok=True)
+        return None
+
+
+def _salvar_cache_terreno(cache_file_path: Path, elevacoes: List[float]) -> None:
+    """Escrita atômica (pedidos concorrentes da mesma linha gravam o mesmo arquivo)."""
+    cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_file_path.with_name(f".{cache_file_path.name}.{uuid.uuid4().hex}.tmp")
     try:
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        with requests.get(url, stream=True, timeout=90) as r:
-            r.raise_for_status()
-            with open(output_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-        logger.info("    -> (DEM) Download concluído: %s", output_path)
-    except requests.RequestException as e:
-        logger.error("    -> (DEM) ❌ Falha no download de %s: %s", url, e)
-        # MUDANÇA 6: Lança exceção específica
-        raise DEMProcessingError(f"Falha ao baixar o arquivo de elevação: {e}")
-
-
-def _download_and_clip_dem(bounds_dem_wgs84: Tuple[float, float, float, float], output_dem_path: Path) -> None:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"elevacoes": elevacoes}, f)
+        os.replace(tmp_path, cache_file_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+async def _terreno_da_linha(
+    pontos: List[Tuple[float, float]], lats: np.ndarray, lons: np.ndarray, cache_file_path: Path
+) -> np.ndarray:
+    """Cotas da linha (1D) do MDT local ou, se não houver, da API pública; grava no cache."""
+    elevacoes = None
+    if settings.SIM_ELEVATION_LOCAL:
+        elevacoes = await run_in_threadpool(dem_store.perfil_local, lats, lons)
+        if elevacoes is not None and np.isnan(elevacoes).any():
+            elevacoes = None  # linha passa por vazio do SRTM
+        if elevacoes is not None:
+            logger.info("  -> Perfil amostrado do MDT local (%s).", settings.SIM_ELEVATION_INTERPOLACAO)
+    if elevacoes is None:
+        elevacoes = np.array(await _elevacoes_remotas(list(zip(lats.tolist(), lons.tolist()))), dtype=np.float64)
+
+    logger.info("  -> Elevações (Min: %.1fm, Max: %.1fm)", elevacoes.min(), elevacoes.max())
+    await run_in_threadpool(_salvar_cache_terreno, cache_file_path, elevacoes.tolist())
+    logger.info(" -> Terreno salvo no cache: %s", cache_file_path.name)
+    return elevacoes
+
+
+async def _terrenos_locais(
+    caminhos: List[Path], lats: np.ndarray, lons: np.ndarray
+) -> Dict[Path, np.ndarray]:
     """
-    Baixa o DEM de uma fonte pública (AWS) e recorta usando Rasterio.
+    Terreno de várias linhas do MDT local, baixando antes os tiles que faltam
+    (até SIM_ELEVATION_BATCH_MAX_TILES, os mais usados primeiro). Linhas que
+    tocam os mesmos tiles são amostradas numa só interpolação; as que cruzam
+    vazios do SRTM ou tiles indisponíveis ficam de fora. Grava no cache.
     """
-    min_lon, min_lat, max_lon, max_lat = bounds_dem_wgs84
-    lat_tile, lon_tile = int(np.floor(min_lat)), int(np.floor(min_lon))
-    N_S, W_E = ('N' if lat_tile >= 0 else 'S'), ('W' if lon_tile < 0 else 'E')
-    lat_str, lon_str = f"{abs(lat_tile):02d}", f"{abs(lon_tile):03d}"
-    tile_url = f"https://elevation-tiles-prod.s3.amazonaws.com/skadi/{N_S}{lat_str}/{N_S}{lat_str}{W_E}{lon_str}.hgt.gz"
+    grupos: Dict[Tuple[str, ...], List[int]] = {}
+    for k in range(len(caminhos)):
+        grupos.setdefault(dem_store.tiles_do_perfil(lats[k], lons[k]), []).append(k)
+    uso: Dict[str, int] = {}
+    for nomes, linhas in grupos.items():
+        for nome in nomes:
+            uso[nome] = uso.get(nome, 0) + len(linhas)
+    ausentes = await run_in_threadpool(lambda: [n for n in uso if not dem_store.tile_em_disco(n)])
+    if ausentes:
+        ausentes.sort(key=lambda n: -uso[n])
+        baixar = ausentes[:settings.SIM_ELEVATION_BATCH_MAX_TILES]
+        logger.info("⛰️  Perfis em lote: baixando %d de %d tiles SRTM ausentes.", len(baixar), len(ausentes))
+        await dem_store.baixar_tiles(baixar)
+
+    def _amostrar() -> Dict[Path, np.ndarray]:
+        prontos: Dict[Path, np.ndarray] = {}
+        for linhas in grupos.values():
+            cotas = dem_store.perfil_local(lats[linhas], lons[linhas])
+            if cotas is None:
+                continue
+            for k, terreno in zip(linhas, cotas):
+                if not np.isnan(terreno).any():
+                    prontos[caminhos[k]] = terreno
+        for c, terreno in prontos.items():
+            _salvar_cache_terreno(c, terreno.tolist())
+        return prontos
 
-    dem_temp_dir = output_dem_path.parent / "temp"
-    dem_temp_dir.mkdir(parents=True, exist_ok=True)
-    temp_gz_path = dem_temp_dir / f"{N_S}{lat_str}{W_E}{lon_str}.hgt.gz"
+    return await run_in_threadpool(_amostrar)
 
-    logger.info("    -> (DEM) Baixando tile de elevação de: %s", tile_url)
-    _download_file(tile_url, temp_gz_path)
 
-    try:
-        logger.info("    -> (DEM) Recortando tile para os limites da área...")
-        geom = box(min_lon, min_lat, max_lon, max_lat)
-        with rasterio.open(f"gzip://{temp_gz_path}") as src:
-            out_image, out_transform = rasterio.mask.mask(src, [geom], crop=True)
-            out_meta = src.meta.copy()
-
-        out_meta.update({
-            "driver": "GTiff", "height": out_image.shape[1],
-            "width": out_image.shape[2], "transform": out_transform,
-            "compress": "deflate"
-        })
+async def _terrenos_remotos(
+    caminhos: List[Path], lats: np.ndarray, lons: np.ndarray
+) -> Dict[Path, Union[np.ndarray, Exception]]:
+    """
+    Terreno de várias linhas pela API pública, com os pontos de todas as linhas
+    em pedidos de até _OPENTOPODATA_MAX_LOCATIONS, um de cada vez (o limitador
+    do host é 1 req/s). Na primeira falha os pedidos restantes não são feitos e
+    as linhas sem terreno recebem o erro. Grava no cache as linhas completas.
+    """
+    pontos = list(zip(lats.ravel().tolist(), lons.ravel().tolist()))
+    cotas = np.full(len(pontos), np.nan)
+    erro: Optional[Exception] = None
+    for inicio in range(0, len(pontos), _OPENTOPODATA_MAX_LOCATIONS):
+        fim = inicio + _OPENTOPODATA_MAX_LOCATIONS
+        try:
+            cotas[inicio:fim] = await _elevacoes_remotas(pontos[inicio:fim])
+        except DEMProcessingError as e:
+            erro = e
+            break
+    cotas = cotas.reshape(lats.shape)
 
-        with rasterio.open(output_dem_path, "w", **out_meta) as dest:
-            dest.write(out_image)
-        logger.info("    -> (DEM) Arquivo DEM recortado e salvo em: %s", output_dem_path)
+    resultado: Dict[Path, Union[np.ndarray, Exception]] = {}
+    for c, terreno in zip(caminhos, cotas):
+        resultado[c] = erro if np.isnan(terreno).any() else terreno
+    prontos = [(c, t) for c, t in resultado.items() if not isinstance(t, Exception)]
+    await run_in_threadpool(lambda: [_salvar_cache_terreno(c, t.tolist()) for c, t in prontos])
+    return resultado
 
-    except Exception as e:
-        logger.error("    -> (DEM) ❌ Falha ao recortar o DEM com Rasterio: %s", e, exc_info=True)
-        raise DEMProcessingError(f"Falha ao processar o arquivo DEM: {e}")
-    finally:
-        try:
-            temp_gz_path.unlink(missing_ok=True)
-        except Exception:
-            pass
+
+async def obter_perfil_elevacao(pontos: List[Tuple[float, float]], alt1: float, alt2: float) -> ElevationProfileResult:
+    """
+    Perfil de elevação entre 2 pontos (ordem importa, pois alt1/alt2 são aplicadas nos extremos).
+    O terreno vem do MDT já em cache (dem_store) e, se não houver, da API pública.
+    O cache guarda só o terreno da linha: outras alturas reaproveitam a mesma amostragem.
+    """
+    if len(pontos) != 2:
+        # MUDANÇA 4: Lança exceção específica para erro de lógica interna
+        raise DEMProcessingError("São necessários exatamente dois pontos para o perfil de elevação.")
+
+    num_passos = settings.SIM_ELEVATION_STEPS
+    lats, lons = _linhas_amostradas(
+        np.array([pontos[0]], dtype=np.float64), np.array([pontos[1]], dtype=np.float64), num_passos
+    )
+    cache_file_path = _arquivo_cache_terreno(pontos, num_passos)
+    cached = await run_in_threadpool(_ler_cache_terreno, cache_file_path)
+    if cached is not None:
+        logger.info("CACHE HIT: terreno %s", cache_file_path.stem[:12])
+        elevacoes = np.array(cached, dtype=np.float64)
+    else:
+        logger.info("CACHE MISS: calculando perfil (%d passos) entre %s e %s.",
+                    num_passos, pontos[0], pontos[1])
+        elevacoes = await _terreno_da_linha(pontos, lats[0], lons[0], cache_file_path)
+
+    return _avaliar_perfis(lats, lons, elevacoes[None, :], np.array([alt1]), np.array([alt2]))[0]
+
+
+async def obter_perfis_elevacao(
+    pares: List[Tuple[Tuple[float, float], Tuple[float, float], float, float]],
+) -> List[Union[ElevationProfileResult, Exception]]:
+    """
+    Vários perfis (origem, destino, alt1, alt2) de uma vez. Cada linha distinta
+    é amostrada uma só vez (cache de terreno, senão MDT local, baixando os
+    tiles que faltam, senão a API pública com várias linhas por pedido) e a
+    visada de todos os pares é avaliada junta. Erros são devolvidos por item.
+    """
+    num_passos = settings.SIM_ELEVATION_STEPS
+    lats, lons = _linhas_amostradas(
+        np.array([p[0] for p in pares], dtype=np.float64), np.array([p[1] for p in pares], dtype=np.float64),
+        num_passos,
+    )
+    caminhos = [_arquivo_cache_terreno([a, b], num_passos) for a, b, _, _ in pares]
+    primeiro: Dict[Path, int] = {}
+    for j, c in enumerate(caminhos):
+        primeiro.setdefault(c, j)
+    lidos = await run_in_threadpool(lambda: [_ler_cache_terreno(c) for c in primeiro])
+    terrenos: Dict[Path, Any] = {c: t for c, t in zip(primeiro, lidos) if t is not None}
+    faltam = [c for c in primeiro if c not in terrenos]
+    logger.info("⛰️  Perfis em lote: %d pedidos, %d linhas distintas, %d em cache.",
+                len(pares), len(primeiro), len(primeiro) - len(faltam))
+
+    if faltam and settings.SIM_ELEVATION_LOCAL:
+        linhas = [primeiro[c] for c in faltam]
+        terrenos.update(await _terrenos_locais(faltam, lats[linhas], lons[linhas]))
+        faltam = [c for c in faltam if c not in terrenos]
+
+    if faltam:
+        # Vazios do SRTM e tiles indisponíveis: API pública, várias linhas por pedido
+        linhas = [primeiro[c] for c in faltam]
+        logger.info("⛰️  Perfis em lote: %d linhas pela API remota.", len(faltam))
+        terrenos.update(await _terrenos_remotos(faltam, lats[linhas], lons[linhas]))
+
+    resultados: List[Any] = [terrenos[c] if isinstance(terrenos[c], Exception) else None for c in caminhos]
+    ok = [j for j, r in enumerate(resultados) if r is None]
+    if ok:
+        avaliados = _avaliar_perfis(
+            lats[ok], lons[ok], np.array([terrenos[caminhos[j]] for j in ok], dtype=np.float64),
+            np.array([pares[j][2] for j in ok], dtype=np.float64),
+            np.array([pares[j][3] for j in ok], dtype=np.float64),
+        )
+        for j, r in zip(ok, avaliados):
+            resultados[j] = r
+    return resultados
 
 
 async def obter_dem_para_area_geografica(
@@ -374,9 +977,6 @@ async def obter_dem_para_area_geografica(
 ) -> Tuple[np.ndarray, rasterio.Affine, rasterio.crs.CRS, Optional[Any]]:
     logger.info("  -> (DEM) Obtendo DEM para (%.4f, %.4f), raio: %.1fkm",
                 lat_central, lon_central, raio_busca_km)
-    dem_cache_dir = settings.ARQUIVOS_DIR_PATH / "dem_cache"
-    dem_cache_dir.mkdir(parents=True, exist_ok=True)
-
     raio_busca_m = raio_busca_km * 1000
     graus_lat_por_metro = 1.0 / 111000.0
     graus_lon_por_metro_aprox = 1.0 / (111000.0 * cos(radians(lat_central)))
@@ -388,21 +988,9 @@ async def obter_dem_para_area_geografica(
         lon_central + offset_lon, lat_central + offset_lat
     )
 
-    nome_arquivo_dem = f"dem_clip_lat{lat_central:.4f}_lon{lon_central:.4f}_r{int(raio_busca_m)}m.tif"
-    nome_arquivo_dem = nome_arquivo_dem.replace(".", "_").replace("-", "m")
-    path_arquivo_dem_local = dem_cache_dir / nome_arquivo_dem
-
     try:
-        if not path_arquivo_dem_local.exists():
-            await run_in_threadpool(_download_and_clip_dem, bounds_dem_wgs84, path_arquivo_dem_local)
-        else:
-            logger.info("    -> (DEM) Usando DEM do cache: %s", path_arquivo_dem_local)
-
-        def _read_rasterio_dem(path: Path) -> Tuple[np.ndarray, rasterio.Affine, rasterio.crs.CRS, Optional[Any]]:
-            with rasterio.open(path) as src:
-                return src.read(1), src.transform, src.crs, src.nodata
-
-        return await run_in_threadpool(_read_rasterio_dem, path_arquivo_dem_local)
+        # Janela do tile SRTM local (baixado uma vez por tile, lido por memmap)
+        return await dem_store.ler_area(*bounds_dem_wgs84)
     except DEMProcessingError:  # Re-lança exceções específicas que já foram tratadas
         raise
     except Exception as e:
@@ -410,6 +998,44 @@ async def obter_dem_para_area_geografica(
         raise DEMProcessingError(f"Falha crítica ao obter DEM para a área: {e}")
 
 
+def _encontrar_picos(
+    dem: np.ndarray, nodata: Optional[float], tamanho_filtro: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(linhas, colunas, cotas) dos máximos locais do MDT (janela tamanho_filtro²)."""
+    dem_picos = dem.astype(np.float32)  # cópia: nunca altera o MDT recebido
+    if nodata is not None:
+        dem_picos[dem == nodata] = np.nan
+
+    valores_picos = maximum_filter(dem_picos, size=tamanho_filtro, mode='constant', cval=np.nan)
+    mascara_picos = (dem_picos == valores_picos) & (~np.isnan(dem_picos))
+    ys, xs = np.where(mascara_picos)
+    return ys, xs, dem_picos[ys, xs]
+
+
+def _filtrar_picos_candidatos(
+    peak_lats: np.ndarray,
+    peak_lons: np.ndarray,
+    overlays_info: List[OverlayInputData],
+    alvo_lat: float,
+    alvo_lon: float,
+    max_dist_m: float,
+    poligonos_pivos: List[Polygon],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Picos (índices, na ordem original) que estão em área com sinal, a até `max_dist_m`
+    do alvo e fora dos polígonos dos pivôs — tudo vetorizado. Retorna também as
+    distâncias de todos os picos ao alvo. (Síncrona; roda no threadpool.)
+    """
+    distancias = haversine_np(peak_lats, peak_lons, alvo_lat, alvo_lon)
+    ok = distancias <= max_dist_m
+    ok[ok] = _cobertura_pontos(peak_lats[ok], peak_lons[ok], overlays_info)
+    for poly in poligonos_pivos:
+        if not ok.any():
+            break
+        ok[ok] = ~shapely.contains_xy(poly, peak_lons[ok], peak_lats[ok])
+    return np.flatnonzero(ok), distancias
+
+
 async def encontrar_locais_altos_para_repetidora(
     alvo_lat: float, alvo_lon: float, alvo_nome: str,
     altura_antena_repetidora_proposta: float, altura_receptor_pivo: float,
@@ -453,87 +1079,53 @@ async def encontrar_locais_altos_para_repetidora(
     )
 
     candidate_sites_list: List[CandidateSite] = []
-    imagens_overlay_pil_cache: Dict[Path, Image.Image] = {}
     MAX_DIST_REPETIDORA_ALVO_M = 1800.0
     TAM_FILTRO_PICO = 5
 
-    try:
-        dem_picos = dem_array.copy().astype(np.float32)
-        if dem_nodata_val is not None:
-            dem_picos[dem_array == dem_nodata_val] = np.nan
-
-        valores_picos = maximum_filter(dem_picos, size=TAM_FILTRO_PICO, mode='constant', cval=np.nan)
-        mascara_picos = (dem_picos == valores_picos) & (~np.isnan(dem_picos))
-        ys, xs = np.where(mascara_picos)
-        xs_lon, ys_lat = rasterio.transform.xy(dem_transform, ys, xs, offset='center')
-
-        tasks, candidate_points_data = [], []
-        for idx, (peak_lon, peak_lat) in enumerate(zip(xs_lon, ys_lat)):
-            elev_pico = dem_picos[ys[idx], xs[idx]]
-            esta_em_area_sinal = False
-            for ov in active_overlays_data:
-                overlay_imagem_path = Path(ov['imagem_path'])
-                if not overlay_imagem_path.is_file(): continue
-                try:
-                    if overlay_imagem_path not in imagens_overlay_pil_cache:
-                        imagens_overlay_pil_cache[overlay_imagem_path] = Image.open(overlay_imagem_path).convert("RGBA")
-                    pil_img = imagens_overlay_pil_cache[overlay_imagem_path]
-                    ov_w, ov_h = pil_img.size
-                    s, w, n, e = ov['bounds']
-                    if s > n: s, n = n, s
-                    if w > e: w, e = e, w
-                    dlon, dlat = e - w, n - s
-                    if dlon == 0 or dlat == 0: continue
-                    px = int(((peak_lon - w) / dlon) * ov_w)
-                    py = int(((n - peak_lat) / dlat) * ov_h)
-                    if 0 <= px < ov_w and 0 <= py < ov_h and pil_img.getpixel((px, py))[3] > settings.SIM_ALPHA_THRESHOLD:
-                        esta_em_area_sinal = True
-                        break
-                except Exception as e_img:
-                    logger.warning("    -> ❌ Erro verif. overlay %s: %s", overlay_imagem_path.name, e_img)
-
-            if not esta_em_area_sinal: continue
-            dist_alvo_m = haversine(alvo_lat, alvo_lon, peak_lat, peak_lon)
-            if dist_alvo_m > MAX_DIST_REPETIDORA_ALVO_M: continue
-            if shapely_pivot_polygons and any(poly.contains(Point(peak_lon, peak_lat)) for poly in shapely_pivot_polygons): continue
-
-            tasks.append(obter_perfil_elevacao(
-                pontos=[(peak_lat, peak_lon), (alvo_lat, alvo_lon)],
-                alt1=altura_antena_repetidora_proposta,
-                alt2=altura_receptor_pivo
-            ))
-            candidate_points_data.append({
-                "lat": float(peak_lat), "lon": float(peak_lon),
-                "elevation": float(elev_pico), "distance_to_target": float(dist_alvo_m)
-            })
+    ys, xs, elev_picos = await run_in_threadpool(
+        _pesado, int(dem_array.size), _encontrar_picos, [dem_array], dem_nodata_val, TAM_FILTRO_PICO
+    )
+    # Centro do pixel (MDT norte-para-cima, sem rotação)
+    peak_lats = dem_transform.f + (np.asarray(ys, dtype=np.float64) + 0.5) * dem_transform.e
+    peak_lons = dem_transform.c + (np.asarray(xs, dtype=np.float64) + 0.5) * dem_transform.a
+    selecionados, distancias_alvo = await run_in_threadpool(
+        _pesado, int(peak_lats.size) * (len(active_overlays_data) + len(shapely_pivot_polygons)),
+        _filtrar_picos_candidatos, [peak_lats, peak_lons], active_overlays_data,
+        alvo_lat, alvo_lon, MAX_DIST_REPETIDORA_ALVO_M, shapely_pivot_polygons,
+    )
 
-        max_tasks = settings.SIM_MAX_LOS_TASKS
-        if len(tasks) > max_tasks:
-            logger.warning(" -> Reduzindo análises de LOS: %d -> %d (cap)", len(tasks), max_tasks)
-            tasks, candidate_points_data = tasks[:max_tasks], candidate_points_data[:max_tasks]
-
-        if tasks:
-            logger.info(" -> Disparando %d análises de perfil/LOS em paralelo...", len(tasks))
-            los_results = await asyncio.gather(*tasks, return_exceptions=True)
-            for i, result in enumerate(los_results):
-                point_data = candidate_points_data[i]
-                if isinstance(result, Exception):
-                    tem_los, info_bloq, altura_torre = False, {"error_calculating_los": str(result)}, None
-                else:
-                    perfil_result = result
-                    tem_los = perfil_result.get("bloqueio") is None
-                    info_bloq = perfil_result.get("bloqueio")
-                    altura_torre = None
-                    if not tem_los and info_bloq and isinstance(info_bloq.get("diff"), (int, float)):
-                        altura_torre = float(info_bloq["diff"]) + 3.0
-                candidate_sites_list.append({
-                    **point_data, "has_los": tem_los,
-                    "ponto_bloqueio": info_bloq, "altura_necessaria_torre": altura_torre
-                })
-    finally:
-        for img in imagens_overlay_pil_cache.values():
-            try: img.close()
-            except Exception: pass
+    pares, candidate_points_data = [], []
+    for idx in selecionados:
+        peak_lat, peak_lon = float(peak_lats[idx]), float(peak_lons[idx])
+        pares.append(((peak_lat, peak_lon), (alvo_lat, alvo_lon), altura_antena_repetidora_proposta, altura_receptor_pivo))
+        candidate_points_data.append({
+            "lat": peak_lat, "lon": peak_lon,
+            "elevation": float(elev_picos[idx]), "distance_to_target": float(distancias_alvo[idx])
+        })
+
+    max_tasks = settings.SIM_MAX_LOS_TASKS
+    if len(pares) > max_tasks:
+        logger.warning(" -> Reduzindo análises de LOS: %d -> %d (cap)", len(pares), max_tasks)
+        pares, candidate_points_data = pares[:max_tasks], candidate_points_data[:max_tasks]
+
+    if pares:
+        logger.info(" -> Calculando %d análises de perfil/LOS em lote...", len(pares))
+        los_results = await obter_perfis_elevacao(pares)
+        for i, result in enumerate(los_results):
+            point_data = candidate_points_data[i]
+            if isinstance(result, Exception):
+                tem_los, info_bloq, altura_torre = False, {"error_calculating_los": str(result)}, None
+            else:
+                perfil_result = result
+                tem_los = perfil_result.get("bloqueio") is None
+                info_bloq = perfil_result.get("bloqueio")
+                altura_torre = None
+                if not tem_los and info_bloq and isinstance(info_bloq.get("diff"), (int, float)):
+                    altura_torre = float(info_bloq["diff"]) + 3.0
+            candidate_sites_list.append({
+                **point_data, "has_los": tem_los,
+                "ponto_bloqueio": info_bloq, "altura_necessaria_torre": altura_torre
+            })
 
     candidate_sites_list.sort(key=lambda s: (
         not s["has_los"], -(s.get("elevation", -float('inf'))), s.get("distance_to_target", float('inf'))
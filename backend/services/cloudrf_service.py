@@ -4,116 +4,198 @@ import asyncio
 import json
 import hashlib
 import logging
+import os
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, Optional
 
 import httpx
+from fastapi.concurrency import run_in_threadpool
 
 from backend.config import settings
 from backend.exceptions import CloudRFAPIError  # MUDANÇA 1: Importa a nova exceção
+from backend.services import coverage_mask, propagation_service
+from backend.services.http_pool import http_pool
+from backend.services.rate_limiter import RateLimitTimeout, rate_limiters
+from backend.services.simulation_cache import simulation_cache
+from backend.services.singleflight import SingleFlight, file_lock
 
 logger = logging.getLogger("irricontrol")
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
-# ----------------- Helpers de HTTP (timeouts/limites/HTTP2) -----------------
+# Simulações idênticas em andamento (mesmo hash de cache) são executadas uma única vez.
+_simulations_inflight = SingleFlight("cloudrf")
 
-def _timeout() -> httpx.Timeout:
-    return httpx.Timeout(getattr(settings, "HTTP_TIMEOUT", 30))
 
+# ----------------- Helpers de HTTP -----------------
 
-def _limits() -> httpx.Limits:
-    return httpx.Limits(
-        max_connections=int(getattr(settings, "HTTP_MAX_CONNECTIONS", 100)),
-        max_keepalive_connections=int(getattr(settings, "HTTP_MAX_KEEPALIVE", 20)),
-    )
-
-
-async def get_http_client() -> httpx.AsyncClient:
+def get_http_client(url: str) -> httpx.AsyncClient:
     """
-    AsyncClient com HTTP/2 opcional (fallback para HTTP/1.1 se 'h2' não estiver instalado).
+    Client compartilhado (pool do app) para o host da URL.
+    Não deve ser fechado pelo chamador; o lifespan cuida disso.
     """
-    want_h2 = bool(getattr(settings, "HTTP_HTTP2", True))
-    kwargs: Dict[str, Any] = {"timeout": _timeout(), "limits": _limits()}
-
-    if want_h2:
-        try:
-            import h2  # noqa: F401
-            kwargs["http2"] = True
-        except Exception:
-            logger.warning('HTTP/2 ativado mas pacote "h2" ausente. Fallback para HTTP/1.1. '
-                            'Dica: pip install "httpx[http2]"')
-            kwargs["http2"] = False
-
-    return httpx.AsyncClient(**kwargs)
+    return http_pool.client_for(url)
 
 
-async def _request_with_retries(
+async def _send_with_retries(
     client: httpx.AsyncClient,
     method: str,
     url: str,
-    *,
-    retries: int = 2,
-    backoff: float = 0.6,
-    **kwargs: Any,
+    retries: int,
+    backoff: float,
+    stream: bool,
+    kwargs: Dict[str, Any],
+    manter_slot: Optional[AsyncExitStack] = None,
 ) -> httpx.Response:
     """
-    Faz request propagando TODOS os kwargs (headers/json/etc).
-    Retry para timeouts/erros de transporte/HTTP 5xx e 429 (rate limit).
+    Núcleo de request_with_retries/stream_with_retries. Com `manter_slot`, o slot
+    do limitador da tentativa bem-sucedida é transferido para a pilha (liberado
+    quando ela fechar) em vez de ser devolvido na chegada dos headers.
     """
+    limiter = rate_limiters.for_url(url)
     attempt = 0
     while True:
+        retry_after: Optional[float] = None
         try:
-            resp = await client.request(method, url, **kwargs)  # <- KWARGS propagados
-            # Re-tenta em 5xx ou 429 (rate limit)
-            if resp.status_code == 429 or (500 <= resp.status_code < 600):
-                raise httpx.HTTPStatusError(str(resp.status_code), request=resp.request, response=resp)
+            async with AsyncExitStack() as tentativa:
+                slot = await tentativa.enter_async_context(limiter.slot())
+                request = client.build_request(method, url, **kwargs)  # <- KWARGS propagados
+                resp = await client.send(request, stream=stream)
+                slot.record(resp)
+                retry_after = slot.retry_after
+                # Re-tenta em 5xx ou 429 (rate limit)
+                if resp.status_code == 429 or (500 <= resp.status_code < 600):
+                    if stream:
+                        await resp.aread()
+                        await resp.aclose()
+                    raise httpx.HTTPStatusError(str(resp.status_code), request=resp.request, response=resp)
+                if manter_slot is not None:
+                    manter_slot.push_async_exit(tentativa.pop_all())
             return resp
+        except RateLimitTimeout:
+            raise
         except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.TransportError):
             if attempt >= retries:
                 raise
-            await asyncio.sleep(backoff * (attempt + 1))
+            await asyncio.sleep(backoff * (2 ** attempt))
             attempt += 1
         except httpx.HTTPStatusError as e:
             status = e.response.status_code
             if (status == 429 or 500 <= status < 600) and attempt < retries:
-                await asyncio.sleep(backoff * (attempt + 1))
+                if retry_after is not None and retry_after > settings.RATE_LIMIT_MAX_RETRY_AFTER:
+                    raise
+                await asyncio.sleep(max(retry_after or 0.0, backoff * (2 ** attempt)))
                 attempt += 1
                 continue
             raise
 
 
+async def request_with_retries(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    *,
+    retries: int = 2,
+    backoff: float = 0.6,
+    **kwargs: Any,
+) -> httpx.Response:
+    """
+    Faz request propagando TODOS os kwargs (headers/json/etc), passando pelo
+    limitador adaptativo do host (token bucket + AIMD).
+    Retry para timeouts/erros de transporte/HTTP 5xx e 429 (rate limit); respeita
+    Retry-After (até RATE_LIMIT_MAX_RETRY_AFTER) e usa backoff exponencial senão.
+    O corpo é lido por completo; para downloads em streaming use stream_with_retries.
+    """
+    return await _send_with_retries(client, method, url, retries, backoff, False, kwargs)
+
+
+@asynccontextmanager
+async def stream_with_retries(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    *,
+    retries: int = 2,
+    backoff: float = 0.6,
+    **kwargs: Any,
+) -> AsyncIterator[httpx.Response]:
+    """
+    Como request_with_retries, mas sem ler o corpo: entrega a resposta em
+    streaming e só a fecha (e libera o slot do limitador) ao sair do bloco, de
+    modo que a transferência inteira conta no limite de concorrência do host.
+    """
+    async with AsyncExitStack() as pilha:
+        resp = await _send_with_retries(client, method, url, retries, backoff, True, kwargs, pilha)
+        try:
+            yield resp
+        finally:
+            await resp.aclose()
+
+
 # ----------------- Utils -----------------
 
+def resolver_engine(tpl: Any, engine: Optional[str] = None) -> str:
+    """Motor efetivo: o da requisição, senão o do template, senão SIM_ENGINE_PADRAO."""
+    escolhido = engine or getattr(tpl, "engine", None) or settings.SIM_ENGINE_PADRAO
+    if escolhido not in propagation_service.ENGINES:
+        raise ValueError(f"Motor de simulação desconhecido: '{escolhido}'.")
+    return escolhido
+
+
 def format_coord(coord: float) -> str:
     """Formata coordenada para nome de arquivo."""
     return f"{coord:.6f}".replace(".", "_").replace("-", "m")
 
 
 def save_bounds(bounds: list, local_image_path: Path) -> None:
-    """Salva bounds em JSON ao lado da imagem."""
+    """Salva bounds em JSON ao lado da imagem (escrita atômica). Síncrona: use no threadpool."""
     json_path = local_image_path.with_suffix(".json")
+    tmp_path = json_path.with_name(f".{json_path.name}.{uuid.uuid4().hex}.tmp")
     try:
         json_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(json_path, "w", encoding="utf-8") as f:
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump({"bounds": bounds}, f, indent=4)
+        os.replace(tmp_path, json_path)
         logger.info(f"  -> Bounds salvos em: {json_path}")
     except Exception as e:
         logger.error(f"  -> ❌ Erro ao salvar bounds em {json_path}: {e}", exc_info=True)
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 
-async def download_image(url: str, local_image_path: Path) -> None:
-    """Baixa a imagem da CloudRF e grava no caminho local (com retry)."""
+async def download_image(url: str, local_image_path: Path) -> str:
+    """
+    Baixa a imagem da CloudRF em streaming (com retry) para um temporário ao lado
+    do destino e renomeia atomicamente. Escritas em disco rodam no threadpool.
+    Retorna o SHA-256 do conteúdo, calculado durante o download.
+    """
     logger.info(f"  -> Baixando imagem: {url}")
-    local_image_path.parent.mkdir(parents=True, exist_ok=True)
-    async with await get_http_client() as client:
-        resp = await _request_with_retries(
+    await run_in_threadpool(local_image_path.parent.mkdir, parents=True, exist_ok=True)
+    tmp_path = local_image_path.with_name(f".{local_image_path.name}.{uuid.uuid4().hex}.part")
+    client = get_http_client(url)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with stream_with_retries(
             client, "GET", url,
             headers={"Accept": "image/png, image/*;q=0.8,*/*;q=0.5"}
-        )
-        resp.raise_for_status()
-        with open(local_image_path, "wb") as f:
-            f.write(resp.content)
-    logger.info(f"  -> Imagem salva em: {local_image_path}")
+        ) as resp:
+            resp.raise_for_status()
+            f = await run_in_threadpool(open, tmp_path, "wb")
+            try:
+                async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await run_in_threadpool(f.write, chunk)
+            finally:
+                await run_in_threadpool(f.close)
+        await run_in_threadpool(os.replace, tmp_path, local_image_path)
+    finally:
+        await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+    logger.info(f"  -> Imagem salva em: {local_image_path} ({size} bytes)")
+    return digest.hexdigest()
 
 
 # ----------------- Payload CloudRF -----------------
@@ -213,36 +295,64 @@ async def run_cloudrf_simulation(
     altura: int,
     altura_receiver: Optional[float],
     template_id: str,
-    is_repeater: bool = False
+    is_repeater: bool = False,
+    permitir_aproximado: bool = True,
+    engine: Optional[str] = None,
 ) -> dict:
     """
-    Executa simulação de cobertura na CloudRF com cache em disco.
-    O cache é canônico (independente de job_id).
+    Executa simulação de cobertura na CloudRF (ou no motor local, ver
+    `resolver_engine`) com cache em disco (SimulationCacheStore).
+    O cache é canônico (independente de job_id) e separado por motor.
+    Se `permitir_aproximado`, uma simulação em cache a até SIM_CACHE_REUSE_RADIUS_M
+    (mesmo motor, template e alturas) é reaproveitada e marcada com `aproximado=True`.
     """
     tpl = settings.obter_template(template_id)
     rx_alt = altura_receiver if altura_receiver is not None else tpl.receiver.alt
+    engine = resolver_engine(tpl, engine)
 
     cache_key_string = f"lat:{lat:.6f}-lon:{lon:.6f}-alt:{altura}-rx_alt:{rx_alt}-tpl:{template_id}"
+    if engine != propagation_service.ENGINE_CLOUDRF:
+        # Chaves da CloudRF ficam como sempre foram (cache existente continua válido).
+        cache_key_string += f"-engine:{engine}-v{propagation_service.LOCAL_ENGINE_VERSION}"
     cache_hash = hashlib.sha256(cache_key_string.encode()).hexdigest()
-    cache_file_path = settings.SIMULATIONS_CACHE_PATH / f"{cache_hash}.json"
-
-    try:
-        cache_file_path.parent.mkdir(parents=True, exist_ok=True)
-    except Exception:
-        pass
 
-    if cache_file_path.exists():
+    cached = await run_in_threadpool(simulation_cache.get, cache_hash)
+    if cached is not None:
         logger.info(f"CACHE HIT: {cache_hash[:12]}")
-        with open(cache_file_path, "r", encoding="utf-8") as f:
-            cached = json.load(f)
-        imgp = Path(cached["imagem_local_path"])
-        if imgp.exists() and imgp.with_suffix(".json").exists():
-            return cached
-        logger.warning("CACHE corrompido (arquivos ausentes). Re-simulando.")
-
-    return await _perform_simulation_and_save_to_cache(
-        lat, lon, altura, rx_alt, template_id, is_repeater, tpl, cache_file_path
-    )
+        return {**cached, "engine": engine}
+
+    if permitir_aproximado and settings.SIM_CACHE_REUSE_RADIUS_M > 0:
+        proximo = await run_in_threadpool(
+            simulation_cache.find_nearby,
+            template_id, altura, rx_alt, lat, lon, settings.SIM_CACHE_REUSE_RADIUS_M, engine,
+        )
+        if proximo is not None:
+            logger.info(f"CACHE HIT (aproximado, {proximo['distancia_reuso_m']:.1f}m): {cache_hash[:12]}")
+            return {**proximo, "engine": engine}
+
+    async def _simulate_once() -> dict:
+        # Lock por hash entre workers: quem chegar depois encontra o cache pronto.
+        lock_path = settings.SIMULATIONS_CACHE_PATH / "locks" / f"{cache_hash}.lock"
+        async with file_lock(lock_path, timeout=settings.SIM_LOCK_TIMEOUT):
+            cached_now = await run_in_threadpool(simulation_cache.get, cache_hash)
+            if cached_now is not None:
+                logger.info(f"CACHE HIT (após lock): {cache_hash[:12]}")
+                return cached_now
+            if engine == propagation_service.ENGINE_LOCAL:
+                return await _perform_local_simulation_and_save_to_cache(
+                    lat, lon, altura, rx_alt, template_id, is_repeater, tpl, cache_hash
+                )
+            return await _perform_simulation_and_save_to_cache(
+                lat, lon, altura, rx_alt, template_id, is_repeater, tpl, cache_hash
+            )
+
+    result = await _simulations_inflight.do(cache_hash, _simulate_once)
+    return {**result, "engine": engine}
+
+
+def simulation_stats() -> Dict[str, Any]:
+    """Contadores de coalescência e do cache de simulações (para /metrics)."""
+    return {"single_flight": _simulations_inflight.stats(), "cache": simulation_cache.stats()}
 
 
 async def _perform_simulation_and_save_to_cache(
@@ -253,7 +363,7 @@ async def _perform_simulation_and_save_to_cache(
     template_id: str,
     is_repeater: bool,
     tpl: Any,
-    cache_file_path: Path
+    cache_key: str
 ) -> dict:
     logger.info(
         "CACHE MISS: Simulação CloudRF (tpl=%s, lat=%.6f, lon=%.6f, alt=%dm, rx=%.2f)",
@@ -271,22 +381,23 @@ async def _perform_simulation_and_save_to_cache(
         "Accept": "application/json",
     }
 
-    async with await get_http_client() as client:
-        try:
-            resp = await _request_with_retries(
-                client, "POST", str(settings.CLOUDRF_API_URL),
-                headers=headers, json=payload
-            )
-            resp.raise_for_status()
-            data = resp.json()
-        except httpx.HTTPStatusError as e:
-            logger.error(f"  -> ❌ Erro HTTP CloudRF: {e.response.status_code} - {e.response.text}", exc_info=True)
-            # MUDANÇA 2: Lança a exceção específica em vez de ValueError
-            raise CloudRFAPIError(f"API respondeu com erro ({e.response.status_code}): {e.response.text}")
-        except Exception as e:
-            logger.error(f"  -> ❌ Erro ao chamar CloudRF: {e}", exc_info=True)
-            # MUDANÇA 3: Lança a exceção específica em vez de ValueError
-            raise CloudRFAPIError(f"Erro de comunicação com a API CloudRF: {e}")
+    api_url = str(settings.CLOUDRF_API_URL)
+    client = get_http_client(api_url)
+    try:
+        resp = await request_with_retries(
+            client, "POST", api_url,
+            headers=headers, json=payload
+        )
+        resp.raise_for_status()
+        data = resp.json()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"  -> ❌ Erro HTTP CloudRF: {e.response.status_code} - {e.response.text}", exc_info=True)
+        # MUDANÇA 2: Lança a exceção específica em vez de ValueError
+        raise CloudRFAPIError(f"API respondeu com erro ({e.response.status_code}): {e.response.text}")
+    except Exception as e:
+        logger.error(f"  -> ❌ Erro ao chamar CloudRF: {e}", exc_info=True)
+        # MUDANÇA 3: Lança a exceção específica em vez de ValueError
+        raise CloudRFAPIError(f"Erro de comunicação com a API CloudRF: {e}")
 
     img_url = data.get("PNG_WGS84")
     bounds = data.get("bounds")
@@ -294,25 +405,80 @@ async def _perform_simulation_and_save_to_cache(
         # MUDANÇA 4: Lança a exceção específica para respostas inválidas
         raise CloudRFAPIError("Resposta inválida da CloudRF (faltou PNG_WGS84 ou bounds).")
 
+    # Baixa para um temporário no volume do cache e indexa (blob por conteúdo)
+    tmp_img = simulation_cache.temp_path(".png.part")
+    try:
+        digest = await download_image(img_url, tmp_img)
+        return await _save_result_to_cache(
+            tmp_img, digest, bounds, lat, lon, altura, receiver_alt, template_id, is_repeater, tpl, cache_key,
+            propagation_service.ENGINE_CLOUDRF,
+        )
+    finally:
+        await run_in_threadpool(tmp_img.unlink, missing_ok=True)
+
+
+async def _perform_local_simulation_and_save_to_cache(
+    lat: float,
+    lon: float,
+    altura: int,
+    receiver_alt: float,
+    template_id: str,
+    is_repeater: bool,
+    tpl: Any,
+    cache_key: str
+) -> dict:
+    logger.info(
+        "CACHE MISS: Simulação local (tpl=%s, lat=%.6f, lon=%.6f, alt=%dm, rx=%.2f)",
+        tpl.id, lat, lon, altura, receiver_alt
+    )
+    tmp_img = simulation_cache.temp_path(".png.part")
+    try:
+        bounds = await propagation_service.simular_cobertura_local(tpl, lat, lon, altura, receiver_alt, tmp_img)
+        return await _save_result_to_cache(
+            tmp_img, None, bounds, lat, lon, altura, receiver_alt, template_id, is_repeater, tpl, cache_key,
+            propagation_service.ENGINE_LOCAL,
+        )
+    finally:
+        await run_in_threadpool(tmp_img.unlink, missing_ok=True)
+
+
+async def _save_result_to_cache(
+    tmp_img: Path,
+    digest: Optional[str],
+    bounds: list,
+    lat: float,
+    lon: float,
+    altura: int,
+    receiver_alt: float,
+    template_id: str,
+    is_repeater: bool,
+    tpl: Any,
+    cache_key: str,
+    engine: str,
+) -> dict:
+    """Indexa a imagem gerada (blob por conteúdo) e gera a máscara de cobertura."""
     # Nome canônico da imagem no cache
     lat_str, lon_str = format_coord(lat), format_coord(lon)
     prefix = "repetidora" if is_repeater else "principal"
     template_name_safe = tpl.id.lower().replace(" ", "_")
-    imagem_filename = f"{prefix}_{template_name_safe}_tx{altura}m_rx{receiver_alt:.1f}m_lat{lat_str}_lon{lon_str}.png"
-    local_img = settings.SIMULATIONS_CACHE_PATH / imagem_filename
-
-    # Baixar imagem e salvar bounds
-    await download_image(img_url, local_img)
-    save_bounds(bounds, local_img)
-
-    # Persistir JSON do cache
-    cached = {
-        "imagem_local_path": str(local_img),
-        "imagem_filename": imagem_filename,
-        "bounds": bounds,
+    sufixo = "" if engine == propagation_service.ENGINE_CLOUDRF else f"_{engine}"
+    imagem_filename = (
+        f"{prefix}_{template_name_safe}_tx{altura}m_rx{receiver_alt:.1f}m_lat{lat_str}_lon{lon_str}{sufixo}.png"
+    )
+
+    params = {
+        "template": template_id, "tx_alt": altura, "rx_alt": receiver_alt, "lat": lat, "lon": lon, "engine": engine,
     }
-    with open(cache_file_path, "w", encoding="utf-8") as f:
-        json.dump(cached, f, indent=4)
-    logger.info(f" -> Resultado salvo no cache: {cache_file_path.name}")
+    cached = await run_in_threadpool(
+        simulation_cache.put, cache_key, tmp_img, imagem_filename, bounds, digest, params
+    )
+
+    # Máscara de cobertura compactada gerada uma vez, junto do blob
+    try:
+        await run_in_threadpool(coverage_mask.ensure_mask, Path(cached["imagem_local_path"]), bounds)
+        await run_in_threadpool(simulation_cache.refresh_size, cached["digest"])
+    except Exception as e:
+        logger.warning(f"  -> ⚠️ Falha ao gerar máscara de cobertura: {e}")
+    logger.info(f" -> Resultado salvo no cache: {cache_key[:12]} ({cached['digest'][:12]})")
 
-    return cached
\ No newline at end of file
+    return cached
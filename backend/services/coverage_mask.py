@@ -0,0 +1,166 @@
+# backend/services/coverage_mask.py
+
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from backend.config import settings
+
+logger = logging.getLogger("irricontrol")
+
+# Versão do formato do sidecar; mudar força a regeneração das máscaras.
+MASK_FORMAT_VERSION = 1
+
+
+# ----------------- Caminhos / geotransform -----------------
+
+def mask_paths(image_path: Path) -> Tuple[Path, Path]:
+    """Sidecars da máscara: bits compactados (.mask.npy) e metadados (.mask.json)."""
+    return image_path.with_suffix(".mask.npy"), image_path.with_suffix(".mask.json")
+
+
+def normalize_bounds(bounds: Sequence[float]) -> Tuple[float, float, float, float]:
+    """Bounds (S, W, N, E) com S<=N e W<=E (a CloudRF às vezes devolve invertido)."""
+    s, w, n, e = (float(v) for v in bounds)
+    if s > n: s, n = n, s
+    if w > e: w, e = e, w
+    return s, w, n, e
+
+
+def geotransform(bounds: Sequence[float], width: int, height: int) -> Tuple[float, float, float, float, float, float]:
+    """
+    Geotransform estilo GDAL (c, a, b, f, d, e):
+        lon = c + px * a ; lat = f + py * e   (b = d = 0, imagem norte-para-cima)
+    """
+    s, w, n, e = normalize_bounds(bounds)
+    return (w, (e - w) / width, 0.0, n, 0.0, -(n - s) / height)
+
+
+# ----------------- Máscara -----------------
+
+class CoverageMask:
+    """Máscara booleana compactada (1 bit/pixel, bitorder big) de uma imagem de cobertura."""
+
+    __slots__ = ("packed", "width", "height")
+
+    def __init__(self, packed: np.ndarray, width: int, height: int):
+        self.packed = packed
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_alpha(cls, alpha: np.ndarray, threshold: int) -> "CoverageMask":
+        height, width = alpha.shape
+        return cls(np.packbits(alpha > threshold, axis=1), width, height)
+
+    def covered(self, px: int, py: int) -> bool:
+        """True se o pixel (px, py) estiver coberto. Fora da imagem -> False."""
+        if not (0 <= px < self.width and 0 <= py < self.height):
+            return False
+        return bool((self.packed[py, px >> 3] >> (7 - (px & 7))) & 1)
+
+    def covered_many(self, px: np.ndarray, py: np.ndarray) -> np.ndarray:
+        """Versão vetorizada de `covered` para arrays de pixels (inteiros, com broadcast)."""
+        px, py = np.broadcast_arrays(np.asarray(px, dtype=np.int64), np.asarray(py, dtype=np.int64))
+        dentro = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        out = np.zeros(px.shape, dtype=bool)
+        x, y = px[dentro], py[dentro]
+        out[dentro] = ((self.packed[y, x >> 3] >> (7 - (x & 7))) & 1).astype(bool)
+        return out
+
+    def unpack(self) -> np.ndarray:
+        return np.unpackbits(self.packed, axis=1, count=self.width).astype(bool)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.packed.nbytes)
+
+
+def _atomic_write(path: Path, writer) -> None:
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            writer(f)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def build_mask(image_path: Path, bounds: Sequence[float], threshold: Optional[int] = None) -> CoverageMask:
+    """
+    Decodifica o PNG uma única vez e grava a máscara (alpha > threshold) + metadados
+    ao lado da imagem. Escrita atômica; leitores concorrentes nunca veem arquivo parcial.
+    """
+    threshold = settings.SIM_ALPHA_THRESHOLD if threshold is None else threshold
+    with Image.open(image_path) as img:
+        alpha = np.asarray(img.convert("RGBA"))[:, :, 3]
+    mask = CoverageMask.from_alpha(alpha, threshold)
+
+    npy_path, meta_path = mask_paths(image_path)
+    meta: Dict[str, Any] = {
+        "version": MASK_FORMAT_VERSION,
+        "width": mask.width,
+        "height": mask.height,
+        "threshold": threshold,
+        "bounds": list(normalize_bounds(bounds)),
+        "geotransform": list(geotransform(bounds, mask.width, mask.height)),
+    }
+    _atomic_write(npy_path, lambda f: np.save(f, mask.packed))
+    _atomic_write(meta_path, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+    return mask
+
+
+def _read_meta(meta_path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _mask_is_fresh(image_path: Path, meta: Optional[Dict[str, Any]], threshold: int) -> bool:
+    if not meta or meta.get("version") != MASK_FORMAT_VERSION or meta.get("threshold") != threshold:
+        return False
+    npy_path, _ = mask_paths(image_path)
+    try:
+        return npy_path.stat().st_mtime_ns >= image_path.stat().st_mtime_ns
+    except OSError:
+        return False
+
+
+def ensure_mask(image_path: Path, bounds: Sequence[float]) -> Path:
+    """Garante que a máscara da imagem exista e esteja atual; retorna o caminho do .mask.npy."""
+    npy_path, meta_path = mask_paths(image_path)
+    if not _mask_is_fresh(image_path, _read_meta(meta_path), settings.SIM_ALPHA_THRESHOLD):
+        build_mask(image_path, bounds)
+    return npy_path
+
+
+def load_mask(image_path: Path, bounds: Sequence[float]) -> CoverageMask:
+    """
+    Carrega a máscara via memmap (sem decodificar o PNG). Se o sidecar não existir
+    ou estiver desatualizado (ex.: imagens de jobs antigos), gera a partir do PNG.
+    """
+    threshold = settings.SIM_ALPHA_THRESHOLD
+    npy_path, meta_path = mask_paths(image_path)
+    meta = _read_meta(meta_path)
+    if _mask_is_fresh(image_path, meta, threshold):
+        try:
+            packed = np.load(npy_path, mmap_mode="r")
+            return CoverageMask(packed, int(meta["width"]), int(meta["height"]))
+        except Exception as e:
+            logger.warning("  -> ⚠️ Máscara ilegível (%s): %s. Regenerando.", npy_path.name, e)
+    try:
+        return build_mask(image_path, bounds, threshold)
+    except OSError as e:
+        # Pasta sem permissão de escrita etc.: decodifica em memória mesmo.
+        logger.warning("  -> ⚠️ Não foi possível gravar máscara de %s: %s", image_path.name, e)
+        with Image.open(image_path) as img:
+            alpha = np.asarray(img.convert("RGBA"))[:, :, 3]
+        return CoverageMask.from_alpha(alpha, threshold)
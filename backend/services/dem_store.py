@@ -0,0 +1,402 @@
+# backend/services/dem_store.py
+"""
+MDT (SRTM) local, por tile de 1°.
+
+Cada tile (ex.: S16W056) é baixado uma vez do bucket público da AWS (.hgt.gz),
+descompactado para um .npy int16 em arquivos/dem_cache/tiles e, daí em diante,
+lido por memmap: recortes de área e perfis de elevação são janelas de um
+mosaico virtual dos tiles que cobrem a área, sem reabrir nem recortar arquivos.
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import threading
+import uuid
+from math import floor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import rasterio
+from fastapi.concurrency import run_in_threadpool
+from rasterio.crs import CRS
+from scipy.ndimage import distance_transform_edt, map_coordinates
+
+from backend.config import settings
+from backend.exceptions import DEMProcessingError
+from backend.services import cloudrf_service
+from backend.services.rate_limiter import RateLimitTimeout
+from backend.services.singleflight import SingleFlight, file_lock
+
+logger = logging.getLogger("irricontrol")
+
+SRTM_URL = "https://elevation-tiles-prod.s3.amazonaws.com/skadi/{pasta}/{nome}.hgt.gz"
+SRTM_NODATA = -32768
+CRS_WGS84 = CRS.from_epsg(4326)
+
+# Pixels extras em volta da janela amostrada (o spline cúbico usa 4×4 vizinhos).
+_MARGEM_JANELA = 3
+# Maior janela lida para amostrar perfis (≈ um tile de 1"; 4 bytes/célula em float32).
+_MAX_CELULAS_JANELA = 3601 * 3601
+
+
+def dem_cache_dir() -> Path:
+    return settings.ARQUIVOS_DIR_PATH / "dem_cache"
+
+
+def tiles_dir() -> Path:
+    return dem_cache_dir() / "tiles"
+
+
+# ----------------- Tiles -----------------
+
+def nome_tile(lat: float, lon: float) -> str:
+    """Nome SRTM do tile de 1° que contém o ponto (canto SW), ex.: S16W056."""
+    lat_tile, lon_tile = int(floor(lat)), int(floor(lon))
+    n_s, w_e = ("N" if lat_tile >= 0 else "S"), ("W" if lon_tile < 0 else "E")
+    return f"{n_s}{abs(lat_tile):02d}{w_e}{abs(lon_tile):03d}"
+
+
+def _canto_sw(nome: str) -> Tuple[int, int]:
+    lat = int(nome[1:3]) * (1 if nome[0] == "N" else -1)
+    lon = int(nome[4:7]) * (1 if nome[3] == "E" else -1)
+    return lat, lon
+
+
+class TileDEM:
+    """
+    Tile SRTM mapeado em memória (int16, nodata -32768), norte para cima.
+
+    Os pixels são indexados num reticulado global (linha = -lat / passo,
+    coluna = lon / passo): tiles vizinhos de mesma resolução se encaixam sem
+    reamostragem (.hgt é "pixel is point" e a borda é repetida nos dois tiles).
+    """
+
+    __slots__ = ("nome", "dados", "passo", "linha0", "coluna0")
+
+    def __init__(self, nome: str, dados: np.ndarray):
+        self.nome = nome
+        self.dados = dados
+        lado = dados.shape[0] - 1
+        lat_sw, lon_sw = _canto_sw(nome)
+        self.passo = 1.0 / lado
+        self.linha0 = -(lat_sw + 1) * lado   # pixel (0, 0) = canto NW do tile
+        self.coluna0 = lon_sw * lado
+
+
+class MosaicoDEM:
+    """
+    Mosaico virtual (estilo VRT) dos tiles que cobrem uma área: cada janela é
+    montada direto dos memmaps, copiando só a parte de cada tile que cai nela
+    (sem concatenar tiles inteiros). Fora dos tiles fica nodata.
+    """
+
+    def __init__(self, tiles: List[TileDEM]):
+        if len({t.dados.shape for t in tiles}) != 1:
+            raise DEMProcessingError("Tiles SRTM de resoluções diferentes na mesma área.")
+        self.tiles = tiles
+        self.passo = tiles[0].passo
+
+    def janela(self, w: float, s: float, e: float, n: float, margem_px: int = 0) -> Tuple[np.ndarray, rasterio.Affine]:
+        """Janela (int16) com os pixels que cobrem (W, S, E, N), mais `margem_px`, e seu transform."""
+        p = self.passo
+        r0 = int(floor(-n / p + 0.5)) - margem_px
+        r1 = int(floor(-s / p + 0.5)) + 1 + margem_px
+        c0 = int(floor(w / p + 0.5)) - margem_px
+        c1 = int(floor(e / p + 0.5)) + 1 + margem_px
+        dados = np.full((r1 - r0, c1 - c0), SRTM_NODATA, dtype=np.int16)
+        for t in self.tiles:
+            altura, largura = t.dados.shape
+            tr0, tr1 = max(r0, t.linha0), min(r1, t.linha0 + altura)
+            tc0, tc1 = max(c0, t.coluna0), min(c1, t.coluna0 + largura)
+            if tr0 < tr1 and tc0 < tc1:
+                dados[tr0 - r0:tr1 - r0, tc0 - c0:tc1 - c0] = (
+                    t.dados[tr0 - t.linha0:tr1 - t.linha0, tc0 - t.coluna0:tc1 - t.coluna0]
+                )
+        return dados, rasterio.Affine(p, 0.0, c0 * p - p / 2, 0.0, -p, -r0 * p + p / 2)
+
+
+def _graus(a: float, b: float) -> range:
+    """Graus inteiros (canto SW) dos tiles que cobrem [a, b]; b inteiro não puxa o tile seguinte."""
+    fim = int(floor(b))
+    if fim == b and fim > a:
+        fim -= 1
+    return range(int(floor(a)), fim + 1)
+
+
+def tiles_da_area(w: float, s: float, e: float, n: float) -> List[str]:
+    """Nomes dos tiles SRTM que intersectam a área (W, S, E, N)."""
+    return [nome_tile(lat, lon) for lat in _graus(s, n) for lon in _graus(w, e)]
+
+
+_tiles: Dict[str, TileDEM] = {}
+_tiles_lock = threading.Lock()
+
+
+def _caminho_tile(nome: str) -> Path:
+    return tiles_dir() / f"{nome}.npy"
+
+
+def tile_em_disco(nome: str) -> bool:
+    return _caminho_tile(nome).exists()
+
+
+def _abrir_tile(nome: str) -> Optional[TileDEM]:
+    """Tile já convertido em disco, aberto por memmap (None se ainda não existe). Síncrona."""
+    with _tiles_lock:
+        tile = _tiles.get(nome)
+    if tile is not None:
+        return tile
+    path = _caminho_tile(nome)
+    if not path.is_file():
+        return None
+    tile = TileDEM(nome, np.load(path, mmap_mode="r"))
+    with _tiles_lock:
+        return _tiles.setdefault(nome, tile)
+
+
+def _converter_hgt(gz_path: Path, destino: Path) -> None:
+    """Descompacta o .hgt.gz (int16 big-endian, N×N) para .npy nativo, com escrita atômica."""
+    with gzip.open(gz_path, "rb") as f:
+        bruto = np.frombuffer(f.read(), dtype=">i2")
+    lado = int(round(np.sqrt(bruto.size)))
+    if lado * lado != bruto.size:
+        raise DEMProcessingError(f"Tile SRTM com tamanho inesperado: {gz_path.name}")
+    tmp = destino.with_name(f".{destino.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, bruto.reshape(lado, lado).astype(np.int16))
+        os.replace(tmp, destino)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+# ----------------- Download -----------------
+# Um download por tile: single-flight no processo + lock de arquivo entre
+# workers. O .part tem nome fixo por tile e é retomado (Range) se uma tentativa
+# anterior caiu no meio; o tile só aparece em tiles/ depois de convertido.
+
+_TENTATIVAS_DOWNLOAD = 3
+
+_tiles_inflight = SingleFlight("dem")
+_download_sem: Optional[asyncio.Semaphore] = None
+
+
+def _semaforo_download() -> asyncio.Semaphore:
+    global _download_sem
+    if _download_sem is None:
+        _download_sem = asyncio.Semaphore(settings.SIM_DEM_DOWNLOAD_CONCURRENCY)
+    return _download_sem
+
+
+def _inicio_content_range(valor: Optional[str]) -> Optional[int]:
+    """Byte inicial de um Content-Range ("bytes 100-199/200")."""
+    try:
+        return int((valor or "").split()[1].split("-")[0])
+    except (IndexError, ValueError):
+        return None
+
+
+async def _baixar_parcial(url: str, part_path: Path) -> None:
+    """Baixa `url` para `part_path`, continuando do tamanho atual do arquivo (Range)."""
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    client = cloudrf_service.get_http_client(url)
+    async with cloudrf_service.stream_with_retries(client, "GET", url, headers=headers) as resp:
+        if resp.status_code == 416:
+            # .part inválido para o objeto atual: recomeça do zero na próxima tentativa
+            await run_in_threadpool(part_path.unlink, missing_ok=True)
+            raise DEMProcessingError(f"Download parcial inválido para {url}; reiniciando.")
+        resp.raise_for_status()
+        retomado = resp.status_code == 206 and _inicio_content_range(resp.headers.get("Content-Range")) == offset
+        if offset and retomado:
+            logger.info("    -> (DEM) Retomando download a partir de %d bytes: %s", offset, url)
+        f = await run_in_threadpool(open, part_path, "ab" if retomado else "wb")
+        try:
+            async for chunk in resp.aiter_bytes(cloudrf_service.DOWNLOAD_CHUNK_SIZE):
+                await run_in_threadpool(f.write, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+
+
+async def _baixar_tile(nome: str) -> TileDEM:
+    url = SRTM_URL.format(pasta=nome[:3], nome=nome)
+    lock_path = tiles_dir() / "locks" / f"{nome}.lock"
+    async with file_lock(lock_path, timeout=settings.SIM_LOCK_TIMEOUT) as travado:
+        # Outro worker pode ter concluído enquanto aguardávamos o lock
+        tile = await run_in_threadpool(_abrir_tile, nome)
+        if tile is not None:
+            return tile
+
+        if travado:
+            part_path = tiles_dir() / "temp" / f"{nome}.hgt.gz.part"
+        else:
+            # Sem o lock, o .part fixo pode estar sendo escrito por quem o tem:
+            # baixa num arquivo próprio desta tentativa (sem retomar downloads alheios).
+            part_path = tiles_dir() / "temp" / f"{nome}.{uuid.uuid4().hex}.hgt.gz.part"
+        await run_in_threadpool(part_path.parent.mkdir, parents=True, exist_ok=True)
+        baixado = False
+        try:
+            async with _semaforo_download():
+                logger.info("    -> (DEM) Baixando tile de elevação de: %s", url)
+                for tentativa in range(1, _TENTATIVAS_DOWNLOAD + 1):
+                    try:
+                        await _baixar_parcial(url, part_path)
+                        break
+                    except RateLimitTimeout:
+                        raise  # a espera do limitador já se esgotou; não soma outra por tentativa
+                    except (httpx.HTTPError, DEMProcessingError) as e:
+                        status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                        if tentativa >= _TENTATIVAS_DOWNLOAD or (status is not None and status < 500 and status != 429):
+                            logger.error("    -> (DEM) ❌ Falha no download de %s: %s", url, e)
+                            raise DEMProcessingError(f"Falha ao baixar o arquivo de elevação: {e}")
+                        logger.warning("    -> (DEM) Download de %s interrompido (%s); tentativa %d/%d.",
+                                       nome, e, tentativa + 1, _TENTATIVAS_DOWNLOAD)
+                        await asyncio.sleep(0.6 * (2 ** (tentativa - 1)))
+            baixado = True
+
+            try:
+                await run_in_threadpool(_converter_hgt, part_path, _caminho_tile(nome))
+            except Exception as e:
+                logger.error("    -> (DEM) ❌ Falha ao converter o tile %s: %s", nome, e, exc_info=True)
+                raise DEMProcessingError(f"Falha ao processar o arquivo DEM: {e}")
+        finally:
+            # O .part fixo (com lock) fica para ser retomado se o download caiu; baixado
+            # por completo (convertido ou corrompido) ou próprio desta tentativa, é apagado.
+            if baixado or not travado:
+                await run_in_threadpool(part_path.unlink, missing_ok=True)
+        logger.info("    -> (DEM) Tile %s salvo em: %s", nome, _caminho_tile(nome))
+    return await run_in_threadpool(_abrir_tile, nome)
+
+
+async def obter_tile(nome: str) -> TileDEM:
+    """Tile aberto por memmap; baixa (uma vez por tile, mesmo com pedidos concorrentes) se faltar."""
+    tile = await run_in_threadpool(_abrir_tile, nome)
+    if tile is not None:
+        return tile
+    return await _tiles_inflight.do(nome, lambda: _baixar_tile(nome))
+
+
+async def obter_mosaico(w: float, s: float, e: float, n: float) -> MosaicoDEM:
+    """Mosaico dos tiles que cobrem a área, baixando os que faltam em paralelo."""
+    nomes = tiles_da_area(w, s, e, n)
+    if len(nomes) > 1:
+        logger.info("    -> (DEM) Área cruza %d tiles: %s", len(nomes), ", ".join(nomes))
+    return MosaicoDEM(list(await asyncio.gather(*(obter_tile(nome) for nome in nomes))))
+
+
+async def baixar_tiles(nomes: Iterable[str]) -> Dict[str, Exception]:
+    """Garante os tiles em disco (downloads em paralelo, limitados pelo semáforo); devolve as falhas por tile."""
+    nomes = list(nomes)
+    resultados = await asyncio.gather(*(obter_tile(nome) for nome in nomes), return_exceptions=True)
+    falhas = {nome: r for nome, r in zip(nomes, resultados) if isinstance(r, Exception)}
+    for nome, erro in falhas.items():
+        logger.warning("    -> (DEM) ⚠️ Tile %s indisponível: %s", nome, erro)
+    return falhas
+
+
+def _mosaico_local(w: float, s: float, e: float, n: float) -> Optional[MosaicoDEM]:
+    """Mosaico só com tiles já em disco (None se faltar algum). Síncrona."""
+    tiles = [_abrir_tile(nome) for nome in tiles_da_area(w, s, e, n)]
+    if any(t is None for t in tiles):
+        return None
+    return MosaicoDEM(tiles)
+
+
+def download_stats() -> Dict[str, int]:
+    with _tiles_lock:
+        abertos = len(_tiles)
+    return {**_tiles_inflight.stats(), "tiles_abertos": abertos}
+
+
+# ----------------- Consumidores -----------------
+
+async def ler_area(w: float, s: float, e: float, n: float) -> Tuple[np.ndarray, rasterio.Affine, CRS, Optional[float]]:
+    """
+    MDT da área (W, S, E, N) por leitura de janela do mosaico de tiles: (dem int16,
+    transform, crs, nodata), no mesmo formato do antigo recorte por rasterio.
+    """
+    mosaico = await obter_mosaico(w, s, e, n)
+    dados, transform = await run_in_threadpool(mosaico.janela, w, s, e, n)
+    return dados, transform, CRS_WGS84, SRTM_NODATA
+
+
+def amostrar(
+    dados: np.ndarray, transform: rasterio.Affine, lats: np.ndarray, lons: np.ndarray, ordem: int = 1
+) -> np.ndarray:
+    """
+    Cota interpolada nos pontos (qualquer shape; ordem 1 = bilinear, 3 = cúbica)
+    a partir de um raster float (NaN = nodata). NaN, ponto a ponto, se o ponto
+    cair fora do raster ou a vizinhança usada na interpolação tiver nodata.
+    """
+    rows = (np.asarray(lats, dtype=np.float64) - transform.f) / transform.e - 0.5
+    cols = (np.asarray(lons, dtype=np.float64) - transform.c) / transform.a - 0.5
+    altura, largura = dados.shape
+    invalido = (rows < 0) | (cols < 0) | (rows > altura - 1) | (cols > largura - 1)
+
+    vazio = np.isnan(dados)
+    if vazio.any():
+        # Vizinhança da interpolação: 2×2 (bilinear) ou 4×4 (cúbica) em volta do ponto
+        r0 = np.floor(np.clip(rows, 0, altura - 1)).astype(np.int64)
+        c0 = np.floor(np.clip(cols, 0, largura - 1)).astype(np.int64)
+        deslocs = range(0, 2) if ordem <= 1 else range(-1, 3)
+        for dr in deslocs:
+            rr = np.clip(r0 + dr, 0, altura - 1)
+            for dc in deslocs:
+                invalido |= vazio[rr, np.clip(c0 + dc, 0, largura - 1)]
+        # Preenche os vazios com o vizinho válido mais próximo para não contaminar o
+        # resto da janela (o pré-filtro do spline cúbico é global).
+        if vazio.all():
+            return np.full(rows.shape, np.nan, dtype=np.float64)
+        _, (ir, ic) = distance_transform_edt(vazio, return_indices=True)
+        dados = dados[ir, ic]
+
+    coords = np.vstack([rows.ravel(), cols.ravel()])
+    cotas = map_coordinates(dados, coords, order=ordem, mode="nearest").astype(np.float64).reshape(rows.shape)
+    cotas[invalido] = np.nan
+    return cotas
+
+
+def _ordem_interpolacao() -> int:
+    return 3 if settings.SIM_ELEVATION_INTERPOLACAO == "cubica" else 1
+
+
+def _area_do_perfil(lats: np.ndarray, lons: np.ndarray) -> Tuple[float, float, float, float]:
+    """Área (W, S, E, N) lida para amostrar os pontos, com a margem da janela."""
+    # Inclui os tiles vizinhos que a margem da janela alcança (passo de 3" no pior caso)
+    folga = _MARGEM_JANELA / 1200.0
+    return (
+        float(np.min(lons)) - folga, float(np.min(lats)) - folga,
+        float(np.max(lons)) + folga, float(np.max(lats)) + folga,
+    )
+
+
+def tiles_do_perfil(lats: np.ndarray, lons: np.ndarray) -> Tuple[str, ...]:
+    """Tiles que perfil_local precisa em disco para amostrar estes pontos."""
+    return tuple(tiles_da_area(*_area_do_perfil(lats, lons)))
+
+
+def perfil_local(lats: np.ndarray, lons: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Cotas do terreno nos pontos (qualquer shape, ex.: várias linhas de perfil),
+    lidas de uma janela do mosaico de tiles SRTM locais numa só interpolação.
+    NaN nos pontos cuja vizinhança tem nodata (SRTM void); None se algum tile
+    ainda não foi baixado ou a janela ficaria grande demais. Nos dois casos o
+    chamador recorre ao caminho por linha / API remota.
+    """
+    lat_min, lat_max = float(np.min(lats)), float(np.max(lats))
+    lon_min, lon_max = float(np.min(lons)), float(np.max(lons))
+    mosaico = _mosaico_local(*_area_do_perfil(lats, lons))
+    if mosaico is None:
+        return None
+    p = mosaico.passo
+    if ((lat_max - lat_min) / p + 2 * _MARGEM_JANELA + 1) * ((lon_max - lon_min) / p + 2 * _MARGEM_JANELA + 1) > _MAX_CELULAS_JANELA:
+        return None
+
+    bruto, transform = mosaico.janela(lon_min, lat_min, lon_max, lat_max, margem_px=_MARGEM_JANELA)
+    dados = bruto.astype(np.float32)
+    dados[bruto == SRTM_NODATA] = np.nan
+    return amostrar(dados, transform, lats, lons, _ordem_interpolacao())
@@ -0,0 +1,191 @@
+# backend/services/http_pool.py
+
+import logging
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from backend.config import settings
+
+logger = logging.getLogger("irricontrol")
+
+
+# ----------------- Perfis por host -----------------
+# Cada upstream tem um padrão de uso diferente: a CloudRF recebe poucas
+# requisições longas, o OpenTopoData recebe rajadas curtas (busca de
+# repetidoras) e o S3 do SRTM serve downloads grandes. Valores ausentes
+# caem nos defaults de settings (HTTP_*).
+
+_HOST_PROFILES: Dict[str, Dict[str, Any]] = {
+    "api.cloudrf.com": {"max_connections": 16, "max_keepalive": 8, "timeout": None},
+    "api.opentopodata.org": {"max_connections": 8, "max_keepalive": 8, "timeout": 20.0},
+    "elevation-tiles-prod.s3.amazonaws.com": {"max_connections": 4, "max_keepalive": 4, "timeout": 90.0},
+}
+
+
+def _host_of(url: str) -> str:
+    return (urlsplit(str(url)).hostname or "").lower()
+
+
+def _http2_available() -> bool:
+    if not settings.HTTP_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except Exception:
+        logger.warning('HTTP/2 ativado mas pacote "h2" ausente. Fallback para HTTP/1.1. '
+                       'Dica: pip install "httpx[http2]"')
+        return False
+
+
+class _HostStats:
+    """Contadores de uso de um client (um por host)."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.in_flight = 0
+        self.waits = 0
+        self.new_connections = 0
+        self.errors = 0
+        self.total_time_s = 0.0
+
+    def as_dict(self, open_connections: int) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "open_connections": open_connections,
+            "max_connections": self.max_connections,
+            "new_connections": self.new_connections,
+            "reused_connections": max(self.requests - self.new_connections, 0),
+            "waits": self.waits,
+            "errors": self.errors,
+            "avg_time_ms": round(1000 * self.total_time_s / self.requests, 1) if self.requests else 0.0,
+        }
+
+
+class _InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """
+    Transport que alimenta _HostStats. Conexões novas são detectadas pelo
+    trace do httpcore (connect_tcp); o restante das requisições reutilizou
+    uma conexão do pool (keep-alive ou stream HTTP/2).
+    """
+
+    def __init__(self, stats: _HostStats, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.stats
+        if stats.in_flight >= stats.max_connections:
+            stats.waits += 1
+        stats.requests += 1
+        stats.in_flight += 1
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                stats.new_connections += 1
+
+        request.extensions = {**request.extensions, "trace": trace}
+        t0 = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight = max(stats.in_flight - 1, 0)
+            stats.total_time_s += time.perf_counter() - t0
+        if response.status_code >= 400:
+            stats.errors += 1
+        return response
+
+    @property
+    def open_connections(self) -> int:
+        try:
+            return len(self._pool.connections)
+        except Exception:
+            return 0
+
+
+class HttpClientPool:
+    """
+    Pool de AsyncClients de longa duração, um por host upstream.
+    Criado no lifespan (startup) e fechado no shutdown; os serviços NÃO
+    devem fechar o client recebido (nada de `async with`).
+    """
+
+    DEFAULT_KEY = "*"
+
+    def __init__(self) -> None:
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, _HostStats] = {}
+        self._transports: Dict[str, _InstrumentedTransport] = {}
+        self._http2: Optional[bool] = None
+
+    # --------- Ciclo de vida ---------
+
+    async def startup(self) -> None:
+        """Pré-cria os clients dos hosts conhecidos (CloudRF incluída)."""
+        self._http2 = _http2_available()
+        for host in {*_HOST_PROFILES, _host_of(str(settings.CLOUDRF_API_URL))}:
+            self._get_or_create(host)
+        logger.info("HTTP pool iniciado (hosts=%s, http2=%s).", sorted(self._clients), self._http2)
+
+    async def shutdown(self) -> None:
+        clients, self._clients = self._clients, {}
+        self._transports = {}
+        for key, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("Falha ao fechar client HTTP '%s': %s", key, e)
+        logger.info("HTTP pool finalizado (%d clients fechados).", len(clients))
+
+    # --------- Acesso ---------
+
+    def client_for(self, url: str) -> httpx.AsyncClient:
+        """Retorna o client compartilhado do host da URL (cria sob demanda)."""
+        host = _host_of(url)
+        known = host in _HOST_PROFILES or host == _host_of(str(settings.CLOUDRF_API_URL))
+        key = host if known else self.DEFAULT_KEY
+        return self._get_or_create(key)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            key: self._stats[key].as_dict(transport.open_connections)
+            for key, transport in self._transports.items()
+        }
+
+    # --------- Internos ---------
+
+    def _get_or_create(self, key: str) -> httpx.AsyncClient:
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+
+        if self._http2 is None:
+            self._http2 = _http2_available()
+
+        profile = _HOST_PROFILES.get(key, {})
+        max_conn = int(profile.get("max_connections") or settings.HTTP_MAX_CONNECTIONS)
+        max_keep = int(profile.get("max_keepalive") or settings.HTTP_MAX_KEEPALIVE)
+        timeout = float(profile.get("timeout") or settings.HTTP_TIMEOUT)
+
+        stats = self._stats.setdefault(key, _HostStats(max_conn))
+        limits = httpx.Limits(
+            max_connections=max_conn,
+            max_keepalive_connections=max_keep,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        )
+        transport = _InstrumentedTransport(stats, http2=self._http2, limits=limits)
+        client = httpx.AsyncClient(timeout=httpx.Timeout(timeout), transport=transport)
+        self._clients[key] = client
+        self._transports[key] = transport
+        return client
+
+
+http_pool = HttpClientPool()
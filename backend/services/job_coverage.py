@@ -0,0 +1,446 @@
+# backend/services/job_coverage.py
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.config import settings
+from backend.services.coverage_mask import normalize_bounds
+from backend.services.overlay_cache import overlay_cache
+from backend.services.signal_palette import SEM_SINAL, SignalPalette, niveis_das_faixas
+
+logger = logging.getLogger("irricontrol")
+
+# Identidade de um overlay: (caminho, mtime_ns, tamanho, bounds normalizados, template)
+_OverlayKey = Tuple[str, int, int, Tuple[float, float, float, float], Optional[str]]
+
+# Paleta do overlay e sensibilidade (rxs) do template; None se não há nível decodificável.
+SinalDoOverlay = Callable[[Dict[str, Any]], Optional[Tuple[SignalPalette, float]]]
+
+# Folga (em pixels do overlay) nas bordas das células, contra diferenças de arredondamento.
+_EPS_PIXEL = 1e-6
+
+
+def _faixa_de_pixels(bordas: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    [primeiro, último] pixel (int() do teste pontual, trunca para zero) alcançado
+    por pontos entre bordas consecutivas (em pixels do overlay), com folga.
+    """
+    return np.trunc(bordas[:-1] - _EPS_PIXEL).astype(np.int64), np.trunc(bordas[1:] + _EPS_PIXEL).astype(np.int64)
+
+
+def _nao_uniforme(
+    valores: np.ndarray, fora: Any, y0: np.ndarray, y1: np.ndarray, x0: np.ndarray, x1: np.ndarray
+) -> np.ndarray:
+    """
+    (linhas, colunas): True se `valores` não é constante no retângulo de pixels
+    [y0[i], y1[i]] x [x0[j], x1[j]] (inclusive); pixels fora da imagem valem
+    `fora`. Conta as bordas entre pixels vizinhos diferentes por somas acumuladas.
+    """
+    h, w = valores.shape
+    v = np.full((h + 2, w + 2), fora, dtype=valores.dtype)
+    v[1:-1, 1:-1] = valores
+    # No array com moldura o pixel -1 vira 0 e o pixel `w` (fora) vira w + 1
+    y0, y1 = np.clip(y0, -1, h) + 1, np.clip(y1, -1, h) + 1
+    x0, x1 = np.clip(x0, -1, w) + 1, np.clip(x1, -1, w) + 1
+
+    def _soma(bordas: np.ndarray, r0: np.ndarray, r1: np.ndarray, c0: np.ndarray, c1: np.ndarray) -> np.ndarray:
+        """Soma de `bordas` em [r0, r1) x [c0, c1), por célula."""
+        acc = np.zeros((bordas.shape[0] + 1, bordas.shape[1] + 1), dtype=np.int32)
+        np.cumsum(np.cumsum(bordas, axis=0, dtype=np.int32), axis=1, out=acc[1:, 1:])
+        r0, r1 = r0[:, None], r1[:, None]
+        return acc[r1, c1] - acc[r0, c1] - acc[r1, c0] + acc[r0, c0]
+
+    horizontais = v[:, 1:] != v[:, :-1]  # (y, x) != (y, x + 1)
+    verticais = v[1:, :] != v[:-1, :]    # (y, x) != (y + 1, x)
+    return (_soma(horizontais, y0, y1 + 1, x0, x1) + _soma(verticais, y0, y1, x0, x1 + 1)) > 0
+
+
+class _Contribuicao:
+    """
+    Pixels da grade cobertos por um overlay (janela compactada em bits), as
+    células em que o overlay não é uniforme (idem) e, se a paleta for
+    conhecida, a faixa de sinal em cada célula (int8).
+    """
+
+    __slots__ = ("row0", "col0", "shape", "bits", "bits_incerto", "faixas", "niveis", "rxs")
+
+    def __init__(self, row0: int, col0: int, janela: np.ndarray, incerto: np.ndarray,
+                 faixas: Optional[np.ndarray] = None, niveis: Optional[np.ndarray] = None, rxs: float = 0.0):
+        self.row0, self.col0 = row0, col0
+        self.shape = janela.shape
+        self.bits = np.packbits(janela, axis=None)
+        self.bits_incerto = np.packbits(incerto, axis=None)
+        self.faixas, self.niveis, self.rxs = faixas, niveis, rxs
+
+    def _desempacotar(self, bits: np.ndarray) -> np.ndarray:
+        n = self.shape[0] * self.shape[1]
+        return np.unpackbits(bits, count=n).reshape(self.shape).astype(bool)
+
+    def janela(self) -> np.ndarray:
+        return self._desempacotar(self.bits)
+
+    def incerto(self) -> np.ndarray:
+        return self._desempacotar(self.bits_incerto)
+
+
+class JobCoverageGrid:
+    """
+    Grade composta de cobertura de um job: contagem, por célula, de quantos
+    overlays ativos cobrem o ponto (união = contagem > 0).
+
+    A grade vive num reticulado fixo (origem e passo definidos pelo primeiro
+    overlay, passo = pixel da imagem). Incluir/remover um overlay só soma/subtrai
+    a janela dele; a grade cresce em células inteiras quando necessário, então
+    contribuições antigas continuam alinhadas. Consultas são O(pontos).
+
+    Cada overlay é amostrado no centro da célula, mas tem reticulado próprio:
+    uma célula em que algum overlay não é uniforme (borda de cobertura ou de
+    faixa dentro dela) fica marcada como incerta, e os pontos que caem nela
+    devem ser verificados pixel a pixel em cada overlay (ver `incerto_at`).
+    Nas demais, o resultado é idêntico ao teste pontual overlay a overlay.
+
+    Com paleta conhecida, a grade guarda também, por célula, o nível (dBm) do
+    overlay de maior margem sobre a sensibilidade do seu template. Incluir faz
+    o máximo na janela; remover recalcula só a janela removida a partir das
+    contribuições restantes que a cruzam.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self._overlays: Dict[_OverlayKey, _Contribuicao] = {}
+        self._count: Optional[np.ndarray] = None  # uint16 (linhas, colunas)
+        self._incerto: Optional[np.ndarray] = None  # uint16: overlays não uniformes na célula
+        self._nivel: Optional[np.ndarray] = None  # float32, NaN sem sinal (só com paleta conhecida)
+        self._margem: Optional[np.ndarray] = None
+        self._lon0 = self._lat0 = 0.0             # canto NW da célula (0, 0) do reticulado
+        self._lon_span = self._lat_span = 1.0     # extensão do overlay âncora (graus) ...
+        self._width = self._height = 1            # ... e seu tamanho em pixels
+        self._row_origin = self._col_origin = 0   # índice do reticulado da posição [0, 0] do array
+        self.adds = 0
+        self.removes = 0
+        self.versao = 0                           # muda a cada inclusão/remoção de overlay
+        self.raster_salvo: Optional[Tuple[int, Path]] = None  # (versao, PNG de redundância já gravado)
+
+    # --------- Reticulado ---------
+
+    def _init_lattice(self, bounds: Tuple[float, float, float, float], width: int, height: int) -> None:
+        s, w, n, e = bounds
+        self._lon0, self._lat0 = w, n
+        self._lon_span, self._lat_span = e - w, n - s
+        self._width, self._height = width, height
+
+    # Mesma forma de conta do teste pontual ((lon - w) / Δlon * largura): no overlay
+    # âncora, célula da grade == pixel da imagem, sem diferença de arredondamento.
+    def _cols(self, lons: np.ndarray) -> np.ndarray:
+        return ((lons - self._lon0) / self._lon_span) * self._width
+
+    def _rows(self, lats: np.ndarray) -> np.ndarray:
+        return ((self._lat0 - lats) / self._lat_span) * self._height
+
+    def _lattice_window(self, bounds: Tuple[float, float, float, float]) -> Tuple[int, int, int, int]:
+        """Índices [r0, r1) x [c0, c1) do reticulado que cobrem os bounds."""
+        s, w, n, e = bounds
+        r0 = int(np.floor(self._rows(np.float64(n)) + 1e-9))
+        r1 = int(np.ceil(self._rows(np.float64(s)) - 1e-9))
+        c0 = int(np.floor(self._cols(np.float64(w)) + 1e-9))
+        c1 = int(np.ceil(self._cols(np.float64(e)) - 1e-9))
+        return r0, max(r1, r0 + 1), c0, max(c1, c0 + 1)
+
+    def _ensure_extent(self, r0: int, r1: int, c0: int, c1: int) -> bool:
+        """Cresce o array para conter a janela. False se exceder SIM_JOB_GRID_MAX_CELLS."""
+        if self._count is None:
+            rows, cols = r1 - r0, c1 - c0
+            if rows * cols > settings.SIM_JOB_GRID_MAX_CELLS:
+                return False
+            self._count = np.zeros((rows, cols), dtype=np.uint16)
+            self._incerto = np.zeros((rows, cols), dtype=np.uint16)
+            self._row_origin, self._col_origin = r0, c0
+            return True
+
+        cur_r0, cur_c0 = self._row_origin, self._col_origin
+        cur_r1, cur_c1 = cur_r0 + self._count.shape[0], cur_c0 + self._count.shape[1]
+        new_r0, new_r1 = min(cur_r0, r0), max(cur_r1, r1)
+        new_c0, new_c1 = min(cur_c0, c0), max(cur_c1, c1)
+        if (new_r0, new_r1, new_c0, new_c1) == (cur_r0, cur_r1, cur_c0, cur_c1):
+            return True
+        if (new_r1 - new_r0) * (new_c1 - new_c0) > settings.SIM_JOB_GRID_MAX_CELLS:
+            return False
+        for nome in ("_count", "_incerto"):
+            grown = np.zeros((new_r1 - new_r0, new_c1 - new_c0), dtype=np.uint16)
+            grown[cur_r0 - new_r0:cur_r1 - new_r0, cur_c0 - new_c0:cur_c1 - new_c0] = getattr(self, nome)
+            setattr(self, nome, grown)
+        if self._nivel is not None:
+            for nome in ("_nivel", "_margem"):
+                grown_f = np.full(grown.shape, np.nan, dtype=np.float32)
+                grown_f[cur_r0 - new_r0:cur_r1 - new_r0, cur_c0 - new_c0:cur_c1 - new_c0] = getattr(self, nome)
+                setattr(self, nome, grown_f)
+        self._row_origin, self._col_origin = new_r0, new_c0
+        return True
+
+    # --------- Sinal ---------
+
+    def _aplicar_sinal(self, contrib: _Contribuicao, r0: int, r1: int, c0: int, c1: int) -> None:
+        """Máximo da margem da contribuição sobre a grade, na janela [r0, r1) x [c0, c1) do reticulado."""
+        r0, r1 = max(r0, contrib.row0), min(r1, contrib.row0 + contrib.shape[0])
+        c0, c1 = max(c0, contrib.col0), min(c1, contrib.col0 + contrib.shape[1])
+        if r0 >= r1 or c0 >= c1:
+            return
+        if self._nivel is None:
+            self._nivel = np.full(self._count.shape, np.nan, dtype=np.float32)
+            self._margem = np.full(self._count.shape, np.nan, dtype=np.float32)
+        nivel = niveis_das_faixas(
+            contrib.faixas[r0 - contrib.row0:r1 - contrib.row0, c0 - contrib.col0:c1 - contrib.col0], contrib.niveis
+        )
+        margem = nivel - np.float32(contrib.rxs)
+        rr0, rr1 = r0 - self._row_origin, r1 - self._row_origin
+        cc0, cc1 = c0 - self._col_origin, c1 - self._col_origin
+        atual_n, atual_m = self._nivel[rr0:rr1, cc0:cc1], self._margem[rr0:rr1, cc0:cc1]
+        # Maior margem; no empate, maior nível (mesma regra de analysis_service._sinal_pontos)
+        melhor = ~np.isnan(margem) & (~(margem <= atual_m) | ((margem == atual_m) & (nivel > atual_n)))
+        atual_n[melhor] = nivel[melhor]
+        atual_m[melhor] = margem[melhor]
+
+    def _recalcular_sinal(self, contrib: _Contribuicao) -> None:
+        """Refaz a janela de uma contribuição removida com as que continuam ativas."""
+        r0, c0 = contrib.row0, contrib.col0
+        r1, c1 = r0 + contrib.shape[0], c0 + contrib.shape[1]
+        rr, cc = r0 - self._row_origin, c0 - self._col_origin
+        self._nivel[rr:rr + contrib.shape[0], cc:cc + contrib.shape[1]] = np.nan
+        self._margem[rr:rr + contrib.shape[0], cc:cc + contrib.shape[1]] = np.nan
+        for outra in self._overlays.values():
+            if outra.faixas is not None:
+                self._aplicar_sinal(outra, r0, r1, c0, c1)
+
+    # --------- Overlays ---------
+
+    @staticmethod
+    def overlay_key(overlay: Dict[str, Any]) -> Optional[_OverlayKey]:
+        bounds = list(overlay["bounds"])
+        if len(bounds) != 4:
+            return None
+        path = Path(overlay["imagem_path"])
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (str(path.resolve()), st.st_mtime_ns, st.st_size, normalize_bounds(bounds), overlay.get("template"))
+
+    def _add(self, key: _OverlayKey, overlay: Dict[str, Any], sinal_do_overlay: Optional[SinalDoOverlay]) -> bool:
+        bounds = key[3]
+        s, w, n, e = bounds
+        if e - w == 0 or n - s == 0:
+            return False
+        mascara = overlay_cache.mask(Path(overlay["imagem_path"]), list(overlay["bounds"]))
+        if self._count is None and not self._overlays:
+            self._init_lattice(bounds, mascara.width, mascara.height)
+
+        # Janela com 1 pixel do overlay (+1 célula) a mais em cada lado: o int() do
+        # teste pontual trunca para zero, então até 1 pixel a oeste/norte ainda é o pixel 0.
+        dx, dy = (e - w) / mascara.width, (n - s) / mascara.height
+        r0, r1, c0, c1 = self._lattice_window((s - dy, w - dx, n + dy, e + dx))
+        r0, r1, c0, c1 = r0 - 1, r1 + 1, c0 - 1, c1 + 1
+        if not self._ensure_extent(r0, r1, c0, c1):
+            raise MemoryError(f"Grade do job '{self.job_id}' excederia SIM_JOB_GRID_MAX_CELLS.")
+
+        # Centro de cada célula amostrado na máscara do overlay (mesma conta do teste pontual)
+        lats = self._lat0 - (np.arange(r0, r1) + 0.5) / self._height * self._lat_span
+        lons = self._lon0 + (np.arange(c0, c1) + 0.5) / self._width * self._lon_span
+        px = np.trunc(((lons - w) / (e - w)) * mascara.width).astype(np.int64)
+        py = np.trunc(((n - lats) / (n - s)) * mascara.height).astype(np.int64)
+        janela = mascara.covered_many(px[None, :], py[:, None])
+
+        # Pixels do overlay alcançados por cada célula inteira (bordas da célula)
+        bordas_lat = self._lat0 - np.arange(r0, r1 + 1) / self._height * self._lat_span
+        bordas_lon = self._lon0 + np.arange(c0, c1 + 1) / self._width * self._lon_span
+        y0, y1 = _faixa_de_pixels(((n - bordas_lat) / (n - s)) * mascara.height)
+        x0, x1 = _faixa_de_pixels(((bordas_lon - w) / (e - w)) * mascara.width)
+        incerto = _nao_uniforme(mascara.unpack(), False, y0, y1, x0, x1)
+
+        sinal = sinal_do_overlay(overlay) if sinal_do_overlay is not None else None
+        faixas = None
+        if sinal is not None:
+            paleta, rxs = sinal
+            grade = overlay_cache.sinal(Path(overlay["imagem_path"]), paleta)
+            faixas = grade.indice_many(px[None, :], py[:, None])
+            incerto |= _nao_uniforme(grade.indices, SEM_SINAL, y0, y1, x0, x1)
+
+        rr, cc = r0 - self._row_origin, c0 - self._col_origin
+        self._count[rr:rr + janela.shape[0], cc:cc + janela.shape[1]] += janela
+        self._incerto[rr:rr + janela.shape[0], cc:cc + janela.shape[1]] += incerto
+        if faixas is None:
+            contrib = _Contribuicao(r0, c0, janela, incerto)
+        else:
+            contrib = _Contribuicao(r0, c0, janela, incerto, faixas, paleta.niveis, rxs)
+            self._aplicar_sinal(contrib, r0, r1, c0, c1)
+        self._overlays[key] = contrib
+        self.adds += 1
+        self.versao += 1
+        return True
+
+    def _remove(self, key: _OverlayKey) -> None:
+        contrib = self._overlays.pop(key)
+        janela = contrib.janela()
+        rr, cc = contrib.row0 - self._row_origin, contrib.col0 - self._col_origin
+        self._count[rr:rr + janela.shape[0], cc:cc + janela.shape[1]] -= janela
+        self._incerto[rr:rr + janela.shape[0], cc:cc + janela.shape[1]] -= contrib.incerto()
+        if contrib.faixas is not None:
+            self._recalcular_sinal(contrib)
+        self.removes += 1
+        self.versao += 1
+
+    def sync(
+        self, overlays_info: List[Dict[str, Any]], sinal_do_overlay: Optional[SinalDoOverlay] = None
+    ) -> Dict[str, int]:
+        """
+        Deixa a grade igual ao conjunto `overlays_info`: inclui os novos e remove
+        os que saíram (ou cujo arquivo mudou). Chame com `self.lock` adquirido.
+        `sinal_do_overlay` dá a paleta/sensibilidade dos overlays incluídos
+        (sem ela, a grade só conta cobertura).
+        """
+        self.last_used = time.time()
+        desejados: Dict[_OverlayKey, Dict[str, Any]] = {}
+        for ov in overlays_info:
+            key = self.overlay_key(ov)
+            if key is None:
+                logger.warning("  -> ⚠️ Overlay ignorado na grade do job (imagem/bounds inválidos): %s",
+                               ov.get("imagem_path"))
+                continue
+            desejados.setdefault(key, ov)
+
+        removidos = [k for k in self._overlays if k not in desejados]
+        for key in removidos:
+            self._remove(key)
+        incluidos = 0
+        for key, ov in desejados.items():
+            if key not in self._overlays and self._add(key, ov, sinal_do_overlay):
+                incluidos += 1
+        if not self._overlays:
+            self._count = self._incerto = self._nivel = self._margem = None
+        return {"incluidos": incluidos, "removidos": len(removidos), "ativos": len(self._overlays)}
+
+    # --------- Consultas ---------
+
+    def _celulas(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Linha e coluna do array para cada ponto e máscara dos que caem dentro da grade."""
+        rows = np.floor(self._rows(np.asarray(lats, dtype=np.float64))).astype(np.int64) - self._row_origin
+        cols = np.floor(self._cols(np.asarray(lons, dtype=np.float64))).astype(np.int64) - self._col_origin
+        dentro = (rows >= 0) & (rows < self._count.shape[0]) & (cols >= 0) & (cols < self._count.shape[1])
+        return rows[dentro], cols[dentro], dentro
+
+    def count_at(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Quantos overlays cobrem cada ponto (0 fora da grade); só vale fora de `incerto_at`."""
+        out = np.zeros(np.shape(lats), dtype=np.int64)
+        if self._count is None:
+            return out
+        rows, cols, dentro = self._celulas(lats, lons)
+        out[dentro] = self._count[rows, cols]
+        return out
+
+    def incerto_at(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """True nos pontos cuja célula não é uniforme em algum overlay (verificar overlay a overlay)."""
+        out = np.zeros(np.shape(lats), dtype=bool)
+        if self._count is None:
+            return out
+        rows, cols, dentro = self._celulas(lats, lons)
+        out[dentro] = self._incerto[rows, cols] > 0
+        return out
+
+    def sinal_at(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (nível dBm, margem dB) do melhor overlay em cada ponto; NaN fora da grade
+        ou sem sinal. Só vale fora de `incerto_at`.
+        """
+        nivel = np.full(np.shape(lats), np.nan, dtype=np.float32)
+        margem = np.full(np.shape(lats), np.nan, dtype=np.float32)
+        if self._nivel is None:
+            return nivel, margem
+        rows, cols, dentro = self._celulas(lats, lons)
+        nivel[dentro] = self._nivel[rows, cols]
+        margem[dentro] = self._margem[rows, cols]
+        return nivel, margem
+
+    def raster(self) -> Optional[Tuple[np.ndarray, List[float]]]:
+        """
+        Cópia da contagem por célula (quantos overlays cobrem cada pixel) e seus
+        bounds [N, E, S, W] (ordem da CloudRF). None se não há overlays.
+        """
+        if self._count is None:
+            return None
+        rows, cols = self._count.shape
+        n = self._lat0 - self._row_origin / self._height * self._lat_span
+        s = self._lat0 - (self._row_origin + rows) / self._height * self._lat_span
+        w = self._lon0 + self._col_origin / self._width * self._lon_span
+        e = self._lon0 + (self._col_origin + cols) / self._width * self._lon_span
+        return self._count.copy(), [n, e, s, w]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "overlays": len(self._overlays),
+            "shape": list(self._count.shape) if self._count is not None else None,
+            "cells": int(self._count.size) if self._count is not None else 0,
+            "bytes": sum(int(a.nbytes) for a in (self._count, self._incerto, self._nivel, self._margem) if a is not None),
+            "adds": self.adds,
+            "removes": self.removes,
+        }
+
+
+class JobCoverageRegistry:
+    """Grades por job, em memória do processo, com limite de jobs (LRU)."""
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max_jobs
+        self._grids: "OrderedDict[str, JobCoverageGrid]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> JobCoverageGrid:
+        with self._lock:
+            grid = self._grids.get(job_id)
+            if grid is None:
+                grid = JobCoverageGrid(job_id)
+                self._grids[job_id] = grid
+                while len(self._grids) > self.max_jobs:
+                    old_id, _ = self._grids.popitem(last=False)
+                    logger.info("Grade de cobertura do job %s descartada (LRU).", old_id)
+            else:
+                self._grids.move_to_end(job_id)
+            return grid
+
+    def drop(self, job_id: str) -> None:
+        with self._lock:
+            self._grids.pop(job_id, None)
+
+    def ajustar(self, job_id: str) -> None:
+        """Descarta as grades menos usadas (exceto a de `job_id`) até o total caber em SIM_JOB_GRID_MAX_TOTAL_CELLS."""
+        with self._lock:
+            total = sum(g.stats()["cells"] for g in self._grids.values())
+            for old_id in list(self._grids):
+                if total <= settings.SIM_JOB_GRID_MAX_TOTAL_CELLS:
+                    break
+                if old_id == job_id:
+                    continue
+                total -= self._grids.pop(old_id).stats()["cells"]
+                logger.info("Grade de cobertura do job %s descartada (limite total de células).", old_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            grids = list(self._grids.values())
+        stats = [g.stats() for g in grids]
+        return {
+            "jobs": len(grids),
+            "max_jobs": self.max_jobs,
+            "cells": sum(st["cells"] for st in stats),
+            "max_cells": settings.SIM_JOB_GRID_MAX_TOTAL_CELLS,
+            "bytes": sum(st["bytes"] for st in stats),
+        }
+
+
+job_coverage = JobCoverageRegistry(max_jobs=settings.SIM_JOB_GRID_MAX_JOBS)
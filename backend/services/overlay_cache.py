@@ -0,0 +1,119 @@
+# backend/services/overlay_cache.py
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from backend.config import settings
+from backend.services.coverage_mask import CoverageMask, load_mask
+from backend.services.signal_palette import SignalGrid, SignalPalette
+
+logger = logging.getLogger("irricontrol")
+
+# (tipo, caminho absoluto, mtime_ns, tamanho): arquivo regravado -> chave nova.
+_Key = Tuple[str, str, int, int]
+
+
+class OverlayCache:
+    """
+    Cache LRU, por processo, de dados decodificados de overlays (máscaras de
+    cobertura e derivados), limitado por bytes e seguro entre threads.
+
+    A chave inclui mtime e tamanho do arquivo, então uma imagem regravada nunca
+    devolve dados antigos. Carregamentos simultâneos da mesma chave (ex.: pivôs
+    e bombas do /run_main em paralelo) são feitos uma única vez.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[_Key, Tuple[Any, int]]" = OrderedDict()
+        self._loading: Dict[_Key, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "uncacheable": 0}
+
+    @staticmethod
+    def _key(kind: str, path: Path) -> _Key:
+        st = os.stat(path)
+        return (kind, str(Path(path).resolve()), st.st_mtime_ns, st.st_size)
+
+    def get_or_load(self, kind: str, path: Path, loader: Callable[[], Any], nbytes: Callable[[Any], int]) -> Any:
+        """Valor em cache para (kind, arquivo); senão chama `loader()` e guarda o resultado."""
+        key = self._key(kind, path)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self._counters["hits"] += 1
+                return item[0]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Outra thread pode ter carregado enquanto esperávamos.
+            with self._lock:
+                item = self._items.get(key)
+                if item is not None:
+                    self._items.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return item[0]
+            try:
+                value = loader()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+            self._store(key, value, int(nbytes(value)))
+            return value
+
+    def _store(self, key: _Key, value: Any, size: int) -> None:
+        with self._lock:
+            self._counters["misses"] += 1
+            if self.max_bytes <= 0 or size > self.max_bytes:
+                self._counters["uncacheable"] += 1
+                return
+            self._items[key] = (value, size)
+            self._bytes += size
+            # Versões antigas do mesmo arquivo nunca mais serão pedidas.
+            for old in [k for k in self._items if k[:2] == key[:2] and k != key]:
+                self._bytes -= self._items.pop(old)[1]
+            while self._bytes > self.max_bytes and self._items:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+                self._counters["evictions"] += 1
+
+    def mask(self, image_path: Path, bounds: Sequence[float]) -> CoverageMask:
+        """Máscara de cobertura do overlay (ver coverage_mask.load_mask), via cache."""
+        return self.get_or_load("mask", image_path, lambda: load_mask(image_path, bounds), lambda m: m.nbytes)
+
+    def sinal(self, image_path: Path, paleta: SignalPalette) -> SignalGrid:
+        """Faixas de sinal do overlay decodificadas pela paleta (RGB -> dBm), via cache."""
+        def _carregar() -> SignalGrid:
+            with Image.open(image_path) as img:
+                rgba = np.asarray(img.convert("RGBA"))
+            return SignalGrid(paleta.indices(rgba, settings.SIM_ALPHA_THRESHOLD), paleta)
+
+        return self.get_or_load(f"sinal:{paleta.nome}", image_path, _carregar, lambda g: g.nbytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round(self._counters["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+overlay_cache = OverlayCache(max_bytes=settings.OVERLAY_CACHE_MAX_BYTES)
@@ -0,0 +1,146 @@
+# backend/services/process_pool.py
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.config import settings
+
+logger = logging.getLogger("irricontrol")
+
+# (nome do bloco, shape, dtype) de um array passado por memória compartilhada
+_Handle = Tuple[str, Tuple[int, ...], str]
+
+# True dentro dos processos do pool: o trabalho nunca é repassado de novo.
+_EM_WORKER = False
+
+
+def _workers_configurados() -> int:
+    if settings.SIM_PROCESS_WORKERS is not None:
+        return settings.SIM_PROCESS_WORKERS
+    return min(max((os.cpu_count() or 1) - 1, 0), 4)
+
+
+def _marcar_worker() -> None:
+    global _EM_WORKER
+    _EM_WORKER = True
+
+
+def _desacoplar(resultado: Any, arrays: Sequence[np.ndarray]) -> Any:
+    """Copia arrays do resultado que ainda apontam para a memória compartilhada (que será fechada)."""
+    if isinstance(resultado, np.ndarray):
+        if any(np.shares_memory(resultado, arr) for arr in arrays):
+            return resultado.copy()
+        return resultado
+    if isinstance(resultado, (tuple, list)):
+        return type(resultado)(_desacoplar(item, arrays) for item in resultado)
+    return resultado
+
+
+def _executar_no_worker(fn: Callable[..., Any], handles: Sequence[_Handle], args: Tuple[Any, ...]) -> Any:
+    """Roda no processo filho: mapeia os arrays compartilhados (sem cópia) e chama `fn`."""
+    blocos: List[SharedMemory] = []
+    arrays: List[np.ndarray] = []
+    try:
+        for nome, shape, dtype in handles:
+            # Com spawn o filho usa o resource tracker do pai, que apaga o bloco (unlink).
+            shm = SharedMemory(name=nome)
+            blocos.append(shm)
+            arrays.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+        return _desacoplar(fn(*arrays, *args), arrays)
+    finally:
+        arrays.clear()
+        for shm in blocos:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # view presa num traceback de erro; o mapeamento some com o GC
+
+
+class ProcessPool:
+    """
+    Pool de processos para geoprocessamento CPU-bound (cobertura de muitos pontos,
+    picos no MDT), fora do GIL do servidor. Arrays grandes vão por memória
+    compartilhada; máscaras de overlay não trafegam: cada processo as abre por
+    memmap dos sidecars (.mask.npy), que o SO compartilha pelo page cache.
+
+    `deve_usar(carga)` decide pelo tamanho do trabalho; abaixo do limiar o custo
+    de serialização não compensa e o chamador segue no threadpool.
+    """
+
+    def __init__(self, workers: int, min_carga: int):
+        self.workers = workers
+        self.min_carga = min_carga
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"tarefas": 0, "erros": 0}
+
+    def deve_usar(self, carga: int) -> bool:
+        return self.workers > 0 and carga >= self.min_carga and not _EM_WORKER
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: o servidor tem threads ativas, fork poderia herdar locks travados.
+                # O tracker sobe antes para que os filhos herdem o mesmo (ver _executar_no_worker).
+                resource_tracker.ensure_running()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_marcar_worker,
+                )
+                logger.info("Pool de processos de geoprocessamento iniciado (%d workers).", self.workers)
+            return self._executor
+
+    def executar(self, fn: Callable[..., Any], arrays: Sequence[np.ndarray], *args: Any) -> Any:
+        """
+        Executa `fn(*arrays, *args)` num processo do pool e espera o resultado
+        (bloqueia a thread chamadora; use a partir do threadpool). `fn` deve ser
+        uma função de módulo; views dos arrays recebidos no resultado são copiadas.
+        """
+        blocos: List[SharedMemory] = []
+        try:
+            handles: List[_Handle] = []
+            for arr in arrays:
+                arr = np.ascontiguousarray(arr)
+                shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+                blocos.append(shm)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+                handles.append((shm.name, arr.shape, arr.dtype.str))
+            resultado = self._get_executor().submit(_executar_no_worker, fn, handles, args).result()
+            with self._lock:
+                self._counters["tarefas"] += 1
+            return resultado
+        except Exception:
+            with self._lock:
+                self._counters["erros"] += 1
+            raise
+        finally:
+            for shm in blocos:
+                shm.close()
+                shm.unlink()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "workers": self.workers,
+            "min_carga": self.min_carga,
+            "ativo": self._executor is not None,
+        }
+
+
+process_pool = ProcessPool(workers=_workers_configurados(), min_carga=settings.SIM_PROCESS_MIN_CARGA)
@@ -0,0 +1,216 @@
+# backend/services/propagation_service.py
+"""
+Motor de propagação local (NumPy) — alternativa rápida à CloudRF para prévias.
+
+Modelo por pixel:
+    Prx = Ptx(dBm) + txg + rxg - FSPL - L_solo - L_difração
+    - FSPL: espaço livre.
+    - L_solo: plano-terra (dois raios) após o ponto de quebra 4·ht·hr/λ.
+    - L_difração: gume de faca (ITU-R P.526) no obstáculo dominante do perfil,
+      com curvatura da Terra (k = 4/3), a partir do MDT SRTM em cache.
+
+O raster é calculado em coordenadas polares (raios a partir do TX) e depois
+reamostrado para a grade de saída, mesma área/resolução do payload da CloudRF.
+"""
+
+import logging
+from math import ceil, cos, log10, pi, radians
+from pathlib import Path
+from typing import Any, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+
+from backend.services import signal_palette
+
+logger = logging.getLogger("irricontrol")
+
+ENGINE_CLOUDRF = "cloudrf"
+ENGINE_LOCAL = "local"
+ENGINES = (ENGINE_CLOUDRF, ENGINE_LOCAL)
+
+# Versão do modelo local; entra na chave de cache (mudou o modelo -> novas imagens).
+LOCAL_ENGINE_VERSION = 3
+
+# Mesma área/resolução do payload enviado à CloudRF (output.rad / output.res).
+RAIO_PADRAO_M = 7000.0
+RESOLUCAO_PADRAO_M = 30.0
+
+_RAIO_TERRA_EFETIVO_M = 6371000.0 * 4.0 / 3.0
+_METERS_PER_DEG_LAT = 111320.0
+_C_MHZ_M = 299.792458  # λ (m) = c / f(MHz)
+
+# Rampa de cores por margem acima da sensibilidade (dB); abaixo de 0 é transparente.
+# Só usada quando a `col` do template não tem paleta conhecida (signal_palette).
+_RAMPA_MARGEM: Sequence[Tuple[float, Tuple[int, int, int]]] = (
+    (0.0, (255, 0, 0)),
+    (5.0, (255, 128, 0)),
+    (10.0, (255, 255, 0)),
+    (20.0, (128, 255, 0)),
+    (30.0, (0, 200, 0)),
+)
+
+
+# ----------------- Perdas -----------------
+
+def perda_difracao_gume(v: np.ndarray) -> np.ndarray:
+    """Perda por difração em gume de faca, ITU-R P.526 (aprox. válida para v > -0.78)."""
+    v = np.asarray(v, dtype=np.float32)
+    perda = 6.9 + 20.0 * np.log10(np.sqrt((v - 0.1) ** 2 + 1.0) + v - 0.1)
+    return np.where(v > -0.78, perda, 0.0).astype(np.float32)
+
+
+def _perdas_por_raio(
+    terreno: np.ndarray, passo_m: float, h_tx_abs: float, rx_alt: float, comprimento_onda: float
+) -> np.ndarray:
+    """
+    Perda de difração (dB) em cada ponto de cada raio.
+
+    `terreno` tem forma (n_raios, n_passos): cota do solo a (i+1)·passo do TX.
+    Para o receptor no passo j, o obstáculo dominante é o ponto i < j de maior
+    ângulo de elevação visto do TX (máximo acumulado), à la Bullington.
+    """
+    n_passos = terreno.shape[1]
+    d = (np.arange(n_passos, dtype=np.float32) + 1.0) * passo_m
+    solo = terreno - (d * d) / (2.0 * _RAIO_TERRA_EFETIVO_M)  # rebaixa pela curvatura
+
+    angulo = (solo - h_tx_abs) / d
+    angulo_rx = (solo + rx_alt - h_tx_abs) / d
+
+    # Máximo acumulado dos pontos ANTERIORES (exclui o próprio receptor) e seu índice.
+    angulo_ant = np.concatenate(
+        [np.full((terreno.shape[0], 1), -np.inf, dtype=np.float32), angulo[:, :-1]], axis=1
+    )
+    max_ant = np.maximum.accumulate(angulo_ant, axis=1)
+    idx = np.where(angulo_ant == max_ant, np.arange(n_passos), 0)
+    idx = np.maximum.accumulate(idx, axis=1)
+    # angulo_ant[:, k] é o ponto k-1: o obstáculo está uma amostra antes de `idx`
+    obstaculo = np.maximum(idx - 1, 0)
+
+    d1 = d[obstaculo]
+    d2 = d[None, :] - d1
+    valido = np.isfinite(max_ant) & (d2 > 0)
+    d2 = np.where(valido, d2, 1.0)
+    h = d1 * (max_ant - angulo_rx)  # altura do obstáculo acima da linha de visada
+    v = np.where(valido, h * np.sqrt(2.0 * d[None, :] / (comprimento_onda * d1 * d2)), -10.0)  # sem obstáculo
+    return perda_difracao_gume(v)
+
+
+# ----------------- Raster -----------------
+
+def _amostrar_dem(
+    dem: np.ndarray, transform: Any, nodata: Optional[float], lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """Cota do MDT (vizinho mais próximo) em coordenadas WGS84; fora/nodata -> mediana."""
+    dem = np.asarray(dem, dtype=np.float32)
+    validos = np.isfinite(dem) & ((dem != nodata) if nodata is not None else True)
+    preenchimento = float(np.median(dem[validos])) if validos.any() else 0.0
+
+    cols = np.floor((lons - transform.c) / transform.a).astype(np.int64)
+    rows = np.floor((lats - transform.f) / transform.e).astype(np.int64)
+    dentro = (rows >= 0) & (rows < dem.shape[0]) & (cols >= 0) & (cols < dem.shape[1])
+    out = np.full(lats.shape, preenchimento, dtype=np.float32)
+    r, c = rows[dentro], cols[dentro]
+    out[dentro] = np.where(validos[r, c], dem[r, c], preenchimento)
+    return out
+
+
+def calcular_nivel_sinal(
+    dem: np.ndarray,
+    dem_transform: Any,
+    dem_nodata: Optional[float],
+    tpl: Any,
+    lat: float,
+    lon: float,
+    tx_alt: float,
+    rx_alt: float,
+    raio_m: float = RAIO_PADRAO_M,
+    resolucao_m: float = RESOLUCAO_PADRAO_M,
+) -> Tuple[np.ndarray, list]:
+    """
+    Nível recebido (dBm) numa grade norte-para-cima centrada no TX, e os bounds
+    no formato da CloudRF [N, E, S, W]. Pixels fora do raio recebem -inf.
+    """
+    m_por_deg_lon = _METERS_PER_DEG_LAT * max(cos(radians(lat)), 1e-6)
+    comprimento_onda = _C_MHZ_M / float(tpl.frq)
+
+    # Perfis radiais: resolução angular suficiente para o anel externo.
+    n_passos = max(int(ceil(raio_m / resolucao_m)), 1)
+    n_raios = max(int(ceil(2 * pi * raio_m / resolucao_m)), 8)
+    az = np.arange(n_raios, dtype=np.float32) * np.float32(2 * pi / n_raios)
+    dist = (np.arange(n_passos, dtype=np.float32) + 1.0) * np.float32(resolucao_m)
+    dx = np.sin(az)[:, None] * dist[None, :]
+    dy = np.cos(az)[:, None] * dist[None, :]
+    terreno = _amostrar_dem(dem, dem_transform, dem_nodata, lat + dy / _METERS_PER_DEG_LAT, lon + dx / m_por_deg_lon)
+    solo_tx = float(_amostrar_dem(dem, dem_transform, dem_nodata, np.array([lat]), np.array([lon]))[0])
+
+    perda_dif = _perdas_por_raio(terreno, resolucao_m, solo_tx + float(tx_alt), float(rx_alt), comprimento_onda)
+
+    # Grade de saída
+    tamanho = max(int(2 * raio_m / resolucao_m), 1)
+    eixo = (np.arange(tamanho, dtype=np.float32) + 0.5) * np.float32(resolucao_m) - np.float32(raio_m)
+    gx, gy = np.meshgrid(eixo, -eixo)  # linha 0 = norte
+    gd = np.hypot(gx, gy)
+    gaz = np.mod(np.arctan2(gx, gy), 2 * pi)
+    i_raio = np.rint(gaz / (2 * pi) * n_raios).astype(np.int64) % n_raios
+    i_passo = np.clip(np.rint(gd / resolucao_m).astype(np.int64) - 1, 0, n_passos - 1)
+
+    d = np.maximum(gd, 1.0)
+    h_t, h_r = max(float(tx_alt), 1.0), max(float(rx_alt), 1.0)
+    d_quebra = 4.0 * h_t * h_r / comprimento_onda
+    fspl = 20.0 * np.log10(d / 1000.0) + 20.0 * log10(float(tpl.frq)) + 32.44
+    perda_solo = np.where(d > d_quebra, 20.0 * np.log10(d / d_quebra), 0.0)
+
+    eirp = 10.0 * log10(float(tpl.transmitter.txw) * 1000.0) + float(tpl.antenna.txg)
+    nivel = (eirp + float(tpl.receiver.rxg) - fspl - perda_solo - perda_dif[i_raio, i_passo]).astype(np.float32)
+    nivel[gd > raio_m] = -np.inf
+
+    dlat, dlon = raio_m / _METERS_PER_DEG_LAT, raio_m / m_por_deg_lon
+    bounds = [round(lat + dlat, 6), round(lon + dlon, 6), round(lat - dlat, 6), round(lon - dlon, 6)]
+    return nivel, bounds
+
+
+def colorir_nivel(nivel_dbm: np.ndarray, sensibilidade_dbm: float, col: Optional[str] = None) -> np.ndarray:
+    """
+    RGBA: na paleta da CloudRF de `col` (mesmas cores, decodificáveis para dBm),
+    senão pela margem sobre a sensibilidade; alpha 0 abaixo da sensibilidade.
+    """
+    margem = nivel_dbm - float(sensibilidade_dbm)
+    paleta = signal_palette.paleta(col)
+    if paleta is not None:
+        rgba = paleta.colorir(nivel_dbm)
+        rgba[margem < 0] = 0
+        return rgba
+    rgba = np.zeros(nivel_dbm.shape + (4,), dtype=np.uint8)
+    for limiar, cor in _RAMPA_MARGEM:
+        rgba[margem >= limiar, :3] = cor
+    rgba[..., 3] = np.where(margem >= 0, 255, 0)
+    return rgba
+
+
+def gerar_imagem_cobertura(
+    dem: np.ndarray, dem_transform: Any, dem_nodata: Optional[float], tpl: Any,
+    lat: float, lon: float, tx_alt: float, rx_alt: float, output_path: Path,
+) -> list:
+    """Calcula a cobertura e grava o PNG RGBA em `output_path`. Retorna os bounds."""
+    nivel, bounds = calcular_nivel_sinal(dem, dem_transform, dem_nodata, tpl, lat, lon, tx_alt, rx_alt)
+    Image.fromarray(colorir_nivel(nivel, tpl.receiver.rxs, tpl.col), mode="RGBA").save(output_path, format="PNG")
+    return bounds
+
+
+async def simular_cobertura_local(
+    tpl: Any, lat: float, lon: float, tx_alt: float, rx_alt: float, output_path: Path
+) -> list:
+    """
+    Simulação local completa: obtém o MDT da área (cache de DEM) e grava o PNG.
+    Retorna os bounds [N, E, S, W]. Erros de MDT sobem como DEMProcessingError.
+    """
+    # Import tardio: analysis_service depende de cloudrf_service, que depende deste módulo.
+    from backend.services import analysis_service
+
+    margem_km = RAIO_PADRAO_M / 1000.0 + 0.3
+    dem, transform, _crs, nodata = await analysis_service.obter_dem_para_area_geografica(lat, lon, margem_km)
+    return await run_in_threadpool(
+        gerar_imagem_cobertura, dem, transform, nodata, tpl, lat, lon, tx_alt, rx_alt, output_path
+    )
@@ -0,0 +1,195 @@
+# backend/services/rate_limiter.py
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from backend.config import settings
+
+logger = logging.getLogger("irricontrol")
+
+
+# ----------------- Perfis por host -----------------
+# rate/burst: token bucket (requisições por segundo / rajada).
+# concurrency: limite inicial do AIMD; cresce +1 a cada "janela" sem throttle
+# até max_concurrency e cai pela metade a cada 429/503.
+# O OpenTopoData público aceita ~1 req/s; a CloudRF tolera mais, mas cada
+# chamada é cara; o S3 do SRTM é praticamente ilimitado.
+
+_HOST_PROFILES: Dict[str, Dict[str, float]] = {
+    "api.cloudrf.com": {"rate": 2.0, "burst": 4, "concurrency": 4, "max_concurrency": 12},
+    "api.opentopodata.org": {"rate": 1.0, "burst": 1, "concurrency": 1, "max_concurrency": 2},
+    "elevation-tiles-prod.s3.amazonaws.com": {"rate": 20.0, "burst": 20, "concurrency": 4, "max_concurrency": 8},
+}
+_DEFAULT_PROFILE: Dict[str, float] = {"rate": 10.0, "burst": 10, "concurrency": 8, "max_concurrency": 32}
+
+THROTTLE_STATUSES = {429, 503}
+
+
+class RateLimitTimeout(httpx.TimeoutException):
+    """Tempo máximo na fila do limitador esgotado (upstream saturado)."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After em segundos (aceita número ou data HTTP). None se ausente/inválido."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Limitador de um upstream: token bucket (vazão) + AIMD (concorrência) +
+    bloqueio global enquanto durar um Retry-After recebido.
+    """
+
+    def __init__(self, host: str, rate: float, burst: float, concurrency: float, max_concurrency: float):
+        self.host = host
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.limit = float(concurrency)
+        self.max_limit = float(max_concurrency)
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.total_wait_s = 0.0
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _acquire(self, max_wait: float) -> None:
+        cond = self._condition()
+        t0 = time.monotonic()
+        deadline = t0 + max_wait
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            async with cond:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self._blocked_until:
+                        wait: Optional[float] = self._blocked_until - now
+                    elif self.in_flight >= max(1, int(self.limit)):
+                        wait = None  # aguarda alguém liberar (notify)
+                    elif self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        self.in_flight += 1
+                        break
+                    else:
+                        wait = (1.0 - self._tokens) / self.rate
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise RateLimitTimeout(f"Fila do limitador de '{self.host}' excedeu {max_wait:.0f}s.")
+                    try:
+                        await asyncio.wait_for(cond.wait(), timeout=min(wait, remaining) if wait else remaining)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.queue_depth -= 1
+            self.total_wait_s += time.monotonic() - t0
+        self.requests += 1
+
+    async def _release(self, status_code: Optional[int], retry_after: Optional[float]) -> None:
+        cond = self._condition()
+        async with cond:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if status_code in THROTTLE_STATUSES:
+                self.throttled += 1
+                self.decreases += 1
+                self.limit = max(1.0, self.limit / 2)
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                    logger.warning("Upstream '%s' pediu pausa de %.1fs (HTTP %s). Limite -> %d.",
+                                   self.host, retry_after, status_code, int(self.limit))
+            elif status_code is not None and status_code < 500:
+                # Aumento aditivo: ~+1 a cada `limit` respostas bem-sucedidas.
+                self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator["_Slot"]:
+        """Reserva uma vaga; o chamador informa o resultado via `slot.record(resp)`."""
+        await self._acquire(settings.RATE_LIMIT_MAX_WAIT)
+        slot = _Slot()
+        try:
+            yield slot
+        finally:
+            await self._release(slot.status_code, slot.retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "decreases": self.decreases,
+            "avg_wait_ms": round(1000 * self.total_wait_s / self.requests, 1) if self.requests else 0.0,
+            "blocked_for_s": round(max(self._blocked_until - time.monotonic(), 0.0), 1),
+        }
+
+
+class _Slot:
+    __slots__ = ("status_code", "retry_after")
+
+    def __init__(self) -> None:
+        self.status_code: Optional[int] = None
+        self.retry_after: Optional[float] = None
+
+    def record(self, response: httpx.Response) -> None:
+        self.status_code = response.status_code
+        if response.status_code in THROTTLE_STATUSES:
+            self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+
+class RateLimiterRegistry:
+    """Um AdaptiveRateLimiter por host upstream (criado sob demanda)."""
+
+    def __init__(self) -> None:
+        self._limiters: Dict[str, AdaptiveRateLimiter] = {}
+
+    def for_url(self, url: str) -> AdaptiveRateLimiter:
+        host = (urlsplit(str(url)).hostname or "").lower()
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            profile = _HOST_PROFILES.get(host, _DEFAULT_PROFILE)
+            limiter = AdaptiveRateLimiter(host, **profile)
+            self._limiters[host] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: lim.stats() for host, lim in self._limiters.items()}
+
+
+rate_limiters = RateLimiterRegistry()
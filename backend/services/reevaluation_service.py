@@ -0,0 +1,242 @@
+# backend/services/reevaluation_service.py
+"""
+Reavaliação incremental de cobertura por job.
+
+O servidor guarda, por job, os overlays ativos, as fontes de sinal e o último
+resultado de cada pivô/bomba. Uma requisição delta (overlays incluídos/removidos,
+entidades novas/movidas/removidas) recalcula só as entidades afetadas:
+    - entidades enviadas (novas ou movidas);
+    - entidades cuja extensão cruza o retângulo de um overlay incluído/removido;
+    - todas, se mudarem as fontes de sinal ou o modo de cobertura.
+A resposta traz só o que mudou. `versao` protege contra estado perdido
+(reinício do processo, LRU): se a versão do cliente não bater, ele reenvia tudo.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from math import cos, radians
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.config import settings
+from backend.exceptions import ReevaluationStateError
+from backend.services import analysis_service
+from backend.services.coverage_mask import normalize_bounds
+
+logger = logging.getLogger("irricontrol")
+
+_M_POR_GRAU_LAT = 111320.0
+
+# Campos do resultado comparados para decidir se a entidade "mudou".
+_CAMPOS_RESULTADO = ("fora", "sinal_dbm", "margem_db", "fracao_coberta")
+
+
+class JobReevalState:
+    """Estado de reavaliação de um job (protegido por `lock`, um delta por vez)."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.lock = asyncio.Lock()
+        self.versao = 0
+        self.last_used = time.time()
+        self.limpar()
+
+    def limpar(self) -> None:
+        """Esquece overlays, entidades e fontes (a versão continua crescendo)."""
+        self.overlays: Dict[str, Dict[str, Any]] = {}   # id -> overlay_info
+        self.pivos: Dict[str, Dict[str, Any]] = {}      # nome -> último resultado
+        self.bombas: Dict[str, Dict[str, Any]] = {}
+        self.signal_sources: List[Dict[str, float]] = []
+        self.modo_cobertura = "centro"
+
+
+class ReevalStateRegistry:
+    """Estados por job, em memória do processo, com limite de jobs (LRU)."""
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max_jobs
+        self._states: "OrderedDict[str, JobReevalState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> JobReevalState:
+        with self._lock:
+            state = self._states.get(job_id)
+            if state is None:
+                state = JobReevalState(job_id)
+                self._states[job_id] = state
+                while len(self._states) > self.max_jobs:
+                    old_id, _ = self._states.popitem(last=False)
+                    logger.info("Estado de reavaliação do job %s descartado (LRU).", old_id)
+            else:
+                self._states.move_to_end(job_id)
+            state.last_used = time.time()
+            return state
+
+    def drop(self, job_id: str) -> None:
+        with self._lock:
+            self._states.pop(job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"jobs": len(self._states), "max_jobs": self.max_jobs}
+
+
+reeval_states = ReevalStateRegistry(max_jobs=settings.SIM_JOB_GRID_MAX_JOBS)
+
+
+# ----------------- Entidades afetadas -----------------
+
+def _extensao(entidade: Dict[str, Any], modo_cobertura: str) -> Tuple[float, float, float, float]:
+    """Retângulo (S, W, N, E) que a avaliação da entidade pode consultar."""
+    lat, lon = float(entidade["lat"]), float(entidade["lon"])
+    if modo_cobertura == "area" and entidade.get("coordenadas"):
+        coords = np.asarray(entidade["coordenadas"], dtype=np.float64)
+        return (min(lat, coords[:, 0].min()), min(lon, coords[:, 1].min()),
+                max(lat, coords[:, 0].max()), max(lon, coords[:, 1].max()))
+    raio = float(entidade.get("raio") or 0.0) if modo_cobertura == "area" else 0.0
+    dlat = raio / _M_POR_GRAU_LAT
+    dlon = raio / (_M_POR_GRAU_LAT * max(cos(radians(lat)), 1e-6))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def _afetadas(
+    entidades: Dict[str, Dict[str, Any]], caixas: List[Tuple[float, float, float, float]], modo_cobertura: str
+) -> List[str]:
+    """Nomes das entidades cuja extensão cruza algum dos retângulos (S, W, N, E)."""
+    if not entidades or not caixas:
+        return []
+    nomes = list(entidades)
+    ext = np.array([_extensao(entidades[n], modo_cobertura) for n in nomes], dtype=np.float64)
+    cx = np.array(caixas, dtype=np.float64)
+    # Folga de 1% (mesma do índice de overlays em analysis_service).
+    fs, fw = (cx[:, 2] - cx[:, 0]) * 0.01, (cx[:, 3] - cx[:, 1]) * 0.01
+    cruza = (
+        (ext[:, None, 0] <= cx[None, :, 2] + fs) & (ext[:, None, 2] >= cx[None, :, 0] - fs)
+        & (ext[:, None, 1] <= cx[None, :, 3] + fw) & (ext[:, None, 3] >= cx[None, :, 1] - fw)
+    ).any(axis=1)
+    return [n for n, c in zip(nomes, cruza.tolist()) if c]
+
+
+def _caixa(overlay: Dict[str, Any]) -> Optional[Tuple[float, float, float, float]]:
+    bounds = list(overlay["bounds"])
+    return normalize_bounds(bounds) if len(bounds) == 4 else None
+
+
+def _mudou(anterior: Optional[Dict[str, Any]], novo: Dict[str, Any]) -> bool:
+    if anterior is None:
+        return True
+    return any(anterior.get(c) != novo.get(c) for c in _CAMPOS_RESULTADO)
+
+
+# ----------------- Delta -----------------
+
+async def aplicar_delta(
+    job_id: str,
+    versao_base: int,
+    overlays_incluidos: List[Dict[str, Any]],
+    overlays_removidos: List[str],
+    pivos: List[Dict[str, Any]],
+    pivos_removidos: List[str],
+    bombas: List[Dict[str, Any]],
+    bombas_removidas: List[str],
+    signal_sources: Optional[List[Dict[str, float]]] = None,
+    modo_cobertura: Optional[str] = None,
+    reiniciar: bool = False,
+) -> Dict[str, Any]:
+    """
+    Aplica o delta ao estado do job e reavalia só as entidades afetadas.
+    Overlays incluídos com `id` já existente substituem o anterior. Pivôs e
+    bombas são identificados por `nome` (enviar de novo = mover/atualizar).
+    Levanta ReevaluationStateError se `versao_base` não for a versão atual.
+    """
+    state = reeval_states.get(job_id)
+    async with state.lock:
+        if not reiniciar and versao_base != state.versao:
+            raise ReevaluationStateError(
+                f"Estado do job '{job_id}' está na versão {state.versao}, cliente enviou {versao_base}."
+            )
+
+        # O delta é montado sobre cópias e só vai para `state` (com a nova versão)
+        # depois da reavaliação: se ela falhar, o estado continua o da versão atual.
+        base = JobReevalState(job_id) if reiniciar else state
+        estado_overlays = dict(base.overlays)
+        estado_pivos, estado_bombas = dict(base.pivos), dict(base.bombas)
+        fontes, modo = base.signal_sources, base.modo_cobertura
+
+        caixas: List[Tuple[float, float, float, float]] = []
+        for oid in overlays_removidos:
+            removido = estado_overlays.pop(oid, None)
+            if removido is not None and _caixa(removido):
+                caixas.append(_caixa(removido))
+        for ov in overlays_incluidos:
+            anterior = estado_overlays.get(ov["id"])
+            if anterior is not None and _caixa(anterior):
+                caixas.append(_caixa(anterior))
+            estado_overlays[ov["id"]] = ov
+            if _caixa(ov):
+                caixas.append(_caixa(ov))
+
+        tudo = False
+        if signal_sources is not None and signal_sources != fontes:
+            fontes, tudo = list(signal_sources), True
+        if modo_cobertura is not None and modo_cobertura != modo:
+            modo, tudo = modo_cobertura, True
+
+        removidos_p = [n for n in pivos_removidos if estado_pivos.pop(n, None) is not None]
+        removidas_b = [n for n in bombas_removidas if estado_bombas.pop(n, None) is not None]
+
+        # Entidades a recalcular: enviadas + afetadas pelos overlays (ou todas)
+        anteriores_p = {p["nome"]: estado_pivos.get(p["nome"]) for p in pivos}
+        anteriores_b = {b["nome"]: estado_bombas.get(b["nome"]) for b in bombas}
+        recalc_p: Dict[str, Dict[str, Any]] = {p["nome"]: p for p in pivos}
+        recalc_b: Dict[str, Dict[str, Any]] = {b["nome"]: b for b in bombas}
+        if tudo:
+            alvos_p, alvos_b = list(estado_pivos), list(estado_bombas)
+        else:
+            alvos_p = _afetadas(estado_pivos, caixas, modo)
+            alvos_b = _afetadas(estado_bombas, caixas, "centro")
+        for nome in alvos_p:
+            if nome not in recalc_p:
+                anteriores_p[nome] = estado_pivos[nome]
+                recalc_p[nome] = estado_pivos[nome]
+        for nome in alvos_b:
+            if nome not in recalc_b:
+                anteriores_b[nome] = estado_bombas[nome]
+                recalc_b[nome] = estado_bombas[nome]
+
+        overlays = list(estado_overlays.values())
+        novos_p, novos_b = await analysis_service.reavaliar_entidades(
+            list(recalc_p.values()), list(recalc_b.values()), overlays, fontes,
+            modo_cobertura=modo, job_id=job_id,
+        )
+
+        enviados_p, enviados_b = {p["nome"] for p in pivos}, {b["nome"] for b in bombas}
+        mudados_p, mudados_b = [], []
+        for novo in novos_p:
+            estado_pivos[novo["nome"]] = novo
+            if novo["nome"] in enviados_p or _mudou(anteriores_p.get(novo["nome"]), novo):
+                mudados_p.append(novo)
+        for novo in novos_b:
+            estado_bombas[novo["nome"]] = novo
+            if novo["nome"] in enviados_b or _mudou(anteriores_b.get(novo["nome"]), novo):
+                mudados_b.append(novo)
+
+        state.overlays, state.pivos, state.bombas = estado_overlays, estado_pivos, estado_bombas
+        state.signal_sources, state.modo_cobertura = fontes, modo
+        state.versao += 1
+        logger.info(
+            "🔄 Delta do job %s (v%d): %d/%d pivôs e %d/%d bombas recalculados, %d overlays ativos.",
+            job_id, state.versao, len(recalc_p), len(state.pivos), len(recalc_b), len(state.bombas), len(overlays),
+        )
+        return {
+            "versao": state.versao,
+            "pivos": mudados_p,
+            "bombas": mudados_b,
+            "pivos_removidos": removidos_p,
+            "bombas_removidas": removidas_b,
+            "recalculados": {"pivos": len(recalc_p), "bombas": len(recalc_b)},
+        }
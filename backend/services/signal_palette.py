@@ -0,0 +1,128 @@
+# backend/services/signal_palette.py
+"""
+Paletas de cor da CloudRF (`tpl.col`) e decodificação cor -> nível de sinal.
+
+Cada paleta é uma lista de faixas (limiar em dBm, cor RGB), lidas das legendas
+em static/imagens/<col>.key.png: um pixel na cor da faixa tem nível >= limiar.
+A decodificação usa uma tabela RGB -> faixa pré-calculada (6 bits por canal,
+cor mais próxima) aplicada à imagem inteira por indexação NumPy.
+"""
+
+import logging
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("irricontrol")
+
+_RGB = Tuple[int, int, int]
+
+# Faixas do mais forte para o mais fraco (mesma ordem das legendas).
+PALETAS: Dict[str, Sequence[Tuple[float, _RGB]]] = {
+    "IRRICONTRO.dBm": (
+        (-70.0, (0, 255, 51)),
+        (-80.0, (10, 215, 86)),
+        (-90.0, (25, 215, 126)),
+        (-100.0, (27, 177, 107)),
+    ),
+    "IRRIEUROPE.dBm": (
+        (-65.0, (0, 255, 51)),
+        (-75.0, (10, 215, 86)),
+        (-85.0, (25, 215, 126)),
+        (-95.0, (27, 177, 107)),
+        (-105.0, (26, 147, 91)),
+    ),
+    "CONTROL90.dBm": (
+        (-70.0, (0, 255, 51)),
+        (-80.0, (10, 215, 86)),
+        (-90.0, (25, 215, 126)),
+    ),
+}
+
+_BITS_LUT = 6                  # 64³ células (256 KiB por paleta)
+_DIST_MAX_COR = 24.0           # cor mais distante que isso de todas as faixas -> desconhecida
+SEM_SINAL = -1                 # índice de faixa para transparente/desconhecido
+
+
+class SignalPalette:
+    """Paleta de uma `col` da CloudRF com tabela RGB -> índice de faixa."""
+
+    def __init__(self, nome: str, faixas: Sequence[Tuple[float, _RGB]]):
+        self.nome = nome
+        self.niveis = np.array([nivel for nivel, _ in faixas], dtype=np.float32)
+        self.cores = np.array([cor for _, cor in faixas], dtype=np.uint8)
+        self.lut = self._montar_lut()
+
+    def _montar_lut(self) -> np.ndarray:
+        passo = 1 << (8 - _BITS_LUT)
+        centros = np.arange(1 << _BITS_LUT, dtype=np.float32) * passo + (passo - 1) / 2.0
+        r, g, b = np.meshgrid(centros, centros, centros, indexing="ij")
+        celulas = np.stack([r, g, b], axis=-1)[..., None, :]              # (64, 64, 64, 1, 3)
+        dist = np.linalg.norm(celulas - self.cores.astype(np.float32), axis=-1)  # (64, 64, 64, faixas)
+        lut = np.argmin(dist, axis=-1).astype(np.int8)
+        lut[dist.min(axis=-1) > _DIST_MAX_COR] = SEM_SINAL
+        return lut
+
+    @property
+    def nivel_minimo(self) -> float:
+        return float(self.niveis.min())
+
+    def indices(self, rgba: np.ndarray, alpha_threshold: int) -> np.ndarray:
+        """Índice da faixa por pixel (int8); SEM_SINAL onde alpha <= limiar ou cor fora da paleta."""
+        shift = 8 - _BITS_LUT
+        rgb = np.asarray(rgba[..., :3]) >> shift
+        idx = self.lut[rgb[..., 0], rgb[..., 1], rgb[..., 2]]
+        idx[np.asarray(rgba[..., 3]) <= alpha_threshold] = SEM_SINAL
+        return idx
+
+    def colorir(self, nivel_dbm: np.ndarray) -> np.ndarray:
+        """RGBA na paleta: cor da faixa mais forte cujo limiar o nível atinge; abaixo da última, transparente."""
+        rgba = np.zeros(nivel_dbm.shape + (4,), dtype=np.uint8)
+        for limiar, cor in zip(self.niveis[::-1].tolist(), self.cores[::-1]):
+            acima = nivel_dbm >= limiar
+            rgba[acima, :3] = cor
+            rgba[acima, 3] = 255
+        return rgba
+
+
+class SignalGrid:
+    """Faixas de sinal decodificadas de uma imagem de cobertura (1 byte/pixel)."""
+
+    __slots__ = ("indices", "paleta", "width", "height")
+
+    def __init__(self, indices: np.ndarray, paleta: SignalPalette):
+        self.indices = indices
+        self.paleta = paleta
+        self.height, self.width = indices.shape
+
+    def indice_many(self, px: np.ndarray, py: np.ndarray) -> np.ndarray:
+        """Índice da faixa nos pixels (int8); SEM_SINAL fora da imagem ou sem sinal."""
+        px, py = np.broadcast_arrays(np.asarray(px, dtype=np.int64), np.asarray(py, dtype=np.int64))
+        dentro = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        out = np.full(px.shape, SEM_SINAL, dtype=np.int8)
+        out[dentro] = self.indices[py[dentro], px[dentro]]
+        return out
+
+    def nivel_many(self, px: np.ndarray, py: np.ndarray) -> np.ndarray:
+        """Nível (dBm, limiar da faixa) nos pixels; NaN fora da imagem ou sem sinal."""
+        return niveis_das_faixas(self.indice_many(px, py), self.paleta.niveis)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.indices.nbytes)
+
+
+def niveis_das_faixas(indices: np.ndarray, niveis: np.ndarray) -> np.ndarray:
+    """Índices de faixa -> nível dBm (float32), NaN onde SEM_SINAL."""
+    return np.where(indices >= 0, niveis[np.maximum(indices, 0)], np.nan).astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def paleta(col: Optional[str]) -> Optional[SignalPalette]:
+    """Paleta da `col` do template (None se não for conhecida)."""
+    faixas = PALETAS.get(col or "")
+    if faixas is None:
+        logger.debug("Paleta '%s' sem tabela de níveis; só cobertura binária.", col)
+        return None
+    return SignalPalette(col, faixas)
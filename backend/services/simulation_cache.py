@@ -0,0 +1,440 @@
+# backend/services/simulation_cache.py
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from backend.config import settings
+
+logger = logging.getLogger("irricontrol")
+
+
+# ----------------- Esquema -----------------
+# Cada item da lista é uma migração; PRAGMA user_version guarda quantas já
+# foram aplicadas. Novas colunas/índices entram como um novo item no final.
+
+_MIGRATIONS: List[str] = [
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key             TEXT PRIMARY KEY,
+        digest          TEXT NOT NULL,
+        imagem_filename TEXT NOT NULL,
+        bounds          TEXT NOT NULL,
+        size_bytes      INTEGER NOT NULL,
+        created_at      REAL NOT NULL,
+        last_access     REAL NOT NULL,
+        hits            INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access);
+    CREATE INDEX IF NOT EXISTS idx_entries_digest ON entries(digest);
+    """,
+    # 2: parâmetros da simulação + célula de grade para reuso por proximidade
+    """
+    ALTER TABLE entries ADD COLUMN template TEXT;
+    ALTER TABLE entries ADD COLUMN tx_alt REAL;
+    ALTER TABLE entries ADD COLUMN rx_alt REAL;
+    ALTER TABLE entries ADD COLUMN lat REAL;
+    ALTER TABLE entries ADD COLUMN lon REAL;
+    ALTER TABLE entries ADD COLUMN cell_lat INTEGER;
+    ALTER TABLE entries ADD COLUMN cell_lon INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_entries_spatial
+        ON entries(template, tx_alt, rx_alt, cell_lat, cell_lon);
+    """,
+    # 3: motor de propagação (CloudRF ou local); entradas antigas são da CloudRF
+    """
+    ALTER TABLE entries ADD COLUMN engine TEXT NOT NULL DEFAULT 'cloudrf';
+    DROP INDEX IF EXISTS idx_entries_spatial;
+    CREATE INDEX IF NOT EXISTS idx_entries_spatial
+        ON entries(engine, template, tx_alt, rx_alt, cell_lat, cell_lon);
+    """,
+]
+
+# Grade fixa de 0.001° (~111 m) para o índice espacial; a busca varre as células
+# que intersectam o raio de tolerância e filtra pela distância real.
+GRID_DEG = 0.001
+_METERS_PER_DEG_LAT = 111320.0
+
+# Nome canônico gerado por cloudrf_service (usado para preencher entradas migradas)
+_FILENAME_RE = re.compile(
+    r"^(?:principal|repetidora)_(?P<tpl>.+)_tx(?P<tx>[\d.]+)m_rx(?P<rx>[\d.]+)m"
+    r"_lat(?P<lat>m?\d+_\d+)_lon(?P<lon>m?\d+_\d+)\.png$"
+)
+
+def _cell(value: float) -> int:
+    return int(math.floor(value / GRID_DEG))
+
+
+def _distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distância equiretangular (precisa o bastante para raios de dezenas de metros)."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371000.0 * math.hypot(x, y)
+
+
+def _parse_coord(text: str) -> float:
+    return float(text.replace("m", "-").replace("_", "."))
+
+
+_HASH_CHUNK = 1024 * 1024
+_LEGACY_KEY_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 do conteúdo de um arquivo (leitura em blocos)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SimulationCacheStore:
+    """
+    Cache de simulações indexado em SQLite e endereçado por conteúdo.
+
+    - Índice (`index.sqlite3`): chave da simulação -> digest da imagem, bounds,
+      nome canônico, tamanho e horários de criação/último acesso.
+    - Blobs: `objects/<dd>/<digest>.png`, imutáveis; caminhos nunca são
+      gravados no índice, então a pasta pode ser movida livremente. O tamanho
+      indexado inclui os derivados do blob (máscara `<digest>.mask.*`).
+    - Escritas atômicas (arquivo temporário + os.replace).
+    - Orçamento de disco (SIM_CACHE_MAX_BYTES) com despejo LRU e idade máxima
+      (SIM_CACHE_MAX_AGE_DAYS).
+
+    Métodos são síncronos (SQLite/disco); chame-os via threadpool.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, max_age_days: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._db_path = root / "index.sqlite3"
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "hits": 0, "approx_hits": 0, "misses": 0, "bytes_written": 0, "bytes_served": 0,
+            "evictions": 0, "bytes_evicted": 0,
+        }
+
+    # --------- Infra ---------
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        self._ensure_schema()
+        conn = sqlite3.connect(self._db_path, timeout=30.0, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    def _ensure_schema(self) -> None:
+        if self._schema_ready:
+            return
+        with self._lock:
+            if self._schema_ready:
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._db_path, timeout=30.0, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for i, sql in enumerate(_MIGRATIONS[version:], start=version + 1):
+                    conn.executescript(f"BEGIN; {sql}; PRAGMA user_version = {i}; COMMIT;")
+            finally:
+                conn.close()
+            self._schema_ready = True
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.png"
+
+    def _delete_blob(self, digest: str) -> None:
+        """Remove o blob e seus derivados (ex.: máscara de cobertura `<digest>.mask.*`)."""
+        blob = self.blob_path(digest)
+        for path in blob.parent.glob(f"{digest}.*"):
+            path.unlink(missing_ok=True)
+
+    def _blob_bytes(self, digest: str) -> int:
+        """Tamanho em disco do blob e seus derivados."""
+        blob = self.blob_path(digest)
+        total = 0
+        for path in blob.parent.glob(f"{digest}.*"):
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _row_to_result(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "imagem_local_path": str(self.blob_path(row["digest"])),
+            "imagem_filename": row["imagem_filename"],
+            "bounds": json.loads(row["bounds"]),
+            "digest": row["digest"],
+        }
+
+    # --------- API ---------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Busca a entrada; atualiza o último acesso (LRU). None se ausente/corrompida."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            if not self.blob_path(row["digest"]).is_file():
+                logger.warning("CACHE corrompido (blob ausente) para %s. Removendo entrada.", key[:12])
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count("misses")
+                return None
+            conn.execute(
+                "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                (time.time(), key),
+            )
+        self._count("hits")
+        self._count("bytes_served", int(row["size_bytes"]))
+        return self._row_to_result(row)
+
+    def find_nearby(
+        self,
+        template: str,
+        tx_alt: float,
+        rx_alt: float,
+        lat: float,
+        lon: float,
+        radius_m: float,
+        engine: str = "cloudrf",
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Simulação mais próxima de (lat, lon) dentro de `radius_m`, com mesmo motor,
+        template e alturas TX/RX. O resultado leva `aproximado=True` e a distância de reuso.
+        """
+        if radius_m <= 0:
+            return None
+        dlat = radius_m / _METERS_PER_DEG_LAT
+        dlon = radius_m / (_METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM entries WHERE engine = ? AND template = ? AND tx_alt = ? AND rx_alt = ? "
+                "AND cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?",
+                (
+                    engine, template, float(tx_alt), float(rx_alt),
+                    _cell(lat - dlat), _cell(lat + dlat), _cell(lon - dlon), _cell(lon + dlon),
+                ),
+            ).fetchall()
+            candidates = sorted(
+                (d, row) for row in rows
+                if (d := _distance_m(lat, lon, row["lat"], row["lon"])) <= radius_m
+            )
+            for distance, row in candidates:
+                if not self.blob_path(row["digest"]).is_file():
+                    continue
+                conn.execute(
+                    "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                    (time.time(), row["key"]),
+                )
+                self._count("approx_hits")
+                self._count("bytes_served", int(row["size_bytes"]))
+                return {**self._row_to_result(row), "aproximado": True, "distancia_reuso_m": round(distance, 2)}
+        return None
+
+    def put(
+        self,
+        key: str,
+        source_path: Path,
+        imagem_filename: str,
+        bounds: list,
+        digest: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Move `source_path` para o armazenamento por conteúdo e indexa a entrada.
+        O arquivo de origem é consumido (movido ou apagado se o blob já existir).
+        `params` (template, tx_alt, rx_alt, lat, lon, engine) habilita o reuso por proximidade.
+        """
+        digest = digest or file_digest(source_path)
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.exists():
+            source_path.unlink(missing_ok=True)
+        else:
+            os.replace(source_path, blob)
+        size = self._blob_bytes(digest)
+
+        now = time.time()
+        p = params or {}
+        lat, lon = p.get("lat"), p.get("lon")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, digest, imagem_filename, bounds, size_bytes, created_at, last_access, hits, "
+                " template, tx_alt, rx_alt, lat, lon, cell_lat, cell_lon, engine) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, digest, imagem_filename, json.dumps(bounds), size, now, now,
+                    p.get("template"), p.get("tx_alt"), p.get("rx_alt"), lat, lon,
+                    _cell(lat) if lat is not None else None,
+                    _cell(lon) if lon is not None else None,
+                    p.get("engine") or "cloudrf",
+                ),
+            )
+        self._count("bytes_written", size)
+        self.evict()
+        return {
+            "imagem_local_path": str(blob),
+            "imagem_filename": imagem_filename,
+            "bounds": bounds,
+            "digest": digest,
+        }
+
+    def refresh_size(self, digest: str) -> None:
+        """
+        Atualiza o tamanho indexado do digest depois de gerar derivados ao lado do
+        blob (ex.: máscara de cobertura) e, se mudou, reaplica o orçamento de disco.
+        """
+        size = self._blob_bytes(digest)
+        if size == 0:
+            return  # blob já despejado
+        with self._connect() as conn:
+            changed = conn.execute(
+                "UPDATE entries SET size_bytes = ? WHERE digest = ? AND size_bytes != ?", (size, digest, size)
+            ).rowcount
+        if changed:
+            self.evict()
+
+    def temp_path(self, suffix: str = ".part") -> Path:
+        """Caminho temporário no mesmo volume do cache (permite os.replace atômico)."""
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        return tmp_dir / f"{uuid.uuid4().hex}{suffix}"
+
+    def evict(self) -> None:
+        """Aplica idade máxima e orçamento de disco (LRU, até 90% do orçamento)."""
+        with self._connect() as conn:
+            removed: List[sqlite3.Row] = []
+            if self.max_age_days > 0:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += conn.execute(
+                    "SELECT key, digest, size_bytes FROM entries WHERE created_at < ?", (cutoff,)
+                ).fetchall()
+                conn.execute("DELETE FROM entries WHERE created_at < ?", (cutoff,))
+
+            if self.max_bytes > 0:
+                total = self._total_bytes(conn)
+                if total > self.max_bytes:
+                    target = int(self.max_bytes * 0.9)
+                    for row in conn.execute(
+                        "SELECT key, digest, size_bytes FROM entries ORDER BY last_access ASC"
+                    ).fetchall():
+                        if total <= target:
+                            break
+                        conn.execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+                        removed.append(row)
+                        shared = conn.execute(
+                            "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (row["digest"],)
+                        ).fetchone()
+                        if shared is None:
+                            total -= int(row["size_bytes"])
+
+            for row in removed:
+                still_used = conn.execute(
+                    "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (row["digest"],)
+                ).fetchone()
+                if still_used is None:
+                    self._delete_blob(row["digest"])
+                    self._count("bytes_evicted", int(row["size_bytes"]))
+                self._count("evictions")
+
+        if removed:
+            logger.info("CACHE: %d entradas despejadas (LRU/idade).", len(removed))
+
+    @staticmethod
+    def _total_bytes(conn: sqlite3.Connection) -> int:
+        # Blobs compartilhados (mesmo digest) contam uma única vez.
+        row = conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM (SELECT DISTINCT digest, size_bytes FROM entries)"
+        ).fetchone()
+        return int(row[0])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self._total_bytes(conn)
+        with self._lock:
+            counters = dict(self._counters)
+        return {**counters, "entries": entries, "total_bytes": total, "max_bytes": self.max_bytes}
+
+    # --------- Migração do formato antigo ---------
+
+    def migrate_legacy(self) -> int:
+        """
+        Importa entradas do formato antigo (`<hash>.json` + PNG + bounds ao lado,
+        com caminho absoluto embutido). O PNG é localizado pelo nome, não pelo
+        caminho gravado, então caches copiados de outra máquina também migram.
+        """
+        migrated = 0
+        for legacy_json in self.root.glob("*.json"):
+            key = legacy_json.stem
+            if not _LEGACY_KEY_RE.fullmatch(key):
+                continue  # sidecars de bounds (<nome>.json) são tratados junto com a entrada
+            try:
+                with open(legacy_json, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                imagem_filename = Path(str(data["imagem_filename"])).name
+                bounds = data["bounds"]
+                legacy_img = self.root / imagem_filename
+                if legacy_img.is_file():
+                    with self._connect() as conn:
+                        exists = conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+                    if exists is None:
+                        self.put(key, legacy_img, imagem_filename, bounds)
+                        migrated += 1
+                    else:
+                        legacy_img.unlink(missing_ok=True)
+                    legacy_img.with_suffix(".json").unlink(missing_ok=True)
+                legacy_json.unlink(missing_ok=True)
+            except Exception as e:
+                logger.warning("CACHE: falha ao migrar entrada antiga %s: %s", legacy_json.name, e)
+        if migrated:
+            logger.info("CACHE: %d entradas antigas migradas para o índice SQLite.", migrated)
+        self._backfill_params()
+        return migrated
+
+    def _backfill_params(self) -> None:
+        """Preenche parâmetros (e célula) de entradas antigas a partir do nome canônico."""
+        templates = {t.lower().replace(" ", "_"): t for t in settings.listar_templates_ids()}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, imagem_filename FROM entries WHERE lat IS NULL").fetchall()
+            for row in rows:
+                m = _FILENAME_RE.match(row["imagem_filename"])
+                template = templates.get(m.group("tpl")) if m else None
+                if template is None:
+                    continue
+                lat, lon = _parse_coord(m.group("lat")), _parse_coord(m.group("lon"))
+                conn.execute(
+                    "UPDATE entries SET template = ?, tx_alt = ?, rx_alt = ?, lat = ?, lon = ?, "
+                    "cell_lat = ?, cell_lon = ? WHERE key = ?",
+                    (template, float(m.group("tx")), float(m.group("rx")), lat, lon,
+                     _cell(lat), _cell(lon), row["key"]),
+                )
+
+
+simulation_cache = SimulationCacheStore(
+    root=settings.SIMULATIONS_CACHE_PATH,
+    max_bytes=settings.SIM_CACHE_MAX_BYTES,
+    max_age_days=settings.SIM_CACHE_MAX_AGE_DAYS,
+)
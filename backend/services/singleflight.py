@@ -0,0 +1,98 @@
+# backend/services/singleflight.py
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+logger = logging.getLogger("irricontrol")
+
+try:
+    import fasteners  # lock de arquivo multiplataforma (Windows/Linux)
+except Exception:  # pragma: no cover - dependência opcional
+    fasteners = None
+
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas dentro do processo: enquanto a primeira
+    chamada de uma chave está em andamento, as demais aguardam o mesmo
+    resultado em vez de repetir o trabalho.
+
+    O trabalho roda numa Task própria; se o chamador "líder" for cancelado
+    (ex.: cliente desconectou), os demais continuam aguardando normalmente.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.coalesced += 1
+            logger.info("SINGLE-FLIGHT (%s): aguardando execução em andamento %s", self.name, key[:12])
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita "exception was never retrieved" quando todos os chamadores cancelaram.
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+@asynccontextmanager
+async def file_lock(
+    lock_path: Path,
+    timeout: float,
+    poll_interval: float = 0.25,
+) -> AsyncIterator[bool]:
+    """
+    Lock exclusivo entre processos (ex.: vários workers do uvicorn) baseado em
+    arquivo. Faz polling não-bloqueante para não ocupar threads do pool.
+
+    Retorna (via `as`) True se o lock foi obtido. Em timeout ou sem o pacote
+    'fasteners', segue sem lock (False): pior caso é trabalho duplicado.
+    """
+    if fasteners is None:
+        logger.warning('Lock entre processos indisponível (pacote "fasteners" ausente). Seguindo sem lock.')
+        yield False
+        return
+
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lock = fasteners.InterProcessLock(str(lock_path))
+    deadline = time.monotonic() + timeout
+    acquired = False
+    try:
+        while True:
+            try:
+                acquired = lock.acquire(blocking=False)
+            except Exception as e:
+                logger.warning("Falha ao tentar lock %s: %s. Seguindo sem lock.", lock_path.name, e)
+                break
+            if acquired or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(poll_interval)
+
+        if not acquired:
+            logger.warning("Timeout (%.0fs) aguardando lock %s. Seguindo sem lock.", timeout, lock_path.name)
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except Exception:
+                pass
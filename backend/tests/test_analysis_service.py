@@ -0,0 +1,78 @@
+# backend/tests/test_analysis_service.py
+import uuid
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.config import settings
+from backend.services import analysis_service
+from backend.services.job_coverage import job_coverage
+
+from backend.tests.test_job_coverage import LAT0, LON0, TEMPLATES, _overlay
+
+
+def _coberto_escalar(lat, lon, overlays):
+    """Teste original, ponto a ponto: pixel por int() sobre os bounds e alpha > SIM_ALPHA_THRESHOLD."""
+    for ov in overlays:
+        s, w, n, e = ov["bounds"]
+        if s > n: s, n = n, s
+        if w > e: w, e = e, w
+        with Image.open(ov["imagem_path"]) as img:
+            rgba = img.convert("RGBA")
+        largura, altura = rgba.size
+        px = int(((lon - w) / (e - w)) * largura)
+        py = int(((n - lat) / (n - s)) * altura)
+        if 0 <= px < largura and 0 <= py < altura and rgba.getpixel((px, py))[3] > settings.SIM_ALPHA_THRESHOLD:
+            return True
+    return False
+
+
+@pytest.fixture
+def cenario(tmp_path):
+    rng = np.random.default_rng(4321)
+    overlays = [_overlay(tmp_path, rng, TEMPLATES[k % len(TEMPLATES)], k) for k in range(5)]
+    # Um overlay com bounds invertidos (S > N, W > E): deve ser normalizado como antes
+    s, w, n, e = overlays[-1]["bounds"]
+    overlays[-1]["bounds"] = [n, e, s, w]
+    lats = LAT0 + rng.uniform(-0.05, 0.05, 400)
+    lons = LON0 + rng.uniform(-0.05, 0.05, 400)
+    job_id = f"teste-{uuid.uuid4().hex}"
+    yield overlays, lats, lons, job_id
+    job_coverage.drop(job_id)
+
+
+def test_cobertura_pontos_igual_ao_teste_escalar(cenario):
+    overlays, lats, lons, job_id = cenario
+    esperado = np.array([_coberto_escalar(la, lo, overlays) for la, lo in zip(lats, lons)])
+    assert 0 < esperado.sum() < esperado.size
+
+    np.testing.assert_array_equal(analysis_service._cobertura_pontos(lats, lons, overlays), esperado)
+    np.testing.assert_array_equal(
+        analysis_service._cobertura_pontos(lats, lons, overlays, job_id=job_id), esperado
+    )
+
+
+def test_check_coverage_sync_igual_ao_teste_escalar(cenario):
+    overlays, lats, lons, job_id = cenario
+    entidades = [{"nome": f"e{i}", "lat": float(la), "lon": float(lo)} for i, (la, lo) in enumerate(zip(lats, lons))]
+    # Fonte em cima da entidade 0 (zona de segurança) e outra longe de todas
+    fontes = [{"lat": entidades[0]["lat"], "lon": entidades[0]["lon"]}, {"lat": LAT0 + 1.0, "lon": LON0 + 1.0}]
+
+    esperado = []
+    for ent in entidades:
+        perto = any(
+            analysis_service.haversine(ent["lat"], ent["lon"], f["lat"], f["lon"]) < analysis_service.PROXIMITY_THRESHOLD_METERS
+            for f in fontes
+        )
+        esperado.append(not (perto or _coberto_escalar(ent["lat"], ent["lon"], overlays)))
+
+    for jid in (None, job_id):
+        resultado = analysis_service._check_coverage_sync(entidades, overlays, fontes, jid)
+        assert [r["fora"] for r in resultado] == esperado
+        assert resultado[0]["fora"] is False
+        assert [r["nome"] for r in resultado] == [e["nome"] for e in entidades]
+
+
+def test_check_coverage_sync_sem_entidades():
+    assert analysis_service._check_coverage_sync([], [], []) == []
@@ -0,0 +1,85 @@
+# backend/tests/test_job_coverage.py
+import uuid
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.services import analysis_service
+from backend.services.job_coverage import job_coverage
+
+TEMPLATES = ("Brazil_V6_100dBm", "Europe_V6_XR", "Brazil_V6_90dBm", None)
+LAT0, LON0 = -16.0, -56.0
+
+
+def _overlay(tmp_path, rng, template, k):
+    """PNG de cobertura sintético (anéis de nível na paleta do template), com tamanho e bounds próprios."""
+    from backend.config import settings
+    from backend.services import propagation_service
+
+    largura, altura = (int(v) for v in rng.integers(60, 220, size=2))
+    clat, clon = LAT0 + rng.uniform(-0.02, 0.02), LON0 + rng.uniform(-0.02, 0.02)
+    dlat, dlon = rng.uniform(0.01, 0.03), rng.uniform(0.01, 0.03)
+    yy, xx = np.mgrid[0:altura, 0:largura]
+    dist = np.hypot((xx + 0.5) / largura - 0.5, (yy + 0.5) / altura - 0.5)
+    nivel = (-60.0 - 90.0 * dist + rng.normal(0.0, 2.0, dist.shape)).astype(np.float32)
+    if template is None:
+        col, rxs = None, -95.0
+    else:
+        tpl = settings.obter_template(template)
+        col, rxs = tpl.col, tpl.receiver.rxs
+    rgba = propagation_service.colorir_nivel(nivel, rxs, col)
+    caminho = tmp_path / f"overlay_{k}.png"
+    Image.fromarray(rgba, mode="RGBA").save(caminho)
+    return {
+        "id": f"ov{k}",
+        "imagem_path": str(caminho),
+        "bounds": [clat - dlat, clon - dlon, clat + dlat, clon + dlon],
+        "template": template,
+    }
+
+
+@pytest.fixture
+def cenario(tmp_path):
+    rng = np.random.default_rng(1234)
+    overlays = [_overlay(tmp_path, rng, TEMPLATES[k % len(TEMPLATES)], k) for k in range(8)]
+    lats = LAT0 + rng.uniform(-0.05, 0.05, 5000)
+    lons = LON0 + rng.uniform(-0.05, 0.05, 5000)
+    job_id = f"teste-{uuid.uuid4().hex}"
+    yield overlays, lats, lons, job_id
+    job_coverage.drop(job_id)
+
+
+def test_grade_do_job_igual_ao_teste_por_overlay(cenario):
+    overlays, lats, lons, job_id = cenario
+    for ativos in (overlays, overlays[2:], overlays[::2] + overlays[1:2], overlays):
+        direto = analysis_service._cobertura_pontos(lats, lons, ativos)
+        pela_grade = analysis_service._cobertura_pontos(lats, lons, ativos, job_id=job_id)
+        np.testing.assert_array_equal(pela_grade, direto)
+
+        np.testing.assert_array_equal(
+            analysis_service._contagem_pontos(lats, lons, ativos, job_id),
+            analysis_service._contagem_pontos(lats, lons, ativos),
+        )
+
+        nivel_d, margem_d = analysis_service._sinal_pontos(lats, lons, ativos)
+        nivel_g, margem_g = analysis_service._sinal_pontos(lats, lons, ativos, job_id)
+        np.testing.assert_array_equal(nivel_g, nivel_d)
+        np.testing.assert_array_equal(margem_g, margem_d)
+
+
+def test_pontos_na_borda_oeste_norte_contam_como_pixel_zero(cenario):
+    overlays, _, _, job_id = cenario
+    ov = overlays[0]
+    s, w, n, e = ov["bounds"]
+    with Image.open(ov["imagem_path"]) as img:
+        largura, altura = img.size
+    # Até 1 pixel fora (oeste/norte) o int() trunca para o pixel 0
+    lats = np.full(50, (s + n) / 2)
+    lons = w - np.linspace(0.0, 1.5, 50) * (e - w) / largura
+    lats = np.concatenate([lats, n + np.linspace(0.0, 1.5, 50) * (n - s) / altura])
+    lons = np.concatenate([lons, np.full(50, (w + e) / 2)])
+    np.testing.assert_array_equal(
+        analysis_service._cobertura_pontos(lats, lons, [ov], job_id=job_id),
+        analysis_service._cobertura_pontos(lats, lons, [ov]),
+    )
@@ -0,0 +1,62 @@
+# backend/tests/test_propagation_service.py
+from math import log10, sqrt
+
+import numpy as np
+import pytest
+
+from backend.services import propagation_service
+
+PASSO_M = 100.0
+N_PASSOS = 10
+H_TX_ABS = 10.0
+RX_ALT = 10.0
+LAMBDA_M = 299.792458 / 1000.0  # 1 GHz
+
+
+def _curvatura(d: float) -> float:
+    return d * d / (2.0 * propagation_service._RAIO_TERRA_EFETIVO_M)
+
+
+def _perda_gume_esperada(i_obst: int, h_obst: float, i_rx: int) -> float:
+    """Gume de faca único calculado à mão: altura sobre a visada, ν de Fresnel e J(ν) da P.526."""
+    d1 = (i_obst + 1) * PASSO_M
+    d = (i_rx + 1) * PASSO_M
+    d2 = d - d1
+    solo_obst = h_obst - _curvatura(d1)
+    h_rx_abs = -_curvatura(d) + RX_ALT
+    visada = H_TX_ABS + (h_rx_abs - H_TX_ABS) * d1 / d
+    h = solo_obst - visada
+    v = h * sqrt(2.0 * d / (LAMBDA_M * d1 * d2))
+    return 6.9 + 20.0 * log10(sqrt((v - 0.1) ** 2 + 1.0) + v - 0.1)
+
+
+def _perdas(i_obst: int, h_obst: float) -> np.ndarray:
+    terreno = np.zeros((1, N_PASSOS), dtype=np.float32)
+    terreno[0, i_obst] = h_obst
+    return propagation_service._perdas_por_raio(terreno, PASSO_M, H_TX_ABS, RX_ALT, LAMBDA_M)[0]
+
+
+@pytest.mark.parametrize("i_obst", [4, 8])
+def test_gume_unico_confere_com_calculo_manual(i_obst):
+    perdas = _perdas(i_obst, 30.0)
+    i_rx = N_PASSOS - 1
+    assert perdas[i_rx] == pytest.approx(_perda_gume_esperada(i_obst, 30.0, i_rx), abs=0.01)
+
+
+def test_obstaculo_imediatamente_antes_do_receptor_difrata():
+    perdas = _perdas(8, 30.0)
+    assert perdas[9] > 6.0
+
+
+def test_sem_obstaculo_sem_perda():
+    terreno = np.zeros((3, N_PASSOS), dtype=np.float32)
+    perdas = propagation_service._perdas_por_raio(terreno, PASSO_M, H_TX_ABS, RX_ALT, LAMBDA_M)
+    assert np.all(perdas == 0.0)
+
+
+def test_perda_difracao_gume_valores_de_referencia():
+    # J(0) ≈ 6 dB (gume rasante); abaixo de ν = -0.78 não há perda.
+    perdas = propagation_service.perda_difracao_gume(np.array([0.0, -1.0, 2.4]))
+    assert perdas[0] == pytest.approx(6.0, abs=0.1)
+    assert perdas[1] == 0.0
+    assert perdas[2] == pytest.approx(20.6, abs=0.2)
@@ -0,0 +1,40 @@
+# backend/tests/test_signal_palette.py
+import numpy as np
+import pytest
+
+from backend.config import settings
+from backend.services import signal_palette
+from backend.services.signal_palette import SEM_SINAL, SignalGrid
+
+
+@pytest.mark.parametrize("col", sorted(signal_palette.PALETAS))
+def test_colorir_e_decodificar_recupera_a_faixa(col):
+    paleta = signal_palette.paleta(col)
+    nivel = np.linspace(-50.0, -120.0, 701, dtype=np.float32).reshape(1, -1)
+    indices = paleta.indices(paleta.colorir(nivel), settings.SIM_ALPHA_THRESHOLD)[0]
+
+    for v, i in zip(nivel[0].tolist(), indices.tolist()):
+        acima = np.flatnonzero(paleta.niveis <= v)
+        assert i == (int(acima[0]) if acima.size else SEM_SINAL), (col, v)
+
+
+def test_transparente_e_cor_desconhecida_sem_sinal():
+    paleta = signal_palette.paleta("IRRICONTRO.dBm")
+    rgba = np.array([[[0, 255, 51, 0], [255, 0, 255, 255], [0, 255, 51, 255], [27, 177, 107, 255]]], dtype=np.uint8)
+    np.testing.assert_array_equal(paleta.indices(rgba, settings.SIM_ALPHA_THRESHOLD)[0], [SEM_SINAL, SEM_SINAL, 0, 3])
+
+
+def test_grade_fora_da_imagem_e_niveis():
+    paleta = signal_palette.paleta("IRRIEUROPE.dBm")
+    grade = SignalGrid(np.array([[0, 4], [SEM_SINAL, 2]], dtype=np.int8), paleta)
+    px = np.array([0, 1, 0, 1, -1, 2, 0])
+    py = np.array([0, 0, 1, 1, 0, 0, 2])
+    np.testing.assert_array_equal(grade.indice_many(px, py), [0, 4, SEM_SINAL, 2, SEM_SINAL, SEM_SINAL, SEM_SINAL])
+    np.testing.assert_array_equal(
+        grade.nivel_many(px, py), np.array([-65.0, -105.0, np.nan, -85.0, np.nan, np.nan, np.nan], dtype=np.float32)
+    )
+
+
+def test_paleta_desconhecida():
+    assert signal_palette.paleta(None) is None
+    assert signal_palette.paleta("NAO_EXISTE.dBm") is None